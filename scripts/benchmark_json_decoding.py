@@ -0,0 +1,91 @@
+"""
+Benchmark of the decoding of JSON annotations (`parsing.decode_json_batch`) against the previous `ast.literal_eval`
+of each row done by `expand_json_column`.
+
+The committed evaluations only contain reports, so the annotations are the rubrics, criteria and brainstormed rubrics
+of the JSON files in `data/`, serialized as the annotators return them: mostly JSON, some inside a "```json" block and
+some as python literals.
+
+python scripts/benchmark_json_decoding.py --n_repeats=10
+"""
+
+import ast
+import json
+import random
+import time
+from pathlib import Path
+
+import fire
+
+from rubric_eval.parsing import decode_json_batch, log_decoding_failures
+
+DATA_DIR = Path(__file__).parents[1] / "data"
+ANNOTATION_COLUMNS = ["rubric", "criteria", "brainstormed_rubric", "evaluation"]
+
+
+def load_annotations(data_dir: Path = DATA_DIR) -> list:
+    """All the annotations (lists or dicts) of the annotation columns of the JSON files in `data_dir`."""
+    annotations = []
+    for path in sorted(data_dir.rglob("*.json")):
+        with open(path) as f:
+            records = json.load(f)
+        if isinstance(records, list):
+            annotations += [
+                r[col] for r in records if isinstance(r, dict) for col in ANNOTATION_COLUMNS if col in r and r[col]
+            ]
+    return annotations
+
+
+def serialize(annotations: list, proba_fenced: float = 0.05, proba_literal: float = 0.05, seed: int = 123) -> list:
+    random.seed(seed)
+    strings = []
+    for annotation in annotations:
+        u = random.random()
+        if u < proba_fenced:
+            strings.append(f"Here is the rubric:\n```json\n{json.dumps(annotation, indent=2)}\n```")
+        elif u < proba_fenced + proba_literal:
+            strings.append(repr(annotation))
+        else:
+            strings.append(json.dumps(annotation))
+    return strings
+
+
+def literal_eval_per_row(strings: list) -> list:
+    """Previous implementation."""
+    decoded = []
+    for s in strings:
+        try:
+            decoded.append(ast.literal_eval(s))
+        except Exception:
+            decoded.append("")
+    return decoded
+
+
+def main(n_repeats: int = 3):
+    annotations = load_annotations()
+    strings = serialize(annotations)
+    n_mb = sum(len(s) for s in strings) / 1e6
+    print(f"Decoding {len(strings)} annotations ({n_mb:.1f}MB) {n_repeats} times.")
+
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        decoded, reasons = decode_json_batch(strings)
+    time_batch = (time.perf_counter() - start) / n_repeats
+    n_failures = log_decoding_failures(reasons, "annotations")
+    print(f"decode_json_batch: {time_batch:.3f}s, {n_failures} failures")
+
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        decoded_per_row = literal_eval_per_row(strings)
+    time_per_row = (time.perf_counter() - start) / n_repeats
+    n_failures_per_row = sum(d == "" for d in decoded_per_row)
+    print(
+        f"ast.literal_eval per row: {time_per_row:.3f}s ({time_per_row / time_batch:.0f}x slower),"
+        f" {n_failures_per_row} failures (e.g. \"```json\" blocks, JSON true, false and null)"
+    )
+    assert decoded == annotations
+    print("decode_json_batch recovers all the annotations.")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,112 @@
+"""
+Benchmark of the rendering of the initial prompts of the summarizer (`prompts.format_examples`) against the previous
+`UnstructuredSummarizer._make_prompt`, which deep-copied the DataFrame, walked the rows with `iterrows` and grew the
+prompt with `+=`.
+
+The examples are the instructions and rubrics of `data/wildbench_hard`, with a rubric-based evaluation of each
+criterion whose feedback is the description of the performance level in the rubric. The prompts are the size of the
+default `approx_max_characters_to_summarize`.
+
+python scripts/benchmark_prompt_rendering.py --n_repeats=10
+"""
+
+import copy
+import json
+import random
+import time
+from pathlib import Path
+
+import fire
+import pandas as pd
+
+from rubric_eval import prompts
+
+RUBRICS_PATH = Path(__file__).parents[1] / "data" / "wildbench_hard" / "rubrics" / "gpt-4.1-nano-2025-04-14_rubrics.json"
+TEMPLATE = "Summarize the following evaluations.\n\n{to_format}\n\nNow generate the report."
+DELIMITER = "-----------------\n\n"
+COLUMNS = ["instruction", "category"]
+PERFORMANCES = ["excellent", "good", "fair", "poor"]
+
+
+def make_examples(seed: int = 123) -> pd.DataFrame:
+    random.seed(seed)
+    with open(RUBRICS_PATH) as f:
+        records = json.load(f)
+    rows = []
+    for record in records:
+        evaluation = []
+        for criterion in record["rubric"]:
+            performance = random.choice(PERFORMANCES)
+            description = criterion.get("performance_to_description", {}).get(performance, "")
+            evaluation.append(
+                dict(
+                    criterion=criterion["criterion"],
+                    feedback=description,
+                    performance=performance,
+                    score=4 - PERFORMANCES.index(performance),
+                    criteria_weight=criterion.get("weight"),
+                    rubric_description=description,
+                )
+            )
+        rows.append(dict(instruction=record["instruction"], category=record.get("category", ""), evaluation=evaluation))
+    return pd.DataFrame(rows)
+
+
+def make_prompt_per_row(df: pd.DataFrame, template: str) -> str:
+    """Previous implementation."""
+    df = copy.deepcopy(df.reset_index())
+    template = copy.deepcopy(template)
+    to_format = copy.deepcopy(DELIMITER)
+    for i, row in df.iterrows():
+        for col in COLUMNS:
+            value = row[col]
+            if not isinstance(value, str):
+                value = json.dumps(value, indent=2)
+            to_format += f"## {col.capitalize()} {i} \n{value}\n\n"
+        to_format += f"## Rubric-based evaluation {i} \n{json.dumps(row['evaluation'], indent=2)}\n\n"
+        to_format += DELIMITER
+    return template.format(to_format=to_format)
+
+
+def make_prompt(df: pd.DataFrame, template: str) -> str:
+    columns = [(col.capitalize(), df[col].tolist()) for col in COLUMNS]
+    columns.append(("Rubric-based evaluation", df["evaluation"].tolist()))
+    return prompts.fill_template(template, prompts.format_examples(columns, delimiter=DELIMITER), prefix=DELIMITER)
+
+
+def split_in_prompts(df: pd.DataFrame, max_characters: int) -> list[pd.DataFrame]:
+    n_chars = df["instruction"].str.len() + df["evaluation"].map(lambda e: len(json.dumps(e, indent=2)))
+    chunks, start, length = [], 0, 0
+    for i, n in enumerate(n_chars.tolist()):
+        if length + n > max_characters and i > start:
+            chunks.append(df.iloc[start:i])
+            start, length = i, 0
+        length += n
+    return chunks + [df.iloc[start:]]
+
+
+def main(n_repeats: int = 3, max_characters: int = 70000):
+    chunks = split_in_prompts(make_examples(), max_characters=max_characters)
+    n_mb = sum(len(make_prompt(chunk, TEMPLATE)) for chunk in chunks) / 1e6
+    print(f"Rendering {len(chunks)} prompts ({n_mb:.1f}MB) {n_repeats} times.")
+
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        rendered = [make_prompt(chunk, TEMPLATE) for chunk in chunks]
+    time_columns = (time.perf_counter() - start) / n_repeats
+    print(f"prompts.format_examples: {time_columns:.3f}s ({time_columns / len(chunks) * 1e3:.1f}ms per prompt)")
+
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        rendered_per_row = [make_prompt_per_row(chunk, TEMPLATE) for chunk in chunks]
+    time_per_row = (time.perf_counter() - start) / n_repeats
+    print(
+        f"iterrows and +=: {time_per_row:.3f}s ({time_per_row / len(chunks) * 1e3:.1f}ms per prompt,"
+        f" {time_per_row / time_columns:.1f}x slower)"
+    )
+    assert rendered == rendered_per_row
+    print("The prompts are identical.")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,77 @@
+"""
+Benchmark of the normalization of the rubrics (deduplication of the criteria, renormalization of the weights and
+extraction of the criteria) done by `make_df_rubrics`.
+
+python scripts/benchmark_rubric_normalization.py --n_rubrics=100000
+"""
+
+import itertools
+import random
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+import pandas as pd
+
+from rubric_eval.rubrics import normalize_rubrics
+
+RUBRICS_PATH = Path(__file__).parents[1] / "data" / "wildbench_hard" / "rubrics" / "gpt-4.1-nano-2025-04-14_rubrics.json"
+
+
+def normalize_rubrics_per_row(rubrics: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """Previous implementation, which builds two DataFrames per rubric and computes the sum of the weights for each
+    criterion."""
+
+    def percentage_scale_df_(df, columns):
+        for col in columns:
+            df[col] = df[col].apply(lambda x: x / df[col].sum()) * 100
+        return df
+
+    rubrics = rubrics.apply(
+        lambda x: pd.DataFrame(x).drop_duplicates(subset=["criterion"], keep="first").to_dict(orient="records")
+    )
+    rubrics = rubrics.apply(lambda x: percentage_scale_df_(pd.DataFrame(x), columns=["weight"]).to_dict(orient="records"))
+    criteria = rubrics.apply(lambda x: [c["criterion"] for c in x])
+    return rubrics, criteria
+
+
+def make_rubrics(n_rubrics: int, proba_duplicate: float = 0.1, seed: int = 123) -> pd.Series:
+    """Sample rubrics from the real rubrics, with some duplicated criteria as generated by bad models."""
+    random.seed(seed)
+    real_rubrics = pd.read_json(RUBRICS_PATH)["rubric"].tolist()
+    rubrics = []
+    for _ in range(n_rubrics):
+        rubric = [{"criterion": c["criterion"], "weight": c["weight"]} for c in random.choice(real_rubrics)]
+        if random.random() < proba_duplicate:
+            rubric.append(dict(random.choice(rubric), weight=random.randint(1, 50)))
+        rubrics.append(rubric)
+    return pd.Series(rubrics)
+
+
+def main(n_rubrics: int = 100_000, is_compare_per_row: bool = True):
+    rubrics = make_rubrics(n_rubrics)
+    n_criteria = rubrics.apply(len).sum()
+    print(f"Normalizing {n_rubrics} rubrics with {n_criteria} criteria.")
+
+    start = time.perf_counter()
+    normalized, criteria = normalize_rubrics(rubrics)
+    time_flat = time.perf_counter() - start
+    print(f"normalize_rubrics: {time_flat:.2f}s")
+
+    if is_compare_per_row:
+        start = time.perf_counter()
+        normalized_per_row, criteria_per_row = normalize_rubrics_per_row(rubrics)
+        time_per_row = time.perf_counter() - start
+        print(f"per row DataFrames: {time_per_row:.2f}s ({time_per_row / time_flat:.0f}x slower)")
+        # the weights can differ by rounding errors because the sums are not computed in the same order
+        flat = pd.DataFrame(itertools.chain.from_iterable(normalized))
+        flat_per_row = pd.DataFrame(itertools.chain.from_iterable(normalized_per_row))
+        assert criteria == criteria_per_row.tolist()
+        assert flat["criterion"].equals(flat_per_row["criterion"])
+        assert np.allclose(flat["weight"], flat_per_row["weight"], rtol=1e-12, atol=0, equal_nan=True)
+        print("Both implementations give the same rubrics.")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,309 @@
+"""Base annotators shared by all the RubricEval annotators (outputer, rubricators, and evaluators)."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence, Type, Union
+
+import pandas as pd
+from alpaca_eval import utils as ae_utils
+from alpaca_eval.annotators import base
+from alpaca_eval.types import AnyData, AnyPath
+
+from . import parsing
+from .artifacts import ArtifactStore
+from .completion_cache import CompletionCache, get_completion_cache, get_completion_key
+from .decoders import (
+    DEFAULT_MAX_CONCURRENCY,
+    _merge_completions,
+    _split_per_prompt_kwargs,
+    cached_completions,
+    get_provider_key,
+    get_provider_semaphore,
+    rate_limited_completions,
+)
+from .helpers import hash_content
+from .rate_limits import DEFAULT_LOCK_DIR, RateLimiter, get_rate_limiter
+
+__all__ = ["BaseAnnotatorJSON", "SingleAnnotator", "fan_out_completions"]
+
+
+class SingleAnnotator(base.SingleAnnotator):
+    __doc__ = (
+        base.SingleAnnotator.__doc__
+        + """
+    max_concurrency : int, optional
+        Maximum number of concurrent requests to the provider (base_url or completion function), shared by all the
+        annotators in the process. If given, each prompt is sent as a separate request from a pool of threads (see
+        `fan_out_completions`). If None, all the prompts of a chunk are sent to the completion function, which
+        parallelizes them itself (e.g. `num_procs` of `openai_completions`). Defaults to `RUBRIC_EVAL_MAX_CONCURRENCY`
+        if set, otherwise None.
+
+    requests_per_minute : int, optional
+        Requests per minute budget for the (provider, model_name), shared by all the annotators in the process.
+
+    tokens_per_minute : int, optional
+        Tokens per minute budget for the (provider, model_name), shared by all the annotators in the process. Each
+        request counts the approximate number of prompt tokens plus `max_tokens`.
+
+    rate_limit_lock_dir : Path, optional
+        Directory used to share the rate limits across processes. Defaults to `RUBRIC_EVAL_RATE_LIMIT_DIR`.
+
+    completion_cache : Path or CompletionCache, optional
+        Cache of the completions of each prompt, shared by all the annotators and the summarizer of the project (see
+        `get_completion_cache`). If "auto", uses the SQLite database `RUBRIC_EVAL_CACHE_DIR/completions.sqlite`. If
+        None, completions are not cached.
+    """
+    )
+
+    def __init__(
+        self,
+        *args,
+        max_concurrency: Optional[int] = DEFAULT_MAX_CONCURRENCY,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        rate_limit_lock_dir: Optional[AnyPath] = DEFAULT_LOCK_DIR,
+        completion_cache: Optional[Union[AnyPath, CompletionCache]] = "auto",
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.completion_cache = get_completion_cache(completion_cache)
+        # name of the completion function in the keys of the cache, before it is wrapped
+        self.fn_completions_name = getattr(self.fn_completions, "__name__", repr(self.fn_completions))
+        provider = get_provider_key(self.fn_completions, self.completions_kwargs)
+        rate_limiter = get_rate_limiter(
+            provider,
+            model_name=self.completions_kwargs.get("model_name", ""),
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            lock_dir=rate_limit_lock_dir,
+        )
+        if self.max_concurrency is not None:
+            self.fn_completions = partial(
+                fan_out_completions,
+                fn_completions=self.fn_completions,
+                max_concurrency=self.max_concurrency,
+                provider=provider,
+                rate_limiter=rate_limiter,
+            )
+        elif rate_limiter is not None:
+            self.fn_completions = partial(
+                rate_limited_completions, fn_completions=self.fn_completions, rate_limiter=rate_limiter
+            )
+        if self.completion_cache is not None:
+            self.fn_completions = partial(
+                cached_completions,
+                fn_completions=self.fn_completions,
+                cache=self.completion_cache,
+                fn_completions_name=self.fn_completions_name,
+            )
+
+    def _search_fn_completion_parser(self, name: str) -> Callable:
+        """Search for a completion parser by name, first in `parsing` (e.g. its faster and more tolerant `json_parser`)
+        and then in `alpaca_eval.completion_parsers`."""
+        if name in parsing.__all__:
+            return getattr(parsing, name)
+        return super()._search_fn_completion_parser(name)
+
+
+def fan_out_completions(
+    prompts: Sequence[str],
+    fn_completions: Callable,
+    max_concurrency: int,
+    provider: Optional[str] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    **completions_kwargs,
+) -> dict[str, list]:
+    """Get completions by sending each prompt as a separate request from a pool of up to `max_concurrency` threads.
+
+    The completion functions are blocking, so each request in flight uses a thread. The number of concurrent requests
+    is limited per provider (see `get_provider_key`) across the whole process, so annotators running in different
+    threads share the same limit.
+
+    Args:
+        prompts: Prompts to get completions for.
+        fn_completions: Completion function from `alpaca_eval.decoders`, e.g. `openai_completions`.
+        max_concurrency: Maximum number of concurrent requests to the provider.
+        provider: Key of the provider used for the concurrency limit. If None, uses `get_provider_key`.
+        rate_limiter: Optional rate limiter to wait on before sending each request.
+        completions_kwargs: kwargs for fn_completions. E.g. model_name, max_tokens, temperature.
+
+    Returns:
+        dict[str, list]: The same output as `fn_completions`, in the same order as `prompts`.
+    """
+    n_examples = len(prompts)
+    n_workers = min(max_concurrency, n_examples)
+    if n_workers <= 1:
+        return rate_limited_completions(prompts, fn_completions, rate_limiter=rate_limiter, **completions_kwargs)
+
+    provider = provider or get_provider_key(fn_completions, completions_kwargs)
+    semaphore = get_provider_semaphore(provider, max_concurrency)
+    complete_one = partial(_complete_one, fn_completions=fn_completions, semaphore=semaphore, rate_limiter=rate_limiter)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="rubric_eval_completions") as executor:
+        all_completions = list(
+            executor.map(complete_one, prompts, _split_per_prompt_kwargs(completions_kwargs, n_examples))
+        )
+    duration = time.time() - start
+    logging.info(f"Completed {n_examples} examples using {provider} in {duration:.1f} seconds.")
+
+    completions = _merge_completions(all_completions)
+    if "time_per_example" in completions:
+        # same as the underlying decoders: the time per example is the wall clock time divided by number of examples
+        completions["time_per_example"] = [duration / n_examples] * n_examples
+    return completions
+
+
+def _complete_one(
+    prompt: str,
+    kwargs: dict[str, Any],
+    fn_completions: Callable,
+    semaphore: threading.BoundedSemaphore,
+    rate_limiter: Optional[RateLimiter],
+) -> dict[str, Any]:
+    with semaphore:
+        return rate_limited_completions([prompt], fn_completions, rate_limiter=rate_limiter, **kwargs)
+
+
+class BaseAnnotatorJSON(base.BaseAnnotatorJSON):
+    __doc__ = (
+        base.BaseAnnotatorJSON.__doc__
+        + """
+    caching_path : Path, optional
+        Path to a JSON file of all the annotations, which is rewritten after each chunk. Defaults to None because the
+        annotations are reused from the artifact store and the completions from the completion cache (see
+        `SingleAnnotator`). Previous JSON caches can be imported with `import_json_cache`.
+
+    artifacts_dir : Path, optional
+        Directory of the content-addressed store of annotations (see `ArtifactStore`). Annotations are stored per
+        example under the hash of its primary keys, of the annotators configs (including the prompt templates) and of
+        the package versions, so identical work is reused across datasets and output paths. If "auto", uses
+        `RUBRIC_EVAL_CACHE_DIR/artifacts` (default `~/.cache/rubric_eval/artifacts`). If None, no store is used.
+
+    n_postprocessing_workers : int, optional
+        Number of processes used to post-process the annotations into DataFrames (e.g. `make_df_rubrics`). If None or
+        1, the post-processing runs in the current process. If -1, uses all the CPUs.
+    """
+    )
+    PACKAGES_FOR_ARTIFACT_KEYS = ("rubric_eval", "alpaca_eval")
+
+    def __init__(
+        self,
+        *args,
+        caching_path: Optional[AnyPath] = None,
+        artifacts_dir: Optional[AnyPath] = "auto",
+        n_postprocessing_workers: Optional[int] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, caching_path=caching_path, **kwargs)
+        self.n_postprocessing_workers = n_postprocessing_workers
+        self.artifact_store = ArtifactStore(artifacts_dir) if artifacts_dir is not None else None
+        self._packages_version = ae_utils.get_multi_package_version(self.PACKAGES_FOR_ARTIFACT_KEYS)
+        self.config_hash = self._get_config_hash()
+
+    def __call__(self, to_annotate: AnyData, **kwargs) -> list[dict[str, Any]]:
+        if self.artifact_store is None or len(to_annotate) == 0:
+            return super().__call__(to_annotate, **kwargs)
+
+        df_to_annotate = ae_utils.convert_to_dataframe(to_annotate)
+        keys = self.get_artifact_keys(df_to_annotate).tolist()
+        artifacts = self.artifact_store.get_many(keys) if self.is_avoid_reannotations else {}
+        is_missing = [k not in artifacts for k in keys]
+        n_missing = sum(is_missing)
+        logging.info(f"Reusing {len(keys) - n_missing} annotations from {self.artifact_store}, annotating {n_missing}.")
+
+        if n_missing > 0:
+            df_annotated = ae_utils.convert_to_dataframe(super().__call__(df_to_annotate[is_missing], **kwargs))
+            new_columns = [c for c in df_annotated.columns if c not in df_to_annotate.columns]
+            new_columns += [self.annotation_key] if self.annotation_key not in new_columns else []
+            new_artifacts = {
+                key: record
+                for key, record in zip(
+                    self.get_artifact_keys(df_annotated), df_annotated[new_columns].to_dict(orient="records")
+                )
+                if not _is_missing_value(record[self.annotation_key])
+            }
+            self.artifact_store.put_many(new_artifacts)
+            artifacts.update(new_artifacts)
+
+        return [
+            {**row, **artifacts.get(key, {self.annotation_key: None})}
+            for key, row in zip(keys, df_to_annotate.to_dict(orient="records"))
+        ]
+
+    def import_json_cache(self, path: AnyPath) -> int:
+        """Import the completions of a JSON cache of annotations (see `caching_path`, e.g. the previous
+        `annotations_seed0_configs.json` next to the configs) into the completion caches of the annotators. The
+        prompts are remade from the annotated examples, so the annotators should have the same configs and seed as
+        when the annotations were made. Only annotators with `batch_size=1` can be imported.
+
+        Returns:
+            int: The number of imported completions.
+        """
+        self.load_(path)
+        df_annotations = self.df_annotations
+        if df_annotations is None or len(df_annotations) == 0:
+            return 0
+
+        completion_column = self.completion_key
+        # other outputs of the completion functions that are kept in the annotations
+        columns = {k: f"{self.annotation_key}_{k}" for k in ("price_per_example", "time_per_example")}
+        columns = {k: c for k, c in columns.items() if c in df_annotations.columns}
+        n_imported = 0
+        for name, annotator in self.annotators.items():
+            df = df_annotations[df_annotations[self.annotator_column] == name]
+            if completion_column in df.columns:
+                df = df[~df[completion_column].isna()]
+            if len(df) == 0 or annotator.completion_cache is None:
+                continue
+            if annotator.batch_size != 1 or completion_column not in df.columns:
+                logging.warning(f"Cannot import the completions of {name} from {path}, skipping them.")
+                continue
+
+            df = df[self.available_fields_to_format + [completion_column] + list(columns.values())].copy()
+            for c in columns.values():
+                df[c] = pd.to_numeric(df[c], errors="coerce")
+            prompts, df = annotator._make_prompts(annotator._preprocess(df))
+            keys = [get_completion_key(p, annotator.fn_completions_name, annotator.completions_kwargs) for p in prompts]
+            completions = [
+                dict(completions=[row[completion_column]], **{k: [row[c]] for k, c in columns.items()})
+                for row in df.to_dict(orient="records")
+            ]
+            annotator.completion_cache.put_many(dict(zip(keys, completions)))
+            n_imported += len(keys)
+
+        logging.info(f"Imported {n_imported} completions from {path}.")
+        return n_imported
+
+    def get_artifact_keys(self, df: pd.DataFrame) -> pd.Series:
+        """Keys of the examples in the artifact store, see `hash_rows`."""
+        return self.hash_rows(df).apply(lambda row_hash: hash_content(self._packages_version, row_hash, length=32))
+
+    @property
+    def SingleAnnotator(self) -> Type[SingleAnnotator]:
+        return SingleAnnotator
+
+    def _get_config_hash(self) -> str:
+        """Hash of the configs and prompt templates of the annotators, i.e., changes whenever the annotations of the
+        same examples could change. Computed once in `__init__` and stored in `config_hash`."""
+        if isinstance(self.annotators_config, (str, Path)):
+            configs = ae_utils.load_configs(self.annotators_config)
+        else:
+            configs = self.annotators_config
+        prompt_templates = {name: annotator.prompt_template for name, annotator in self.annotators.items()}
+        return hash_content(self.__class__.__name__, configs, prompt_templates)
+
+    def hash_rows(self, df: pd.DataFrame) -> pd.Series:
+        """Hash of each example, computed from its primary keys and the configs of the annotator. Two examples with the
+        same hash would get the same annotation."""
+        config_hash = self.config_hash
+        columns = [df[k].tolist() if k in df.columns else [None] * len(df) for k in self.primary_keys]
+        return pd.Series([hash_content(config_hash, *values) for values in zip(*columns)], index=df.index, dtype=str)
+
+
+def _is_missing_value(value: Any) -> bool:
+    return value is None or (pd.api.types.is_scalar(value) and pd.isna(value))
@@ -0,0 +1,81 @@
+"""Content-addressed store of the annotations, shared across datasets, output paths and runs."""
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+from alpaca_eval.types import AnyPath
+
+__all__ = ["ArtifactStore", "get_cache_dir"]
+
+
+def get_cache_dir() -> Path:
+    """Return the directory where rubric_eval caches its artifacts: `RUBRIC_EVAL_CACHE_DIR` if set, otherwise
+    `~/.cache/rubric_eval`."""
+    cache_dir = os.environ.get("RUBRIC_EVAL_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "rubric_eval"
+    return Path(cache_dir)
+
+
+class ArtifactStore:
+    """Store of JSON records addressed by a content hash, e.g., the hash of the inputs of an annotation, the configs
+    of the annotator (including prompt templates) and the package versions. Each record is a separate file that is
+    written atomically, so the store can be shared by concurrent processes.
+
+    Args:
+        artifacts_dir: Directory of the store. If "auto", uses `get_cache_dir() / "artifacts"`.
+
+    Example:
+        >>> import tempfile
+        >>> store = ArtifactStore(tempfile.mkdtemp())
+        >>> store.put_many({"3b7ad7e22b2e4d4b": {"rubric": [{"criterion": "clarity"}]}})
+        >>> store.get_many(["3b7ad7e22b2e4d4b", "0000000000000000"])
+        {'3b7ad7e22b2e4d4b': {'rubric': [{'criterion': 'clarity'}]}}
+    """
+
+    def __init__(self, artifacts_dir: AnyPath = "auto"):
+        if artifacts_dir == "auto":
+            artifacts_dir = get_cache_dir() / "artifacts"
+        self.artifacts_dir = Path(artifacts_dir)
+
+    def __repr__(self) -> str:
+        return f"ArtifactStore({str(self.artifacts_dir)!r})"
+
+    def _get_path(self, key: str) -> Path:
+        return self.artifacts_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        """Return the record stored under `key` or None if there is none."""
+        try:
+            with open(self._get_path(key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring the corrupted artifact {self._get_path(key)}.")
+            return None
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, dict[str, Any]]:
+        """Return the records that are stored for the given keys."""
+        records = {}
+        for key in dict.fromkeys(keys):
+            record = self.get(key)
+            if record is not None:
+                records[key] = record
+        return records
+
+    def put(self, key: str, record: dict[str, Any]) -> None:
+        """Store a JSON serializable record under `key`."""
+        path = self._get_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=path.parent, suffix=".tmp", delete=False) as f:
+            json.dump(record, f, default=str)
+        os.replace(f.name, path)
+
+    def put_many(self, records: dict[str, dict[str, Any]]) -> None:
+        """Store multiple records, given as a dict mapping keys to records."""
+        for key, record in records.items():
+            self.put(key, record)
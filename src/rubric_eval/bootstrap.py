@@ -0,0 +1,147 @@
+"""Vectorized bootstrap of the mean scores: confidence intervals and stability of the rankings of models."""
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "get_bootstrap_counts",
+    "bootstrap_means",
+    "bootstrap_confidence_intervals",
+    "rank_stability",
+    "rank_stability_from_bootstrap",
+]
+
+N_BOOTSTRAP_RESAMPLES = 10_000
+CONFIDENCE_LEVEL = 0.95
+
+
+def get_bootstrap_counts(n_instructions: int, n_resamples: int = N_BOOTSTRAP_RESAMPLES, seed: int = 123) -> np.ndarray:
+    """Sample a (n_resamples, n_instructions) resampling index matrix and return how many times each instruction is
+    drawn in each resample, so that resampled sums are a single matrix product.
+
+    Example:
+        >>> counts = get_bootstrap_counts(5, n_resamples=3)
+        >>> counts.shape, counts.sum(axis=1).tolist()
+        ((3, 5), [5.0, 5.0, 5.0])
+    """
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, n_instructions, size=(n_resamples, n_instructions))
+    offsets = np.arange(n_resamples)[:, None] * n_instructions
+    counts = np.bincount((indices + offsets).ravel(), minlength=n_resamples * n_instructions)
+    return counts.reshape(n_resamples, n_instructions).astype(np.float64)
+
+
+def bootstrap_means(
+    scores: np.ndarray,
+    n_resamples: int = N_BOOTSTRAP_RESAMPLES,
+    seed: int = 123,
+    counts: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Bootstrap the mean of each row of a (n_models, n_instructions) score matrix, resampling the same instructions
+    for all the models (paired bootstrap). Missing scores (NaN) are ignored in the means.
+
+    Returns:
+        np.ndarray: (n_models, n_resamples) matrix of the resampled means.
+    """
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    if counts is None:
+        counts = get_bootstrap_counts(scores.shape[1], n_resamples=n_resamples, seed=seed)
+    is_valid = ~np.isnan(scores)
+    sums = np.where(is_valid, scores, 0.0) @ counts.T
+    n_valid = is_valid.astype(np.float64) @ counts.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums / n_valid
+
+
+def bootstrap_confidence_intervals(
+    scores: np.ndarray,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    n_resamples: int = N_BOOTSTRAP_RESAMPLES,
+    seed: int = 123,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap confidence intervals of the mean of each row of a (n_models, n_instructions) score matrix.
+
+    Returns:
+        tuple: Lower and upper bounds, each of shape (n_models,).
+
+    Example:
+        >>> lower, upper = bootstrap_confidence_intervals(np.arange(100).reshape(1, 100), n_resamples=1000)
+        >>> bool(lower[0] < 49.5 < upper[0])
+        True
+    """
+    means = bootstrap_means(scores, n_resamples=n_resamples, seed=seed)
+    alpha = (1 - confidence_level) / 2
+    lower, upper = np.nanquantile(means, [alpha, 1 - alpha], axis=1)
+    return lower, upper
+
+
+def rank_stability(
+    scores: pd.DataFrame,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    n_resamples: int = N_BOOTSTRAP_RESAMPLES,
+    seed: int = 123,
+) -> pd.DataFrame:
+    """Rank the models by mean score and estimate how stable the ranking is with a paired bootstrap over instructions.
+
+    Args:
+        scores: (models, instructions) score matrix, e.g. `df.pivot(index="model", columns="id", values="weighted_score")`.
+            Missing scores (NaN) are ignored.
+
+    Returns:
+        pd.DataFrame: Indexed by model and sorted by rank with columns "mean", "ci_lower", "ci_upper", "rank" (1 is
+        the best), "rank_ci_lower", "rank_ci_upper" and "proba_rank" (probability that the model holds its rank).
+
+    Example:
+        >>> scores = pd.DataFrame([[9, 8, 9, 7], [1, 2, 1, 3]], index=["a", "b"])
+        >>> rank_stability(scores, n_resamples=100)[["rank", "proba_rank"]]
+           rank  proba_rank
+        a     1         1.0
+        b     2         1.0
+    """
+    values = scores.to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        means = np.nanmean(values, axis=1)
+    boot_means = bootstrap_means(values, n_resamples=n_resamples, seed=seed)
+    return rank_stability_from_bootstrap(means, boot_means, index=scores.index, confidence_level=confidence_level)
+
+
+def rank_stability_from_bootstrap(
+    means: np.ndarray,
+    boot_means: np.ndarray,
+    index: Optional[Sequence[str]] = None,
+    confidence_level: float = CONFIDENCE_LEVEL,
+) -> pd.DataFrame:
+    """Same as `rank_stability` but from the means (n_models,) and the resampled means (n_models, n_resamples), e.g.
+    to mix paired bootstrap resamples with resamples drawn from the mean and SEM of models without per-instruction
+    scores."""
+    means = np.asarray(means, dtype=np.float64)
+    # rank 1 is the highest mean, NaN means are ranked last
+    ranks = _rank_descending(means[:, None])[:, 0]
+    boot_ranks = _rank_descending(boot_means)
+
+    alpha = (1 - confidence_level) / 2
+    with np.errstate(invalid="ignore"):
+        ci_lower, ci_upper = np.nanquantile(boot_means, [alpha, 1 - alpha], axis=1)
+    rank_ci_lower, rank_ci_upper = np.quantile(boot_ranks, [alpha, 1 - alpha], axis=1)
+    df_ranks = pd.DataFrame(
+        dict(
+            mean=means,
+            ci_lower=ci_lower,
+            ci_upper=ci_upper,
+            rank=ranks,
+            rank_ci_lower=rank_ci_lower.astype(int),
+            rank_ci_upper=rank_ci_upper.astype(int),
+            proba_rank=(boot_ranks == ranks[:, None]).mean(axis=1),
+        ),
+        index=index,
+    )
+    return df_ranks.sort_values("rank", kind="stable")
+
+
+def _rank_descending(means: np.ndarray) -> np.ndarray:
+    """Rank of each row (1 for the largest) in each column of a (n_models, n_resamples) matrix."""
+    order = np.argsort(-np.nan_to_num(means, nan=-np.inf), axis=0, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, means.shape[0] + 1)[:, None], axis=0)
+    return ranks
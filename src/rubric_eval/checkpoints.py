@@ -0,0 +1,197 @@
+"""Crash-safe checkpointing of the stages: finished rows are appended to a JSONL write-ahead file."""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pandas as pd
+from alpaca_eval import utils as ae_utils
+from alpaca_eval.types import AnyPath
+
+from .helpers import hash_content
+from .pipeline import AsyncArtifactWriter
+
+__all__ = [
+    "run_with_checkpoints",
+    "get_checkpoint_path",
+    "get_checkpoint_keys",
+    "load_checkpoint",
+    "append_to_checkpoint",
+]
+
+CHECKPOINT_KEY_COLUMN = "_checkpoint_key"
+
+
+def get_checkpoint_path(output_path: AnyPath) -> Path:
+    """Return the path of the write-ahead file of an output, e.g. `evaluations.partial.jsonl` for `evaluations.json`.
+
+    Example:
+        >>> get_checkpoint_path("results/evaluations.json").as_posix()
+        'results/evaluations.partial.jsonl'
+    """
+    return Path(output_path).with_suffix(".partial.jsonl")
+
+
+def get_checkpoint_keys(
+    df: pd.DataFrame, fn_hash_rows: Optional[Callable[[pd.DataFrame], pd.Series]] = None
+) -> pd.Series:
+    """Key of each row in the write-ahead file: the hash of the row (e.g. `annotator.hash_rows`, which hashes its
+    primary keys and configs) and its occurrence among the rows with the same hash. The keys don't depend on the
+    position of the rows, so they stay the same if rows are added or removed from the input.
+
+    Args:
+        df: Rows to key.
+        fn_hash_rows: Function returning the hash of each row. If None, hashes all the values of each row.
+
+    Example:
+        >>> get_checkpoint_keys(pd.DataFrame(dict(instruction=["q1", "q2", "q1"]))).str[-2:].tolist()
+        [':0', ':0', ':1']
+    """
+    if fn_hash_rows is None:
+        row_hashes = pd.Series([hash_content(*row) for row in df.itertuples(index=False)], index=df.index, dtype=str)
+    else:
+        row_hashes = fn_hash_rows(df).astype(str)
+    occurrences = row_hashes.groupby(row_hashes, sort=False).cumcount()
+    return row_hashes + ":" + occurrences.astype(str)
+
+
+def load_checkpoint(checkpoint_path: AnyPath) -> list[dict[str, Any]]:
+    """Load the rows of a write-ahead file. A truncated last line (crash while writing) is ignored."""
+    records = []
+    try:
+        with open(checkpoint_path, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return records
+
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            if i == len(lines) - 1:
+                logging.warning(f"Ignoring the last line of {checkpoint_path} which was only partially written.")
+            else:
+                raise
+    return records
+
+
+def append_to_checkpoint(checkpoint_path: AnyPath, df: pd.DataFrame) -> None:
+    """Append the rows of `df` to the write-ahead file and make sure that they are on disk before returning."""
+    if df.empty:
+        return
+    lines = df.to_json(orient="records", lines=True)
+    with open(checkpoint_path, "a") as f:
+        f.write(lines if lines.endswith("\n") else lines + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_with_checkpoints(
+    df_input: pd.DataFrame,
+    fn_from_df: Callable[[pd.DataFrame], pd.DataFrame],
+    output_path: AnyPath,
+    is_resume: bool = False,
+    chunksize: int = 64,
+    fn_postprocess: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    writer: Optional[AsyncArtifactWriter] = None,
+    fn_hash_rows: Optional[Callable[[pd.DataFrame], pd.Series]] = None,
+) -> pd.DataFrame:
+    """Apply a stage to chunks of `df_input`, appending the finished rows of each chunk to a JSONL write-ahead file
+    next to `output_path`. Once all the chunks are done, the output is written to `output_path` as a JSON list (same
+    format as before) and the write-ahead file is removed.
+
+    Args:
+        df_input: Input of the stage.
+        fn_from_df: Stage to apply, e.g. `partial(evaluate_from_df, evaluator=evaluator)`. Should return one row per
+            input row that succeeded and keep the columns of the input.
+        output_path: Path of the final JSON output.
+        is_resume: Whether to reload the rows of an existing write-ahead file and only run the remaining rows. Rows
+            are matched by content (see `get_checkpoint_keys`), so the input may have changed since the crash: the
+            finished rows that are not in the input anymore are dropped. If False, any existing write-ahead file is
+            discarded.
+        chunksize: Number of rows to process before appending them to the write-ahead file.
+        fn_postprocess: Optional function applied to all the finished rows before writing the final output.
+        writer: If given, the final output is written (and the write-ahead file removed) in the background.
+        fn_hash_rows: Function returning the hash of each input row, e.g. `annotator.hash_rows`. If None, hashes all
+            the values of each row.
+
+    Example:
+        >>> import tempfile
+        >>> path = Path(tempfile.mkdtemp()) / "outputs.json"
+        >>> seen, crash_on = [], {"q3"}
+        >>> def shout(df):
+        ...     if df["instruction"].isin(crash_on).any():
+        ...         raise RuntimeError("crash")
+        ...     seen.extend(df["instruction"])
+        ...     return df.assign(output=df["instruction"].str.upper())
+        >>> run_with_checkpoints(pd.DataFrame(dict(instruction=["q1", "q2", "q3"])), shout, path, chunksize=2)
+        Traceback (most recent call last):
+        ...
+        RuntimeError: crash
+        >>> crash_on.clear()
+        >>> df_input = pd.DataFrame(dict(instruction=["q0", "q1", "q2", "q3"]))  # a row was added before resuming
+        >>> run_with_checkpoints(df_input, shout, path, is_resume=True, chunksize=2)["output"].tolist()
+        ['Q0', 'Q1', 'Q2', 'Q3']
+        >>> seen
+        ['q1', 'q2', 'q0', 'q3']
+    """
+    output_path = Path(output_path)
+    checkpoint_path = get_checkpoint_path(output_path)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+
+    df_input = df_input.reset_index(drop=True)
+    df_input[CHECKPOINT_KEY_COLUMN] = get_checkpoint_keys(df_input, fn_hash_rows=fn_hash_rows)
+    key_to_position = {key: i for i, key in enumerate(df_input[CHECKPOINT_KEY_COLUMN])}
+
+    # the finished rows are kept in memory, the write-ahead file is only read to resume a previous run
+    df_outs = []
+    if is_resume:
+        df_previous = pd.DataFrame(load_checkpoint(checkpoint_path))
+        if CHECKPOINT_KEY_COLUMN in df_previous.columns:
+            df_outs.append(df_previous)
+            df_input = df_input[~df_input[CHECKPOINT_KEY_COLUMN].isin(df_previous[CHECKPOINT_KEY_COLUMN])]
+        logging.info(
+            f"Resuming from {checkpoint_path}: {len(key_to_position) - len(df_input)} rows are done,"
+            f" {len(df_input)} remaining."
+        )
+    elif checkpoint_path.exists():
+        logging.warning(f"Discarding the previous checkpoint {checkpoint_path}. Use `is_resume=True` to resume it.")
+        checkpoint_path.unlink()
+
+    for df_chunk in ae_utils.dataframe_chunk_generator(df_input, chunksize, tqdm_desc=f"Chunks of {output_path.name}"):
+        df_out = fn_from_df(df_chunk.copy())
+        append_to_checkpoint(checkpoint_path, df_out)
+        df_outs.append(df_out)
+
+    df_output = pd.concat(df_outs, ignore_index=True) if len(df_outs) > 0 else pd.DataFrame()
+    if not df_output.empty:
+        # restore the order of the input and drop the finished rows that are not in the input anymore
+        positions = df_output[CHECKPOINT_KEY_COLUMN].map(key_to_position)
+        n_stale = int(positions.isna().sum())
+        if n_stale > 0:
+            logging.warning(f"Dropping {n_stale} rows of {checkpoint_path} that are not in the input anymore.")
+        df_output = (
+            df_output.assign(_position=positions)
+            .dropna(subset=["_position"])
+            .drop_duplicates(subset=CHECKPOINT_KEY_COLUMN, keep="last")
+            .sort_values("_position", kind="stable")
+            .drop(columns=[CHECKPOINT_KEY_COLUMN, "_position"])
+            .reset_index(drop=True)
+        )
+
+    if fn_postprocess is not None:
+        df_output = fn_postprocess(df_output)
+
+    if writer is None:
+        _save_output(df_output, output_path, checkpoint_path)
+    else:
+        writer.submit(_save_output, df_output.copy(), output_path, checkpoint_path)
+    return df_output
+
+
+def _save_output(df_output: pd.DataFrame, output_path: Path, checkpoint_path: Path):
+    df_output.to_json(output_path, orient="records", indent=4)
+    checkpoint_path.unlink(missing_ok=True)
@@ -0,0 +1,109 @@
+"""Local near-duplicate clustering of short texts (e.g. the feedback of the evaluations) with MinHash and LSH."""
+import re
+import zlib
+from typing import Hashable, Optional, Sequence
+
+import numpy as np
+
+__all__ = ["minhash_signatures", "cluster_near_duplicates"]
+
+N_PERMUTATIONS = 64
+N_BANDS = 16
+SIMILARITY_THRESHOLD = 0.5
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+# prime larger than the 32 bits hashes of the shingles, the permutations are (a * x + b) % _PRIME
+_PRIME = (1 << 32) + 15
+
+
+def get_shingles(text: str) -> set[str]:
+    """Lowercased words of at least 3 characters of the text, which are the shingles of the Jaccard similarity."""
+    return set(_WORD_PATTERN.findall(text.lower()))
+
+
+def minhash_signatures(texts: Sequence[str], n_permutations: int = N_PERMUTATIONS, seed: int = 123) -> np.ndarray:
+    """MinHash signatures of the texts: the fraction of equal values between two signatures is an estimate of the
+    Jaccard similarity of their shingles (see `get_shingles`). All the shingles of all the texts are hashed at once.
+
+    Returns:
+        np.ndarray: (n_texts, n_permutations) signatures. Texts without shingles have a signature of `_PRIME`.
+    """
+    all_shingles = [get_shingles(text) for text in texts]
+    lengths = np.array([len(shingles) for shingles in all_shingles], dtype=np.int64)
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingles in all_shingles for shingle in shingles),
+        dtype=np.uint64,
+        count=int(lengths.sum()),
+    )
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=n_permutations, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=n_permutations, dtype=np.uint64)
+    signatures = np.full((len(texts), n_permutations), _PRIME, dtype=np.uint64)
+    if len(hashes) == 0:
+        return signatures
+
+    permuted = (hashes[:, None] * a + b) % np.uint64(_PRIME)
+    has_shingles = lengths > 0
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[has_shingles]
+    signatures[has_shingles] = np.minimum.reduceat(permuted, starts, axis=0)
+    return signatures
+
+
+def cluster_near_duplicates(
+    texts: Sequence[str],
+    groups: Optional[Sequence[Hashable]] = None,
+    similarity_threshold: float = SIMILARITY_THRESHOLD,
+    n_permutations: int = N_PERMUTATIONS,
+    n_bands: int = N_BANDS,
+    seed: int = 123,
+) -> np.ndarray:
+    """Cluster the texts whose estimated Jaccard similarity to the first text of the cluster (its representative) is
+    at least `similarity_threshold`. Texts are not compared to all the representatives but only to the ones with the
+    same MinHash values on one of `n_bands` bands (LSH), and a text that is not similar to any of them starts a new
+    cluster. Texts are only clustered within the same group.
+
+    Returns:
+        np.ndarray: The cluster of each text, numbered by first appearance. The first text of each cluster is its
+        representative.
+
+    Example:
+        >>> texts = ["The response is clear and well organized.", "The response is well organized and clear!",
+        ...          "The code does not handle empty inputs.", "The response is clear and well organized."]
+        >>> cluster_near_duplicates(texts).tolist()
+        [0, 0, 1, 0]
+        >>> cluster_near_duplicates(texts, groups=["good", "poor", "poor", "good"]).tolist()
+        [0, 1, 2, 0]
+    """
+    if n_permutations % n_bands != 0:
+        raise ValueError(f"n_permutations={n_permutations} should be a multiple of n_bands={n_bands}.")
+    if groups is None:
+        groups = [None] * len(texts)
+
+    signatures = minhash_signatures(texts, n_permutations=n_permutations, seed=seed)
+    band_size = n_permutations // n_bands
+    buckets = {}  # (group, band, band values) -> representatives
+    clusters = np.empty(len(texts), dtype=np.int64)
+    representatives = []
+    for i, (text, group, signature) in enumerate(zip(texts, groups, signatures)):
+        band_keys = [
+            (group, band, signature[band * band_size : (band + 1) * band_size].tobytes()) for band in range(n_bands)
+        ]
+        if signature[0] == _PRIME:
+            # texts without shingles are only clustered with identical texts
+            band_keys = [(group, -1, text)]
+
+        candidates = {c for key in band_keys for c in buckets.get(key, ())}
+        best_cluster, best_similarity = None, similarity_threshold
+        for c in sorted(candidates):
+            similarity = (signatures[representatives[c]] == signature).mean()
+            if similarity >= best_similarity and (best_cluster is None or similarity > best_similarity):
+                best_cluster, best_similarity = c, similarity
+
+        if best_cluster is None:
+            best_cluster = len(representatives)
+            representatives.append(i)
+            for key in band_keys:
+                buckets.setdefault(key, []).append(best_cluster)
+        clusters[i] = best_cluster
+    return clusters
@@ -0,0 +1,159 @@
+"""Cache of the completions shared by all the annotators and the summarizer, stored in a single SQLite database."""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional, Sequence, Union
+
+from alpaca_eval.types import AnyPath
+
+from .artifacts import get_cache_dir
+
+__all__ = ["CompletionCache", "get_completion_cache", "get_completion_key"]
+
+DEFAULT_COMPLETION_CACHE_NAME = "completions.sqlite"
+
+# keys per `SELECT ... IN (...)`, below the default maximum number of variables of old SQLite versions
+_MAX_KEYS_PER_QUERY = 900
+_COMPLETION_CACHES: dict[str, "CompletionCache"] = {}
+_COMPLETION_CACHES_LOCK = threading.Lock()
+
+
+def get_completion_key(prompt: str, fn_completions: str, completions_kwargs: dict[str, Any]) -> str:
+    """Key of the completion of a prompt: the hash of the arguments that `alpaca_eval.decoders.cache_completions`
+    uses as key of its JSON caches, so those caches can be imported (see `CompletionCache.import_json`).
+
+    Example:
+        >>> get_completion_key("Say hi", "openai_completions", dict(model_name="gpt-4o-2024-08-06"))[:16]
+        'd6b172509a9725ad'
+    """
+    hashable_args = json.dumps(
+        dict(prompt=prompt, fn_completions=fn_completions, completions_kwargs=completions_kwargs),
+        sort_keys=True,
+        default=str,
+    )
+    return _hash_json_key(hashable_args)
+
+
+def _hash_json_key(hashable_args: str) -> str:
+    return hashlib.sha256(hashable_args.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Key-value store of the completions in a SQLite database in WAL mode: lookups use the primary key index, readers
+    don't block writers and the database can be shared by the threads and processes of a project (but not over a
+    network file system). Each thread uses its own connection and each `put_many` is a single transaction.
+
+    The values are the outputs of the completion functions for a single prompt, e.g. `{"completions": ["..."],
+    "price_per_example": [0.01], "time_per_example": [1.2]}`.
+
+    Args:
+        path: Path to the database. If "auto", uses `get_cache_dir() / "completions.sqlite"`, so setting
+            `RUBRIC_EVAL_CACHE_DIR` gives one cache per project.
+        timeout: Seconds to wait for the lock of the database held by another writer.
+
+    Example:
+        >>> import tempfile
+        >>> cache = CompletionCache(Path(tempfile.mkdtemp()) / "completions.sqlite")
+        >>> cache.put_many({"d6b172509a9725ad": {"completions": ["Hi!"], "price_per_example": [0.0]}})
+        >>> cache.get_many(["d6b172509a9725ad", "0000000000000000"])
+        {'d6b172509a9725ad': {'completions': ['Hi!'], 'price_per_example': [0.0]}}
+    """
+
+    def __init__(self, path: AnyPath = "auto", timeout: float = 60.0):
+        if path == "auto":
+            path = get_cache_dir() / DEFAULT_COMPLETION_CACHE_NAME
+        self.path = Path(path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __repr__(self) -> str:
+        return f"CompletionCache({str(self.path)!r})"
+
+    def __len__(self) -> int:
+        return self._get_connection().execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Connection of the current thread, reopened in forked processes which can't reuse the parent's."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit mode, the transactions of the writes are explicit
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        """Return the completion stored under `key` or None if there is none."""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, dict[str, Any]]:
+        """Return the completions that are stored for the given keys."""
+        connection = self._get_connection()
+        keys = list(dict.fromkeys(keys))
+        completions = {}
+        for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+            batch = keys[start : start + _MAX_KEYS_PER_QUERY]
+            rows = connection.execute(
+                f"SELECT key, value FROM completions WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            completions.update((key, json.loads(value)) for key, value in rows)
+        return completions
+
+    def put(self, key: str, completion: dict[str, Any]) -> None:
+        """Store a JSON serializable completion under `key`."""
+        self.put_many({key: completion})
+
+    def put_many(self, completions: dict[str, dict[str, Any]]) -> None:
+        """Store multiple completions, given as a dict mapping keys to completions, in a single transaction."""
+        if len(completions) == 0:
+            return
+        rows = [(key, json.dumps(completion, default=str)) for key, completion in completions.items()]
+        connection = self._get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO completions (key, value) VALUES (?, ?)", rows)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def import_json(self, json_path: AnyPath) -> int:
+        """Import a JSON cache of `alpaca_eval.decoders.cache_completions` (e.g. the previous `cache.json` of the
+        summarizers), which maps the JSON dumped arguments of each completion to the completion.
+
+        Returns:
+            int: The number of imported completions.
+        """
+        with open(json_path, "r") as f:
+            json_cache = json.load(f)
+        if not isinstance(json_cache, dict):
+            raise ValueError(f"{json_path} is not a cache of completions, which should be a JSON object.")
+        self.put_many({_hash_json_key(hashable_args): completion for hashable_args, completion in json_cache.items()})
+        logging.info(f"Imported {len(json_cache)} completions from {json_path} to {self}.")
+        return len(json_cache)
+
+
+def get_completion_cache(cache: Union[AnyPath, CompletionCache, Any, None] = "auto") -> Optional[Any]:
+    """Return the completion cache given to an annotator or a summarizer: None (no cache), a path to a database (or
+    "auto" for the default one) whose `CompletionCache` is shared by the whole process, or any object with the same
+    `get_many` and `put_many` methods (e.g. an `ArtifactStore`), which is returned as is.
+    """
+    if cache is None or not isinstance(cache, (str, os.PathLike)):
+        return cache
+    path = get_cache_dir() / DEFAULT_COMPLETION_CACHE_NAME if cache == "auto" else Path(cache)
+    with _COMPLETION_CACHES_LOCK:
+        key = str(path.resolve())
+        if key not in _COMPLETION_CACHES:
+            _COMPLETION_CACHES[key] = CompletionCache(path)
+        return _COMPLETION_CACHES[key]
@@ -0,0 +1,200 @@
+"""Wrappers around the alpaca_eval completion functions."""
+import logging
+import os
+import threading
+from typing import Any, Callable, Optional, Sequence, Union
+
+from alpaca_eval.decoders import get_fn_completions
+from alpaca_eval.types import AnyPath
+
+from .completion_cache import CompletionCache, get_completion_cache, get_completion_key
+from .rate_limits import RateLimiter, estimate_n_tokens_of_request
+
+__all__ = [
+    "rate_limited_completions",
+    "cache_completions",
+    "cached_completions",
+    "get_provider_key",
+    "get_provider_semaphore",
+]
+
+# None keeps the default parallelism, i.e. the annotators send all the prompts of a chunk to the completion function
+# (which parallelizes them with its own `num_procs`) and the summarizer sends its requests sequentially
+DEFAULT_MAX_CONCURRENCY = (
+    int(os.environ["RUBRIC_EVAL_MAX_CONCURRENCY"]) if os.environ.get("RUBRIC_EVAL_MAX_CONCURRENCY") else None
+)
+
+# semaphores are process-wide so that all the annotators that hit the same provider share the same limit
+_PROVIDER_SEMAPHORES: dict[str, threading.BoundedSemaphore] = {}
+_PROVIDER_SEMAPHORES_LOCK = threading.Lock()
+
+
+def get_provider_key(fn_completions: Callable | str, completions_kwargs: dict[str, Any]) -> str:
+    """Return the key identifying the provider that will be queried, i.e., the base_url if given or the name of the
+    completion function.
+
+    Example:
+        >>> get_provider_key("openai_completions", dict(client_kwargs=dict(base_url="https://api.together.xyz")))
+        'https://api.together.xyz'
+        >>> get_provider_key("openai_completions", dict(model_name="gpt-4.1-2025-04-14"))
+        'openai_completions'
+    """
+    client_kwargs = completions_kwargs.get("client_kwargs") or {}
+    if client_kwargs.get("base_url"):
+        return str(client_kwargs["base_url"])
+    if isinstance(fn_completions, str):
+        return fn_completions
+    return getattr(fn_completions, "__name__", repr(fn_completions))
+
+
+def get_provider_semaphore(provider: str, max_concurrency: int) -> threading.BoundedSemaphore:
+    """Return the semaphore limiting the number of concurrent requests to a provider. The limit is set by the first
+    caller for a given provider."""
+    with _PROVIDER_SEMAPHORES_LOCK:
+        if provider not in _PROVIDER_SEMAPHORES:
+            logging.info(f"Limiting the number of concurrent requests to `{provider}` to {max_concurrency}.")
+            _PROVIDER_SEMAPHORES[provider] = threading.BoundedSemaphore(max_concurrency)
+        return _PROVIDER_SEMAPHORES[provider]
+
+
+def rate_limited_completions(
+    prompts: Sequence[str],
+    fn_completions: Callable,
+    rate_limiter: Optional[RateLimiter] = None,
+    **completions_kwargs,
+) -> dict[str, list]:
+    """Call `fn_completions` after waiting for the rate limiter to have enough budget for all the prompts."""
+    if rate_limiter is not None:
+        for prompt in prompts:
+            rate_limiter.acquire(estimate_n_tokens_of_request(prompt, completions_kwargs))
+    return fn_completions(prompts=prompts, **completions_kwargs)
+
+
+def cache_completions(
+    prompts: Sequence[str],
+    fn_completions: str,
+    cache: Union[AnyPath, CompletionCache, Any] = "auto",
+    rate_limiter: Optional[RateLimiter] = None,
+    **completions_kwargs,
+) -> list[dict[str, Any]]:
+    """Same as `alpaca_eval.decoders.cache.cache_completions`, but the completions are stored in a completion cache
+    shared with the annotators (see `CompletionCache`), only the prompts that are not cached are sent through the rate
+    limiter and each completion is stored as soon as it is received.
+
+    Args:
+        prompts: Prompts to get completions for.
+        fn_completions: Name of the function in `alpaca_eval.decoders` to use for decoding the output.
+        cache: The completion cache, see `get_completion_cache`.
+        rate_limiter: Optional rate limiter to wait on before sending each uncached prompt.
+        completions_kwargs: kwargs for fn_completions. E.g. model_name, max_tokens, temperature.
+    """
+    assert isinstance(fn_completions, str), "fn_completions must be a string to be hashable."
+    cache = get_completion_cache(cache)
+    keys = [get_completion_key(prompt, fn_completions, completions_kwargs) for prompt in prompts]
+    # the completions are done without any lock, so that concurrent callers (e.g. summarizer threads) don't wait on
+    # each other. The database handles the concurrent reads and writes.
+    completions = cache.get_many(keys)
+    fn_completions_callable = get_fn_completions(fn_completions)
+    for prompt, key in zip(prompts, keys):
+        if key not in completions:
+            completions[key] = rate_limited_completions(
+                [prompt], fn_completions_callable, rate_limiter=rate_limiter, **completions_kwargs
+            )
+            cache.put_many({key: completions[key]})
+
+    return [completions[key] for key in keys]
+
+
+def cached_completions(
+    prompts: Sequence[str],
+    fn_completions: Callable,
+    cache: Any,
+    fn_completions_name: Optional[str] = None,
+    **completions_kwargs,
+) -> dict[str, list]:
+    """Call `fn_completions` only on the prompts whose completions are not in the cache and store the new ones. The
+    completions are stored per prompt under the same keys as `cache_completions`, so all the annotators and the
+    summarizer share the cache.
+
+    Args:
+        prompts: Prompts to get completions for.
+        fn_completions: Completion function, e.g. `openai_completions` or `annotators.fan_out_completions` wrapping
+            it. It is called once with all the uncached prompts.
+        cache: Completion cache, e.g. a `CompletionCache`.
+        fn_completions_name: Name of the completion function in the keys. If None, uses `fn_completions.__name__`.
+        completions_kwargs: kwargs for fn_completions. E.g. model_name, max_tokens, temperature.
+
+    Returns:
+        dict[str, list]: The same output as `fn_completions`, in the same order as `prompts`.
+    """
+    fn_completions_name = fn_completions_name or getattr(fn_completions, "__name__", repr(fn_completions))
+    all_kwargs = _split_per_prompt_kwargs(completions_kwargs, len(prompts))
+    keys = [get_completion_key(prompt, fn_completions_name, kw) for prompt, kw in zip(prompts, all_kwargs)]
+    completions = cache.get_many(keys)
+
+    key_to_idx = {}  # first prompt of each uncached key, duplicated prompts are only completed once
+    for i, key in enumerate(keys):
+        if key not in completions:
+            key_to_idx.setdefault(key, i)
+    idcs_to_complete = list(key_to_idx.values())
+    logging.info(f"Reusing {len(prompts) - len(idcs_to_complete)} cached completions, completing the others.")
+
+    if len(idcs_to_complete) > 0:
+        kwargs = dict(completions_kwargs)
+        max_tokens = completions_kwargs.get("max_tokens")
+        if isinstance(max_tokens, (list, tuple)) and len(max_tokens) == len(prompts):
+            kwargs["max_tokens"] = [max_tokens[i] for i in idcs_to_complete]
+        new_completions = _split_completions(
+            fn_completions(prompts=[prompts[i] for i in idcs_to_complete], **kwargs), len(idcs_to_complete)
+        )
+        new_completions = {keys[i]: c for i, c in zip(idcs_to_complete, new_completions)}
+        cache.put_many(new_completions)
+        completions.update(new_completions)
+
+    return _merge_completions([completions[key] for key in keys])
+
+
+def _split_per_prompt_kwargs(completions_kwargs: dict[str, Any], n_examples: int) -> list[dict[str, Any]]:
+    """Split the kwargs that are given per prompt (e.g. `max_tokens` as a list) into one kwargs dict per prompt."""
+    all_kwargs = [dict(completions_kwargs) for _ in range(n_examples)]
+    max_tokens = completions_kwargs.get("max_tokens")
+    if isinstance(max_tokens, (list, tuple)) and len(max_tokens) == n_examples:
+        for kwargs, curr_max_tokens in zip(all_kwargs, max_tokens):
+            kwargs["max_tokens"] = curr_max_tokens
+    return all_kwargs
+
+
+def _merge_completions(all_completions: list[dict[str, Any]]) -> dict[str, list]:
+    """Merge the outputs of single-prompt calls to `fn_completions` into the output of a single call.
+
+    Example:
+        >>> _merge_completions([dict(completions=["a"], price_per_example=[1]), dict(completions=["b"])])
+        {'completions': ['a', 'b'], 'price_per_example': [1, None]}
+    """
+    keys = []
+    for completions in all_completions:
+        keys += [k for k in completions.keys() if k not in keys]
+
+    merged = {k: [] for k in keys}
+    for completions in all_completions:
+        for k in keys:
+            value = completions.get(k, [None])
+            merged[k].extend(value if isinstance(value, (list, tuple)) else [value])
+    return merged
+
+
+def _split_completions(completions: dict[str, Any], n_examples: int) -> list[dict[str, list]]:
+    """Split the output of a call to `fn_completions` into the outputs of single-prompt calls, the inverse of
+    `_merge_completions`.
+
+    Example:
+        >>> _split_completions({'completions': ['a', 'b'], 'price_per_example': [1, None]}, 2)
+        [{'completions': ['a'], 'price_per_example': [1]}, {'completions': ['b'], 'price_per_example': [None]}]
+    """
+    return [
+        {
+            k: [v[i]] if isinstance(v, (list, tuple)) and len(v) == n_examples else v
+            for k, v in completions.items()
+        }
+        for i in range(n_examples)
+    ]
@@ -0,0 +1,437 @@
+"""Pre-flight estimation of the tokens, cost and time of the stages (`--dry_run`), without any network call."""
+import json
+import logging
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from alpaca_eval import utils as ae_utils
+from alpaca_eval.types import AnyPath
+
+from .helpers import CONFIGS_DIR, MAIN_DIR
+from .rate_limits import CHARS_PER_TOKEN
+from .summarizer import pack_examples
+
+__all__ = [
+    "STAGES",
+    "count_tokens",
+    "get_price_per_million_tokens",
+    "load_calibration",
+    "estimate_stage",
+    "estimate_stages",
+    "format_estimates",
+]
+
+# for each stage: directories of its configs, column of the annotation and column with the name of the annotator
+STAGES = {
+    "brainstorm_rubrics": dict(
+        base_dirs=[CONFIGS_DIR / "rubric_brainstormers_configs"],
+        annotation_key="brainstormed_rubric",
+        annotator_column="brainstormer",
+    ),
+    "generate_rubrics": dict(
+        base_dirs=[CONFIGS_DIR / "rubricators_configs"],
+        annotation_key="rubric",
+        annotator_column="rubricator",
+    ),
+    "generate_outputs": dict(
+        base_dirs=[CONFIGS_DIR / "models_configs"],
+        annotation_key="output",
+        annotator_column="model",
+    ),
+    "evaluate": dict(
+        base_dirs=[CONFIGS_DIR / "evaluators_configs"],
+        annotation_key="evaluation",
+        annotator_column="evaluator",
+    ),
+    "generate_report": dict(
+        base_dirs=[CONFIGS_DIR / "summarizers_configs"],
+        annotation_key="summarizer",
+        annotator_column="summarizer",
+    ),
+}
+
+# approximate list prices in USD per million (input, output) tokens, matched by the longest prefix of the model name
+PRICES_PER_MILLION_TOKENS = {
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "o1": (15.0, 60.0),
+    "o1-mini": (1.1, 4.4),
+    "o3": (10.0, 40.0),
+    "o3-mini": (1.1, 4.4),
+    "o4-mini": (1.1, 4.4),
+    "gemini-1.5-flash": (0.075, 0.3),
+    "gemini-1.5-pro": (1.25, 5.0),
+    "gemini-2.0-flash": (0.1, 0.4),
+    "gemini-2.0-flash-lite": (0.075, 0.3),
+    "gemini-2.5-flash": (0.15, 0.6),
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemma-2-9b": (0.3, 0.3),
+    "gemma-2-27b": (0.8, 0.8),
+    "llama-3.3-70b": (0.88, 0.88),
+    "llama-4-maverick": (0.27, 0.85),
+    "llama-4-scout": (0.18, 0.59),
+    "meta-llama-3.1-8b": (0.18, 0.18),
+    "meta-llama-3.1-70b": (0.88, 0.88),
+    "meta-llama-3.1-405b": (3.5, 3.5),
+    "mistral-small-24b": (0.8, 0.8),
+    "mixtral-8x7b": (0.6, 0.6),
+    "mixtral-8x22b": (1.2, 1.2),
+    "qwq-32b": (1.2, 1.2),
+    "qwen2-72b": (0.9, 0.9),
+    "qwen2.5-7b": (0.3, 0.3),
+    "qwen2.5-72b": (1.2, 1.2),
+    "deepseek-r1": (3.0, 7.0),
+    "deepseek-v3": (1.25, 1.25),
+    "test": (0.0, 0.0),
+}
+
+# models that generate hidden reasoning tokens, which are billed as output tokens
+REASONING_MODELS_PREFIXES = ("o1", "o3", "o4", "deepseek-r1", "qwq", "gemini-2.5")
+REASONING_TOKENS_MULTIPLIER = 3
+
+# default number of output tokens per example when there is no history for the annotator
+DEFAULT_OUTPUT_TOKENS = {
+    "brainstorm_rubrics": 1500,
+    "generate_rubrics": 2000,
+    "generate_outputs": 800,
+    "evaluate": 1200,
+    "generate_report": 1500,
+}
+
+# default number of tokens of the columns that are only available after running the previous stages
+DEFAULT_PLACEHOLDER_TOKENS = {
+    "useful_info_to_eval_instruction": 0,
+    "brainstormed_rubric": 1000,
+    "brainstormed_response": 500,
+    "rubric": 1500,
+    "criteria": 50,
+    "excellent_response": 600,
+    "output": 800,
+    "evaluation": 1000,
+}
+
+# latency model used when there is no history for the annotator
+DEFAULT_SECONDS_PER_REQUEST = 1.0
+DEFAULT_OUTPUT_TOKENS_PER_SECOND = 60
+
+
+def count_tokens(text: str) -> int:
+    """Approximate number of tokens of a text, same approximation as the rate limiter. We don't use a tokenizer
+    because they need to download their vocabulary, and a dry run should not make any network call.
+
+    Example:
+        >>> count_tokens("Write a haiku.")
+        4
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _get_model_key(model_name: str) -> str:
+    return model_name.split("/")[-1].lower()
+
+
+def get_price_per_million_tokens(model_name: str) -> tuple[float, float]:
+    """Approximate price in USD per million (input, output) tokens of a model, NaN if the model is unknown.
+
+    Example:
+        >>> get_price_per_million_tokens("gpt-4o-mini-2024-07-18")
+        (0.15, 0.6)
+        >>> get_price_per_million_tokens("meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo")
+        (0.18, 0.18)
+    """
+    model_key = _get_model_key(model_name)
+    matches = [k for k in PRICES_PER_MILLION_TOKENS if model_key.startswith(k)]
+    if len(matches) == 0:
+        return (np.nan, np.nan)
+    return PRICES_PER_MILLION_TOKENS[max(matches, key=len)]
+
+
+def _is_reasoning_model(model_name: str) -> bool:
+    return _get_model_key(model_name).startswith(REASONING_MODELS_PREFIXES)
+
+
+@lru_cache(maxsize=None)
+def load_calibration(data_dir: AnyPath = MAIN_DIR / "data") -> pd.DataFrame:
+    """Mean price, time and number of characters per example of each (stage, annotator) from the historical
+    annotations and reports in `data_dir`, i.e. the `*_price_per_example` and `*_time_per_example` columns.
+
+    Returns:
+        pd.DataFrame: Indexed by (stage, name) with columns `price_per_example`, `time_per_example`, `n_chars`.
+    """
+    records = []
+    for path in sorted(Path(data_dir).glob("**/*.json")):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        is_report = isinstance(data, dict)
+        if is_report:
+            data = [data]
+        if not isinstance(data, list) or len(data) == 0 or not isinstance(data[0], dict):
+            continue
+
+        df = pd.DataFrame.from_records(data)
+        for stage, stage_info in STAGES.items():
+            key, name_column = stage_info["annotation_key"], stage_info["annotator_column"]
+            price_col, time_col = f"{key}_price_per_example", f"{key}_time_per_example"
+            if name_column not in df.columns or (price_col not in df.columns and time_col not in df.columns):
+                continue
+
+            if is_report and stage == "generate_outputs" and "avg_n_chars" in df.columns:
+                n_chars = df["avg_n_chars"]
+            elif not is_report and key in df.columns:
+                n_chars = df[key].map(lambda v: len(v) if isinstance(v, str) else len(json.dumps(v, default=str)))
+            else:
+                n_chars = np.nan
+
+            records.append(
+                pd.DataFrame(
+                    dict(
+                        stage=stage,
+                        name=df[name_column].astype(str),
+                        price_per_example=pd.to_numeric(df.get(price_col, np.nan), errors="coerce"),
+                        time_per_example=pd.to_numeric(df.get(time_col, np.nan), errors="coerce"),
+                        n_chars=n_chars,
+                        # a report summarizes n_instructions examples
+                        weight=df["n_instructions"] if is_report and "n_instructions" in df.columns else 1,
+                    )
+                )
+            )
+
+    columns = ["price_per_example", "time_per_example", "n_chars"]
+    if len(records) == 0:
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_tuples([], names=["stage", "name"]))
+
+    df_all = pd.concat(records, ignore_index=True)
+
+    def _weighted_mean(df_group: pd.DataFrame) -> pd.Series:
+        out = {}
+        for col in columns:
+            is_valid = df_group[col].notna()
+            weights = df_group.loc[is_valid, "weight"]
+            out[col] = (df_group.loc[is_valid, col] * weights).sum() / weights.sum() if is_valid.any() else np.nan
+        return pd.Series(out)
+
+    return df_all.groupby(["stage", "name"])[columns + ["weight"]].apply(_weighted_mean)
+
+
+def _load_stage_configs(stage: str, configs: AnyPath) -> tuple[str, dict[str, Any], Path]:
+    """Return the name, the configs (the kwargs of the annotator or summarizer) and the base directory of a stage."""
+    for base_dir in STAGES[stage]["base_dirs"]:
+        if (Path(base_dir) / configs / "configs.yaml").exists():
+            loaded = ae_utils.load_configs(configs, relative_to=base_dir)
+            if stage == "generate_report":
+                return Path(configs).name, loaded["summarizer_kwargs"], Path(base_dir)
+            name, stage_configs = next(iter(loaded.items()))
+            return name, stage_configs, Path(base_dir)
+    raise FileNotFoundError(f"Could not find the configs {configs} of {stage} in {STAGES[stage]['base_dirs']}.")
+
+
+def _make_placeholder(n_tokens: int) -> str:
+    return "lorem " * int(n_tokens)
+
+
+def _render_prompts(df: pd.DataFrame, template: str, batch_size: int, placeholder_tokens: dict[str, int]) -> list[str]:
+    """Render the real prompts of the annotator, columns that are not yet in `df` are filled with placeholders."""
+    df = df.copy()
+    for column in set(re.findall(r"{([^ \s]+?)}", template)) - set(df.columns):
+        df[column] = _make_placeholder(placeholder_tokens.get(column, 0))
+    if len(df) % batch_size > 0:
+        df = pd.concat([df, df.iloc[: batch_size - len(df) % batch_size]], ignore_index=True)
+    prompts, _ = ae_utils.make_prompts(df, template=template, batch_size=batch_size)
+    return prompts
+
+
+def _get_summarizer_prompts_chars(
+    df: pd.DataFrame, configs: dict[str, Any], template: str, subsequent_template: str, evaluation_chars: int
+) -> list[int]:
+    """Simulate the hierarchical summarization of `UnstructuredSummarizer` and return the characters of each prompt."""
+    max_prompt_tokens = configs.get("max_prompt_tokens") or (
+        configs.get("approx_max_characters_to_summarize", 70000) // CHARS_PER_TOKEN
+    )
+    summary_chars = DEFAULT_OUTPUT_TOKENS["generate_report"] * CHARS_PER_TOKEN
+    columns = [c for c in ("instruction", "category") if c in df.columns]
+    row_chars = df[columns].astype(str).apply(lambda s: s.str.len()).sum(axis=1) if columns else pd.Series(0, df.index)
+    if "evaluation" in df.columns:
+        row_chars = row_chars + df["evaluation"].map(lambda v: len(str(v)))
+    else:
+        row_chars = row_chars + evaluation_chars
+
+    def _summarize(chars: list[float], prompt_template: str) -> tuple[list[int], int]:
+        # same packing as `UnstructuredSummarizer._get_chunks`
+        chunks = pack_examples(chars, max_length=max_prompt_tokens * CHARS_PER_TOKEN - len(prompt_template))
+        return [int(sum(chars[start:end])) + len(prompt_template) for start, end in chunks], len(chunks)
+
+    def _summarize_hierarchically(chars: list[float]) -> list[int]:
+        prompts, n_summaries = _summarize(chars, template)
+        while n_summaries > 1:
+            new_prompts, n_summaries = _summarize([summary_chars] * n_summaries, subsequent_template)
+            prompts += new_prompts
+        return prompts
+
+    if "category" in df.columns and df["category"].nunique() > 1:
+        prompts = []
+        for _, group_chars in row_chars.groupby(df["category"]):
+            prompts += _summarize_hierarchically(group_chars.tolist())
+        n_categories = df["category"].nunique()
+        final_prompts, n_summaries = _summarize([summary_chars] * n_categories, subsequent_template)
+        prompts += final_prompts
+        while n_summaries > 1:
+            final_prompts, n_summaries = _summarize([summary_chars] * n_summaries, subsequent_template)
+            prompts += final_prompts
+        return prompts
+    return _summarize_hierarchically(row_chars.tolist())
+
+
+def estimate_stage(
+    stage: str,
+    configs: AnyPath,
+    df: pd.DataFrame,
+    placeholder_tokens: Optional[dict[str, int]] = None,
+    calibration: Optional[pd.DataFrame] = None,
+) -> dict[str, Any]:
+    """Estimate the tokens, price (USD) and time (seconds of requests, summed over examples) of running a stage.
+
+    The prompts are rendered from the prompt templates of the configs. The price and time per example come from the
+    historical annotations of the same annotator if there are any (`source="history"`), otherwise from the number of
+    tokens and `PRICES_PER_MILLION_TOKENS` (`source="tokens"`).
+
+    Args:
+        stage: One of `STAGES`, e.g. "evaluate".
+        configs: Name of the configs of the stage, e.g. "gpt-4.1-2025-04-14".
+        df: Input of the stage.
+        placeholder_tokens: Number of tokens of the columns that are not yet in `df`. Defaults to
+            `DEFAULT_PLACEHOLDER_TOKENS`.
+        calibration: Output of `load_calibration`. Defaults to the historical data of the package.
+    """
+    placeholder_tokens = {**DEFAULT_PLACEHOLDER_TOKENS, **(placeholder_tokens or {})}
+    if calibration is None:
+        calibration = load_calibration()
+
+    name, stage_configs, base_dir = _load_stage_configs(stage, configs)
+    completions_kwargs = stage_configs.get("completions_kwargs", {})
+    model_name = completions_kwargs.get("model_name", "")
+    template = ae_utils.read_or_return(stage_configs["prompt_template"], relative_to=base_dir)
+    tools = completions_kwargs.get("tools")
+    tools_tokens = count_tokens(json.dumps(tools)) if tools else 0
+
+    history = calibration.loc[(stage, name)] if (stage, name) in calibration.index else None
+    max_tokens = completions_kwargs.get("max_tokens", completions_kwargs.get("max_completion_tokens", np.inf))
+    if history is not None and pd.notna(history["n_chars"]):
+        output_tokens_per_request = history["n_chars"] / CHARS_PER_TOKEN
+    else:
+        output_tokens_per_request = DEFAULT_OUTPUT_TOKENS[stage]
+    if _is_reasoning_model(model_name):
+        output_tokens_per_request *= REASONING_TOKENS_MULTIPLIER
+    output_tokens_per_request = min(output_tokens_per_request, max_tokens)
+
+    n_examples = len(df)
+    if stage == "generate_report":
+        subsequent_template = ae_utils.read_or_return(
+            stage_configs.get("subsequent_prompt_template", stage_configs["prompt_template"]), relative_to=base_dir
+        )
+        prompts_chars = _get_summarizer_prompts_chars(
+            df,
+            stage_configs,
+            template,
+            subsequent_template,
+            evaluation_chars=placeholder_tokens["evaluation"] * CHARS_PER_TOKEN,
+        )
+        n_requests = len(prompts_chars)
+        input_tokens = sum(math.ceil(c / CHARS_PER_TOKEN) for c in prompts_chars) + n_requests * tools_tokens
+    else:
+        prompts = _render_prompts(df, template, stage_configs.get("batch_size", 1), placeholder_tokens)
+        n_requests = len(prompts)
+        input_tokens = sum(count_tokens(p) for p in prompts) + n_requests * tools_tokens
+    output_tokens = int(output_tokens_per_request * n_requests)
+
+    price_input, price_output = get_price_per_million_tokens(model_name)
+    price_from_tokens = (input_tokens * price_input + output_tokens * price_output) / 1e6
+    time_from_tokens = n_requests * (
+        DEFAULT_SECONDS_PER_REQUEST + output_tokens_per_request / DEFAULT_OUTPUT_TOKENS_PER_SECOND
+    )
+
+    if history is not None and pd.notna(history["price_per_example"]):
+        price, price_source = history["price_per_example"] * n_examples, "history"
+    else:
+        price, price_source = price_from_tokens, "tokens"
+    if history is not None and pd.notna(history["time_per_example"]):
+        time, time_source = history["time_per_example"] * n_examples, "history"
+    else:
+        time, time_source = time_from_tokens, "tokens"
+
+    return dict(
+        stage=stage,
+        configs=name,
+        model_name=model_name,
+        n_examples=n_examples,
+        n_requests=n_requests,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        price=price,
+        time=time,
+        price_source=price_source,
+        time_source=time_source,
+    )
+
+
+def estimate_stages(
+    df: pd.DataFrame,
+    stages: Sequence[tuple[str, Optional[AnyPath]]],
+    calibration: Optional[pd.DataFrame] = None,
+    **estimate_kwargs,
+) -> pd.DataFrame:
+    """Estimate a chain of stages on the same input, e.g. `[("generate_outputs", model), ("evaluate", evaluator)]`.
+    Stages whose configs are None are skipped, and the columns that a stage adds are sized from its estimate for the
+    following stages.
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    placeholder_tokens = dict(estimate_kwargs.pop("placeholder_tokens", None) or {})
+    estimates = []
+    for stage, configs in stages:
+        if configs is None:
+            continue
+        try:
+            estimate = estimate_stage(
+                stage, configs, df, placeholder_tokens=placeholder_tokens, calibration=calibration, **estimate_kwargs
+            )
+        except FileNotFoundError as e:
+            logging.warning(f"Skipping the estimate of {stage}: {e}")
+            continue
+        estimates.append(estimate)
+        if estimate["n_requests"] > 0:
+            # the outputs of that stage are the inputs of the following ones
+            placeholder_tokens[STAGES[stage]["annotation_key"]] = estimate["output_tokens"] // estimate["n_requests"]
+    return pd.DataFrame(estimates)
+
+
+def format_estimates(df_estimates: pd.DataFrame) -> str:
+    """Format the estimates as a table with a total per stage and a total per model."""
+    if df_estimates.empty:
+        return "Nothing to estimate."
+    df_estimates = df_estimates.copy()
+    df_estimates["time"] = df_estimates["time"] / 60
+    df_estimates = df_estimates.rename(columns=dict(price="price ($)", time="time (min)"))
+    numeric_columns = ["n_examples", "n_requests", "input_tokens", "output_tokens", "price ($)", "time (min)"]
+    per_stage = df_estimates.groupby("stage", sort=False)[numeric_columns].sum(min_count=1)
+    per_model = df_estimates.groupby("model_name", sort=False)[numeric_columns].sum(min_count=1)
+    float_format = lambda x: f"{x:,.2f}"  # noqa: E731
+    return "\n\n".join(
+        [
+            "Projection per stage and annotator:\n" + df_estimates.to_string(index=False, float_format=float_format),
+            "Total per stage:\n" + per_stage.to_string(float_format=float_format),
+            "Total per model:\n" + per_model.to_string(float_format=float_format),
+            f"Total: ${df_estimates['price ($)'].sum():,.2f} and {df_estimates['time (min)'].sum():,.1f} minutes of "
+            "requests (before parallelism). Estimates are approximate, no request was sent.",
+        ]
+    )
@@ -2,19 +2,49 @@ import ast
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Sequence
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
 
 import numpy as np
 import pandas as pd
 from alpaca_eval import utils as ae_utils
 from alpaca_eval.annotators import base
-
-from .helpers import CONFIGS_DIR, expand_json_column, mean
-
-__all__ = ["Evaluator", "make_evaluation_report_dict", "format_evaluation_report_md"]
-
-
-class Evaluator(base.BaseAnnotatorJSON):
+from alpaca_eval.types import AnyPath
+
+from .annotators import BaseAnnotatorJSON
+from .bootstrap import CONFIDENCE_LEVEL, N_BOOTSTRAP_RESAMPLES, bootstrap_confidence_intervals
+from .helpers import CONFIGS_DIR, apply_in_parallel, expand_json_column, get_instruction_ids
+from .output_statistics import get_outputs_statistics
+from .parsing import decode_json_batch, log_decoding_failures
+from .ragged import RaggedRecords
+
+__all__ = [
+    "Evaluator",
+    "make_evaluation_report_dict",
+    "format_evaluation_report_md",
+    "compute_scores_from_rubrics_and_gradings",
+    "reconcile_criteria",
+    "make_criteria_table",
+    "save_criteria_table",
+    "load_criteria_table",
+]
+
+CRITERIA_TABLE_COLUMNS = [
+    "instruction_id",
+    "model",
+    "evaluator",
+    "criterion",
+    "weight",
+    "performance",
+    "score",
+    "feedback",
+]
+# minimal token-set similarity to map a graded criterion to a criterion of the rubric with a different name
+MIN_CRITERION_SIMILARITY = 0.5
+# string columns with few distinct values, stored dictionary-encoded
+CRITERIA_TABLE_DICTIONARY_COLUMNS = ["instruction_id", "evaluator", "criterion", "performance"]
+
+
+class Evaluator(BaseAnnotatorJSON):
     __doc__ = base.BaseAnnotatorJSON.__doc__.replace(
         "Base class for a pool of annotators.",
         "Auto evaluator of the output using the rubric.",
@@ -52,46 +82,57 @@ class Evaluator(base.BaseAnnotatorJSON):
     def make_df_rubric_grading(
         self,
         annotated: Sequence[dict],
+        n_postprocessing_workers: Optional[int] = None,
+        is_reconcile_criteria: bool = True,
     ) -> pd.DataFrame:
-        """Add scores to the dataframe based on the rubric."""
+        """Add scores to the dataframe based on the rubric. The scores are computed in `n_postprocessing_workers`
+        processes (defaults to the value given at initialization). If `is_reconcile_criteria`, the graded criteria
+        whose name was paraphrased by the evaluator are first mapped back to the criteria of the rubric (see
+        `reconcile_criteria`), so that their score is not missing."""
         df_eval = ae_utils.convert_to_dataframe(annotated)
 
         df_eval = df_eval.dropna(subset=[self.annotation_key])
 
-        mask_str = df_eval[self.annotation_key].apply(lambda x: isinstance(x, str))
+        mask_str = df_eval[self.annotation_key].apply(lambda x: isinstance(x, str)).to_numpy()
         if mask_str.any():
-            df_eval.loc[mask_str, self.annotation_key] = df_eval.loc[mask_str, self.annotation_key].apply(
-                ae_utils.convert_str_to_sequence
+            decoded, reasons = decode_json_batch(df_eval.loc[mask_str, self.annotation_key].tolist())
+            reasons = [
+                "not a list" if reason is None and not isinstance(value, list) else reason
+                for value, reason in zip(decoded, reasons)
+            ]
+            df_eval[self.annotation_key] = df_eval[self.annotation_key].astype(object)
+            df_eval.loc[mask_str, self.annotation_key] = pd.Series(
+                decoded, index=df_eval.index[mask_str], dtype=object
             )
-            mask_str_new = df_eval[self.annotation_key].apply(lambda x: isinstance(x, str))
-            if mask_str_new.any():
+            n_failures = log_decoding_failures(reasons, self.annotation_key)
+            if n_failures > 0:
                 # let's drop this time
-                logging.warning(
-                    f"{mask_str_new.sum()} examples have string annotations in {self.annotation_key} we are droping them."
-                )
-                df_eval = df_eval[~mask_str_new]
-            else:
-                logging.warning(
-                    f"{mask_str.sum()} examples had string annotations in {self.annotation_key}, we converted them."
-                )
-
-        performance_to_score = dict(excellent=4, good=3, fair=2, poor=1)
-
-        def get_score_for_criterion(d: dict) -> float | int:
-            if "likert_score" in d:
-                return d["likert_score"]
-            else:
-                # convert the performance to a score between 1-10
-                return (performance_to_score[d["performance"]] - 1) * 3 + 1
-
-        df_eval[self.annotation_key] = df_eval[self.annotation_key].apply(
-            lambda x: [{**d, "score": get_score_for_criterion(d)} for d in x]
-        )
-        # to get the per example score, you take the score for each criterion in self.annotation_key, you then weight
-        # them by the weight in "rubric" and sum them up
-        df_eval["unweighted_score"] = df_eval[self.annotation_key].apply(lambda x: mean([d["score"] for d in x]))
+                logging.warning(f"Dropping the {n_failures} examples whose {self.annotation_key} could not be decoded.")
+                is_failure = np.zeros(len(df_eval), dtype=bool)
+                is_failure[np.flatnonzero(mask_str)[[reason is not None for reason in reasons]]] = True
+                df_eval = df_eval[~is_failure]
+            logging.warning(
+                f"{mask_str.sum() - n_failures} examples had string annotations in {self.annotation_key}, we converted"
+                " them."
+            )
+
+        is_reconciled = np.zeros(len(df_eval), dtype=bool)
+        if is_reconcile_criteria:
+            gradings, is_reconciled = reconcile_criteria(df_eval["rubric"], df_eval[self.annotation_key])
+            df_eval[self.annotation_key] = pd.Series(gradings, index=df_eval.index, dtype=object)
 
-        df_eval["weighted_score"] = df_eval.apply(_compute_score_from_rubric_and_grading, axis=1)
+        df_eval = apply_in_parallel(
+            df_eval,
+            _add_scores,
+            n_workers=n_postprocessing_workers or self.n_postprocessing_workers,
+            annotation_key=self.annotation_key,
+        )
+        if is_reconciled.any():
+            n_recovered = (is_reconciled & df_eval["weighted_score"].notnull().to_numpy()).sum()
+            logging.info(
+                f"Reconciled the criteria names of {is_reconciled.sum()} examples with their rubric, which recovered "
+                f"the scores of {n_recovered} examples."
+            )
         if df_eval["weighted_score"].isnull().any():
             n_scores_missing = df_eval["weighted_score"].isnull().sum()
             logging.warning(
@@ -106,7 +147,11 @@ class Evaluator(base.BaseAnnotatorJSON):
 
 
 def make_evaluation_report_dict(
-    df: pd.DataFrame, summary_completions: Optional[dict[str, Any]] = None
+    df: pd.DataFrame,
+    summary_completions: Optional[dict[str, Any]] = None,
+    n_bootstrap_resamples: int = N_BOOTSTRAP_RESAMPLES,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    output_statistics_cache: Optional[AnyPath] = "auto",
 ) -> dict[str, Any]:
     """Generate a report dict from the evaluation DataFrame.
 
@@ -115,12 +160,17 @@ def make_evaluation_report_dict(
             "output_date", "evaluation_date", "evaluator_version", "output_time_per_example", "output_price_per_example",
             "evaluation_time_per_example", "evaluation_price_per_example", "weighted_score", "unweighted_score", "category".
         summary_completions (bool): Optional summary of the evaluations.
+        n_bootstrap_resamples (int): Number of bootstrap resamples for the confidence intervals of the scores.
+        confidence_level (float): Confidence level of the bootstrap confidence intervals.
+        output_statistics_cache (Optional[AnyPath]): Where the statistics of each output are stored, so that the
+            reports of the same outputs by other evaluators or reruns reuse them. See `get_outputs_statistics`.
     """
 
     def date_only(x: str) -> str:
         return datetime.fromisoformat(x).strftime("%Y-%m-%d")
 
     n_instructions = len(df)
+    output_statistics = get_outputs_statistics(df["output"], cache=output_statistics_cache)
     eval_time_per_eg = df["evaluation_time_per_example"].mean()
     eval_price_per_eg = df["evaluation_price_per_example"].mean()
 
@@ -137,9 +187,13 @@ def make_evaluation_report_dict(
         evaluator_version=_get_unique_val_from_col(df, "evaluation_version"),
         report_version=ae_utils.get_multi_package_version(["rubric_eval"]),
         # --- output details ---
-        avg_n_chars=df["output"].apply(len).mean(),
-        avg_n_list_items=df["output"].apply(ae_utils.contains_list, is_return_count=True).mean(),
-        proba_list=df["output"].apply(ae_utils.contains_list, is_return_count=False).mean(),
+        avg_n_chars=output_statistics["n_chars"].mean(),
+        avg_n_tokens=output_statistics["n_tokens"].mean(),
+        avg_n_list_items=output_statistics["n_list_items"].mean(),
+        proba_list=output_statistics["has_list"].mean(),
+        avg_n_headers=output_statistics["n_headers"].mean(),
+        avg_n_code_blocks=output_statistics["n_code_blocks"].mean(),
+        avg_n_table_rows=output_statistics["n_table_rows"].mean(),
         # --- time & cost ---
         evaluation_time_per_example=eval_time_per_eg,
         evaluation_price_per_example=eval_price_per_eg,
@@ -152,10 +206,7 @@ def make_evaluation_report_dict(
         weighted_score_sem=df["weighted_score"].sem(),
         unweighted_score_mean=df["unweighted_score"].mean(),
         unweighted_score_sem=df["unweighted_score"].sem(),
-        weighted_score_per_category=df.groupby("category")["weighted_score"].mean().to_dict(),
-        weighted_sem_per_category=df.groupby("category")["weighted_score"].sem().to_dict(),
-        unweighted_score_per_category=df.groupby("category")["unweighted_score"].mean().to_dict(),
-        unweighted_sem_per_category=df.groupby("category")["unweighted_score"].sem().to_dict(),
+        **_get_score_statistics(df, n_bootstrap_resamples=n_bootstrap_resamples, confidence_level=confidence_level),
         # score_per_cagtegory
         # --- qualitative ---
         # pro_feedback=["feedback 1", "feedback 2"],
@@ -181,6 +232,43 @@ def make_evaluation_report_dict(
     return report_dict
 
 
+def _get_score_statistics(
+    df: pd.DataFrame, n_bootstrap_resamples: int = N_BOOTSTRAP_RESAMPLES, confidence_level: float = CONFIDENCE_LEVEL
+) -> dict[str, Any]:
+    """Bootstrap confidence intervals of the weighted and unweighted scores, overall and per category, and the
+    per category means and SEMs (computed in a single groupby)."""
+    scores = df[["weighted_score", "unweighted_score"]].to_numpy(dtype=float).T
+    lower, upper = bootstrap_confidence_intervals(
+        scores, confidence_level=confidence_level, n_resamples=n_bootstrap_resamples
+    )
+    statistics = dict(
+        weighted_score_ci_lower=lower[0],
+        weighted_score_ci_upper=upper[0],
+        unweighted_score_ci_lower=lower[1],
+        unweighted_score_ci_upper=upper[1],
+        confidence_level=confidence_level,
+    )
+
+    df_per_category = df.groupby("category")[["weighted_score", "unweighted_score"]].agg(["mean", "sem"])
+    statistics.update(
+        weighted_score_per_category=df_per_category[("weighted_score", "mean")].to_dict(),
+        weighted_sem_per_category=df_per_category[("weighted_score", "sem")].to_dict(),
+        unweighted_score_per_category=df_per_category[("unweighted_score", "mean")].to_dict(),
+        unweighted_sem_per_category=df_per_category[("unweighted_score", "sem")].to_dict(),
+        weighted_ci_lower_per_category={},
+        weighted_ci_upper_per_category={},
+    )
+    for category, df_category in df.groupby("category"):
+        lower, upper = bootstrap_confidence_intervals(
+            df_category["weighted_score"].to_numpy(dtype=float),
+            confidence_level=confidence_level,
+            n_resamples=n_bootstrap_resamples,
+        )
+        statistics["weighted_ci_lower_per_category"][category] = lower[0]
+        statistics["weighted_ci_upper_per_category"][category] = upper[0]
+    return statistics
+
+
 def format_evaluation_report_md(report_dict: dict[str, Any]) -> str:
     rd = report_dict
     is_category = rd["n_categories"] > 1
@@ -235,7 +323,7 @@ def format_evaluation_report_md(report_dict: dict[str, Any]) -> str:
     if is_category:
         weighted_score_per_category_str = "\n".join(
             [
-                f"- {k}: {v:.2f} ± {rd['weighted_sem_per_category'][k]:.2f}"
+                f"- {k}: {v:.2f} ± {rd['weighted_sem_per_category'][k]:.2f}" + _format_ci(rd, category=k)
                 for k, v in rd["weighted_score_per_category"].items()
             ]
         )
@@ -248,8 +336,8 @@ def format_evaluation_report_md(report_dict: dict[str, Any]) -> str:
     return f"""# Evaluation report for model="{rd["model"]}" on dataset="{rd["dataset"]}"
 
 ## Overview
-**Score**: {rd["weighted_score_mean"]:.2f} ± {rd["weighted_score_sem"]:.2f}
-{overview_str_sffx}
+**Score**: {rd["weighted_score_mean"]:.2f} ± {rd["weighted_score_sem"]:.2f}{_format_ci(rd)}
+{overview_str_sffx}{quantitative_str_per_category}
 ## Details
 **Model**: {rd["model"]}
 
@@ -280,21 +368,272 @@ def format_evaluation_report_md(report_dict: dict[str, Any]) -> str:
 """
 
 
+def _format_ci(rd: dict[str, Any], category: Optional[str] = None) -> str:
+    """Format the bootstrap confidence interval of the weighted score, if it is in the report (older reports don't)."""
+    if category is None:
+        lower, upper = rd.get("weighted_score_ci_lower"), rd.get("weighted_score_ci_upper")
+    else:
+        lower = rd.get("weighted_ci_lower_per_category", {}).get(category)
+        upper = rd.get("weighted_ci_upper_per_category", {}).get(category)
+    if lower is None or upper is None:
+        return ""
+    return f" ({rd.get('confidence_level', CONFIDENCE_LEVEL):.0%} CI: [{lower:.2f}, {upper:.2f}])"
+
+
 ### Helpers
 
+PERFORMANCE_TO_SCORE = dict(excellent=4, good=3, fair=2, poor=1)
 
-def _compute_score_from_rubric_and_grading(x: dict) -> float:
-    """Compute the score from the rubric and grading."""
-    df_grading = pd.DataFrame(x["evaluation"])
-    if "criterion" not in df_grading.columns:
-        return np.nan
-    df_grading = df_grading.set_index("criterion")
-    df_rubric = pd.DataFrame(x["rubric"]).set_index("criterion")
-    necessary_indices = df_rubric.query("weight > 0").index
-    if not (set(necessary_indices).issubset(set(df_grading.index))):
-        return np.nan
-    out = (df_grading["score"] * df_rubric.reindex(df_grading.index)["weight"] / 100).sum()
-    return out
+
+def _get_scores_of_criteria(gradings: RaggedRecords) -> list[float | int]:
+    """Score of each graded criterion: its "likert_score" if any, otherwise its performance converted to 1-10."""
+    performance_to_score = {k: (v - 1) * 3 + 1 for k, v in PERFORMANCE_TO_SCORE.items()}
+    return [
+        likert_score if has_likert_score else performance_to_score[performance]
+        for has_likert_score, likert_score, performance in zip(
+            gradings.has("likert_score").tolist(),
+            gradings.get("likert_score", default=None).tolist(),
+            gradings.get("performance", default=None).tolist(),
+        )
+    ]
+
+
+def _add_scores(df_eval: pd.DataFrame, annotation_key: str = "evaluation") -> pd.DataFrame:
+    """Scoring of the gradings, defined at the module level to be able to run in a process pool."""
+    df_eval = df_eval.copy()
+    gradings = RaggedRecords.from_lists(df_eval[annotation_key])
+    gradings = gradings.set("score", _get_scores_of_criteria(gradings))
+    scores = compute_scores_from_rubrics_and_gradings(RaggedRecords.from_lists(df_eval["rubric"]), gradings)
+    df_eval[annotation_key] = pd.Series(gradings.to_lists(), index=df_eval.index, dtype=object)
+    df_eval["unweighted_score"] = scores["unweighted_score"].to_numpy()
+    df_eval["weighted_score"] = scores["weighted_score"].to_numpy()
+    return df_eval
+
+
+def _explode_records(series: Union[pd.Series, RaggedRecords], keys: Sequence[str]) -> pd.DataFrame:
+    """Flatten a series of lists of dicts (or its `RaggedRecords`) into one row per dict with the given keys (NaN if
+    missing) and the position `row` of the list in the series. Non-list elements are treated as empty lists."""
+    ragged = series if isinstance(series, RaggedRecords) else RaggedRecords.from_lists(series)
+    df = ragged.to_frame(keys)
+    df["has_criterion"] = ragged.has("criterion")
+    return df
+
+
+def _normalize_criteria(criteria: pd.Series) -> pd.Series:
+    """Casefold the criteria names and replace punctuation and whitespaces by a single space (NaN if not a string)."""
+    criteria = criteria.where(criteria.map(lambda x: isinstance(x, str))).astype(object)
+    return criteria.str.casefold().str.replace(r"[\W_]+", " ", regex=True).str.strip()
+
+
+def _jaccard_similarity(tokens_a: frozenset, tokens_b: frozenset) -> float:
+    if len(tokens_a) == 0 or len(tokens_b) == 0:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+def reconcile_criteria(
+    rubrics: pd.Series, gradings: pd.Series, min_similarity: float = MIN_CRITERION_SIMILARITY
+) -> tuple[list[Any], np.ndarray]:
+    """Map the graded criteria that are not in the rubric (e.g. paraphrased by the evaluator) back to the criteria of
+    the rubric that were not graded.
+
+    All the criteria are flattened once and only the examples with unmatched criteria on both sides are processed.
+    For those, candidate pairs of the same example are scored by the token-set (Jaccard) similarity of the normalized
+    names (casefolded, without punctuation and extra whitespaces), identical normalized names having similarity 1. The
+    pairs are then matched one-to-one greedily by decreasing similarity, ignoring pairs below `min_similarity`. The
+    renamed criteria keep their previous name in "original_criterion".
+
+    Returns:
+        tuple: The reconciled gradings (the input lists are not modified), and a boolean array of the examples where
+        a criterion with positive weight was missing and at least one criterion was renamed.
+
+    Example:
+        >>> rubrics = pd.Series([[{"criterion": "Code Correctness", "weight": 50}, {"criterion": "Clarity", "weight": 50}]])
+        >>> gradings = pd.Series([[{"criterion": "clarity.", "score": 7}, {"criterion": "Correctness of code", "score": 4}]])
+        >>> reconciled, is_reconciled = reconcile_criteria(rubrics, gradings)
+        >>> [d["criterion"] for d in reconciled[0]], is_reconciled
+        (['Clarity', 'Code Correctness'], array([ True]))
+    """
+    gradings = list(gradings)
+    is_reconciled = np.zeros(len(gradings), dtype=bool)
+    df_grading = _explode_records(pd.Series(gradings, dtype=object), keys=["criterion"])
+    df_grading["idx"] = np.arange(len(df_grading))
+    df_rubric = _explode_records(rubrics, keys=["criterion", "weight"])
+    df_rubric["idx"] = np.arange(len(df_rubric))
+    df_rubric = df_rubric.drop_duplicates(subset=["row", "criterion"], keep="first")
+
+    # only keep the criteria that are not exactly matched
+    keys = ["row", "criterion"]
+    is_graded = df_rubric[keys].merge(df_grading[keys].drop_duplicates(), how="left", indicator=True)["_merge"]
+    is_in_rubric = df_grading[keys].merge(df_rubric[keys], how="left", indicator=True)["_merge"]
+    df_rubric = df_rubric[(is_graded == "left_only").to_numpy()]
+    df_grading = df_grading[(is_in_rubric == "left_only").to_numpy()]
+    rows = np.intersect1d(df_rubric["row"].unique(), df_grading["row"].unique())
+    if len(rows) == 0:
+        return gradings, is_reconciled
+    df_rubric = df_rubric[df_rubric["row"].isin(rows)]
+    df_grading = df_grading[df_grading["row"].isin(rows)]
+
+    df_rubric = df_rubric.assign(normalized=_normalize_criteria(df_rubric["criterion"])).dropna(subset=["normalized"])
+    df_grading = df_grading.assign(normalized=_normalize_criteria(df_grading["criterion"])).dropna(
+        subset=["normalized"]
+    )
+    df_pairs = df_grading.merge(df_rubric, on="row", suffixes=("_grading", "_rubric"))
+    tokens = {n: frozenset(n.split()) for n in pd.concat([df_grading["normalized"], df_rubric["normalized"]]).unique()}
+    df_pairs["similarity"] = [
+        1.0 if a == b else _jaccard_similarity(tokens[a], tokens[b])
+        for a, b in zip(df_pairs["normalized_grading"], df_pairs["normalized_rubric"])
+    ]
+    df_pairs = df_pairs[df_pairs["similarity"] >= min_similarity]
+    df_pairs = df_pairs.sort_values(
+        ["similarity", "idx_grading", "idx_rubric"], ascending=[False, True, True], kind="stable"
+    )
+
+    # greedy one-to-one matching
+    renames, used_rubric_idcs = {}, set()
+    for idx_grading, idx_rubric, criterion in zip(
+        df_pairs["idx_grading"], df_pairs["idx_rubric"], df_pairs["criterion_rubric"]
+    ):
+        if idx_grading in renames or idx_rubric in used_rubric_idcs:
+            continue
+        renames[idx_grading] = criterion
+        used_rubric_idcs.add(idx_rubric)
+
+    if len(renames) == 0:
+        return gradings, is_reconciled
+
+    offsets = np.concatenate([[0], np.cumsum([len(x) if isinstance(x, list) else 0 for x in gradings])])
+    renamed_rows = np.searchsorted(offsets, list(renames), side="right") - 1
+    for row in np.unique(renamed_rows):
+        gradings[row] = [
+            {**d, "criterion": renames[i], "original_criterion": d["criterion"]} if i in renames else d
+            for i, d in enumerate(gradings[row], start=offsets[row])
+        ]
+
+    weights = pd.to_numeric(df_rubric["weight"], errors="coerce")
+    rows_missing_criteria = df_rubric.loc[(weights > 0).to_numpy(), "row"].unique()
+    is_reconciled[np.intersect1d(np.unique(renamed_rows), rows_missing_criteria)] = True
+    return gradings, is_reconciled
+
+
+def compute_scores_from_rubrics_and_gradings(
+    rubrics: Union[pd.Series, RaggedRecords], gradings: Union[pd.Series, RaggedRecords]
+) -> pd.DataFrame:
+    """Compute the weighted and unweighted scores of each example from its rubric and its grading (which should already
+    contain the "score" of each criterion). Both can be given as series of lists of dicts or as `RaggedRecords`.
+
+    All the criteria are flattened once into criterion-level arrays, joined in a single merge and aggregated with a
+    groupby, so the cost is linear in the total number of criteria. The weighted score is the sum over the graded
+    criteria of `score * weight / 100`. It is NaN if the grading has no criterion or if a criterion with positive weight
+    in the rubric was not graded (e.g. the evaluator renamed it). The unweighted score is the mean of the scores.
+
+    Returns:
+        pd.DataFrame: Columns "weighted_score" and "unweighted_score", with one row per example (in the input order).
+
+    Example:
+        >>> rubrics = pd.Series([[{"criterion": "a", "weight": 60}, {"criterion": "b", "weight": 40}]] * 2)
+        >>> gradings = pd.Series([[{"criterion": "a", "score": 10}, {"criterion": "b", "score": 5}],
+        ...                       [{"criterion": "a", "score": 10}, {"criterion": "c", "score": 5}]])
+        >>> compute_scores_from_rubrics_and_gradings(rubrics, gradings)
+           weighted_score  unweighted_score
+        0             8.0               7.5
+        1             NaN               7.5
+    """
+    n_examples = len(gradings)
+    df_grading = _explode_records(gradings, keys=["criterion", "score"])
+    df_rubric = _explode_records(rubrics, keys=["criterion", "weight"])
+    df_grading["score"] = pd.to_numeric(df_grading["score"], errors="coerce")
+    df_rubric["weight"] = pd.to_numeric(df_rubric["weight"], errors="coerce")
+    df_rubric = df_rubric.drop_duplicates(subset=["row", "criterion"], keep="first")
+
+    df_merged = df_grading.merge(df_rubric[["row", "criterion", "weight"]], on=["row", "criterion"], how="left")
+    df_merged["weighted"] = df_merged["score"] * df_merged["weight"] / 100
+    grouped = df_merged.groupby("row")
+    weighted_score = grouped["weighted"].sum().reindex(range(n_examples))
+    unweighted_score = grouped["score"].mean().reindex(range(n_examples))
+
+    # the weighted score is missing if the grading has no criterion or misses a criterion with positive weight
+    has_criterion = grouped["has_criterion"].any().reindex(range(n_examples), fill_value=False)
+    df_necessary = df_rubric.loc[df_rubric["weight"] > 0, ["row", "criterion"]]
+    df_necessary = df_necessary.merge(
+        df_grading[["row", "criterion"]].drop_duplicates(), on=["row", "criterion"], how="left", indicator=True
+    )
+    is_missing_criteria = np.zeros(n_examples, dtype=bool)
+    is_missing_criteria[df_necessary.loc[df_necessary["_merge"] == "left_only", "row"].unique()] = True
+    weighted_score[~has_criterion.to_numpy() | is_missing_criteria] = np.nan
+
+    return pd.DataFrame(
+        dict(weighted_score=weighted_score.to_numpy(dtype=float), unweighted_score=unweighted_score.to_numpy(dtype=float))
+    )
+
+
+def make_criteria_table(df_eval: pd.DataFrame, annotation_key: str = "evaluation") -> pd.DataFrame:
+    """Flatten the evaluations into a long table with one row per graded criterion and the columns
+    `CRITERIA_TABLE_COLUMNS`. The weight comes from the rubric (NaN if the criterion is not in the rubric). The
+    instruction id is the "id" column if there is one, otherwise a hash of the instruction.
+
+    Example:
+        >>> df_eval = pd.DataFrame(dict(id=[7], instruction=["Say hi"], model=["m"], evaluator=["e"],
+        ...     rubric=[[{"criterion": "tone", "weight": 100}]],
+        ...     evaluation=[[{"criterion": "tone", "performance": "good", "score": 7, "feedback": "ok"}]]))
+        >>> make_criteria_table(df_eval).iloc[0].to_dict()
+        {'instruction_id': '7', 'model': 'm', 'evaluator': 'e', 'criterion': 'tone', 'weight': 100.0, 'performance': 'good', 'score': 7.0, 'feedback': 'ok'}
+    """
+    df_eval = df_eval.reset_index(drop=True)
+    df_grading = _explode_records(df_eval[annotation_key], keys=["criterion", "performance", "score", "feedback"])
+    df_rubric = _explode_records(df_eval["rubric"], keys=["criterion", "weight"])
+    df_rubric = df_rubric.drop_duplicates(subset=["row", "criterion"], keep="first")
+    df_criteria = df_grading.merge(df_rubric[["row", "criterion", "weight"]], on=["row", "criterion"], how="left")
+
+    rows = df_criteria["row"].to_numpy()
+    df_criteria["instruction_id"] = get_instruction_ids(df_eval).to_numpy()[rows]
+    for col in ["model", "evaluator"]:
+        if col in df_eval.columns:
+            df_criteria[col] = df_eval[col].fillna("<Unknown>").astype(str).to_numpy()[rows]
+        else:
+            df_criteria[col] = "<Unknown>"
+
+    df_criteria["weight"] = pd.to_numeric(df_criteria["weight"], errors="coerce").astype(float)
+    df_criteria["score"] = pd.to_numeric(df_criteria["score"], errors="coerce").astype(float)
+    for col in ["criterion", "performance", "feedback"]:
+        # missing values stay missing (null in Parquet) instead of becoming "nan"
+        df_criteria[col] = df_criteria[col].astype("string")
+    return df_criteria[CRITERIA_TABLE_COLUMNS]
+
+
+def save_criteria_table(df_criteria: pd.DataFrame, path: AnyPath) -> Path:
+    """Save the criteria table as a Parquet dataset partitioned by model (`path/model=<model>/*.parquet`). The
+    partitions of the models in `df_criteria` are replaced, the ones of other models are kept, so the evaluations of
+    all the models can share the same dataset."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Saving the criteria table requires `pyarrow`, install it with `pip install pyarrow`.") from e
+
+    table = pa.Table.from_pandas(df_criteria[CRITERIA_TABLE_COLUMNS], preserve_index=False)
+    for col in CRITERIA_TABLE_DICTIONARY_COLUMNS:
+        table = table.set_column(table.schema.get_field_index(col), col, pc.dictionary_encode(table[col]))
+
+    path = Path(path)
+    pq.write_to_dataset(
+        table,
+        root_path=path,
+        partition_cols=["model"],
+        existing_data_behavior="delete_matching",
+        use_dictionary=True,
+    )
+    return path
+
+
+def load_criteria_table(
+    path: AnyPath, models: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Load the criteria table saved by `save_criteria_table`, optionally only the partitions of some models."""
+    filters = [("model", "in", list(models))] if models is not None else None
+    df_criteria = pd.read_parquet(path, columns=list(columns) if columns is not None else None, filters=filters)
+    return df_criteria[[c for c in CRITERIA_TABLE_COLUMNS if c in df_criteria.columns]]
 
 
 def _get_unique_val_from_col(
@@ -1,14 +1,23 @@
 import ast
+import hashlib
+import json
 import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Callable, Dict, List, Optional, Sequence
 
 import datasets
+import numpy as np
 import pandas as pd
 from alpaca_eval import constants as ae_const
 from alpaca_eval import utils as ae_utils
 from alpaca_eval.types import AnyPath
 
+from .parsing import decode_json_batch, log_decoding_failures
+
 CONFIGS_DIR = Path(__file__).parent / "configs"
 MAIN_DIR = Path(__file__).parents[2]
 
@@ -19,10 +28,57 @@ def mean(x):
     return sum(x) / len(x)
 
 
+def hash_content(*contents: Any, length: int = 16) -> str:
+    """Deterministic hash of JSON serializable contents, e.g. the values of the fields of a row.
+
+    Example:
+        >>> hash_content("instruction", [{"criterion": "clarity", "weight": 50.0}])
+        'f27ef32fa9f28ea9'
+    """
+    serialized = json.dumps(contents, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:length]
+
+
+def get_instruction_ids(df: pd.DataFrame) -> pd.Series:
+    """Id of the instruction of each row: the "id" column if there is one, otherwise a hash of the instruction."""
+    if "id" in df.columns:
+        return df["id"].astype(str)
+    return df["instruction"].map(hash_content)
+
+
+def apply_in_parallel(
+    df: pd.DataFrame,
+    fn: Callable[..., pd.DataFrame],
+    n_workers: Optional[int] = None,
+    min_rows_per_worker: int = 64,
+    **fn_kwargs,
+) -> pd.DataFrame:
+    """Apply `fn(df_shard, **fn_kwargs)` to contiguous shards of `df` in a pool of processes and concatenate the
+    results in the order of the shards, so the output is the same as `fn(df, **fn_kwargs)` if `fn` is row-wise.
+
+    Args:
+        df: DataFrame to process.
+        fn: Row-wise function that takes and returns a DataFrame. Should be picklable, i.e., defined at module level.
+        n_workers: Number of processes. If None or 1, `fn` is applied in the current process. If -1, uses all CPUs.
+        min_rows_per_worker: Minimum number of rows per shard, to avoid paying the pickling overhead for small inputs.
+        fn_kwargs: Additional keyword arguments to pass to `fn`.
+    """
+    if n_workers == -1:
+        n_workers = os.cpu_count() or 1
+    n_shards = min(n_workers or 1, math.ceil(len(df) / min_rows_per_worker))
+    if n_shards <= 1:
+        return fn(df, **fn_kwargs)
+
+    shards = [df.iloc[idcs] for idcs in np.array_split(np.arange(len(df)), n_shards)]
+    with ProcessPoolExecutor(max_workers=n_shards) as executor:
+        processed = list(executor.map(partial(fn, **fn_kwargs), shards))
+    return pd.concat(processed)
+
+
 def percentage_scale_df_(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
     """Scale a certain column in the df so that it's normalized in percentage (i.e. divide by sum)."""
     for col in columns:
-        df[col] = df[col].apply(lambda x: x / df[col].sum()) * 100
+        df[col] = df[col] / df[col].sum() * 100
     return df
 
 
@@ -84,15 +140,12 @@ def expand_json_column(
         logging.warning(f"{mask.sum()} examples have empty {column_name} and will be dropped.")
         df = df[~mask]
 
-    df[column_name] = df[column_name].apply(literal_eval_if_string)
-
-    # convert the annotated string to a dictionary
-    mask = df[column_name] == ""
-    if mask.any():
-        logging.warning(
-            f"{mask.sum()} examples have not been able to be parsed from {column_name} and will be dropped."
-        )
-        df = df[~mask]
+    # convert the annotated strings to dictionaries
+    decoded, reasons = decode_json_batch(df[column_name].tolist())
+    df[column_name] = pd.Series(decoded, index=df.index, dtype=object)
+    if log_decoding_failures(reasons, column_name) > 0:
+        logging.warning(f"The examples that could not be decoded from {column_name} will be dropped.")
+        df = df[[reason is None for reason in reasons]]
 
     # Splits up the columns from the annotation key into separate columns
     columns_to_add = pd.json_normalize(df[column_name], max_level=0)
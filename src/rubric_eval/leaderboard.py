@@ -0,0 +1,265 @@
+"""Leaderboard of all the evaluated models: rankings, per category rankings, pairwise win rates and significance.
+
+The evaluations of each model are either raw evaluations (one score per instruction, e.g. `evaluations.json` of a sweep)
+or only a report (`report_evaluations_*.json`, mean and SEM of the scores). Models with raw evaluations are compared with
+a paired bootstrap over the shared instructions, models with only a report are resampled from their mean and SEM.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from alpaca_eval.types import AnyPath
+
+from .bootstrap import CONFIDENCE_LEVEL, N_BOOTSTRAP_RESAMPLES, bootstrap_means, get_bootstrap_counts
+from .bootstrap import rank_stability_from_bootstrap
+from .helpers import MAIN_DIR, get_instruction_ids
+
+__all__ = [
+    "find_evaluation_files",
+    "load_evaluation_summary",
+    "load_evaluation_summaries",
+    "make_leaderboard",
+    "leaderboard_to_dict",
+    "format_leaderboard_md",
+]
+
+EVALUATIONS_DIR = MAIN_DIR / "data" / "evaluations"
+LEADERBOARD_CACHE_NAME = "leaderboard_cache.json"
+SCORE_COLUMN = "weighted_score"
+
+
+def find_evaluation_files(evaluations_dir: AnyPath = EVALUATIONS_DIR) -> list[Path]:
+    """Return the raw evaluations (`*evaluations*.json`) and the reports (`report_*.json`) under `evaluations_dir`."""
+    return sorted(
+        p
+        for p in Path(evaluations_dir).rglob("*.json")
+        if p.name.startswith("report_") or "evaluations" in p.name
+    )
+
+
+def load_evaluation_summary(path: AnyPath) -> dict[str, Any]:
+    """Load the part of an evaluation file that is needed by the leaderboard.
+
+    Returns:
+        dict: With keys "model", "evaluator" and "kind". For raw evaluations (kind "raw") also "ids", "categories" and
+        "scores", one per instruction. For reports (kind "report") "mean", "sem", "mean_per_category" and
+        "sem_per_category".
+    """
+    path = Path(path)
+    with open(path) as f:
+        content = json.load(f)
+
+    if path.name.startswith("report_"):
+        return dict(
+            kind="report",
+            model=content.get("model") or path.parent.name,
+            evaluator=content.get("evaluator"),
+            mean=content[f"{SCORE_COLUMN}_mean"],
+            sem=content[f"{SCORE_COLUMN}_sem"],
+            mean_per_category=content.get(f"{SCORE_COLUMN}_per_category", {}),
+            sem_per_category=content.get("weighted_sem_per_category", {}),
+        )
+
+    df = pd.DataFrame(content)
+    return dict(
+        kind="raw",
+        model=str(df["model"].iloc[0]) if "model" in df.columns else path.parent.name,
+        evaluator=str(df["evaluator"].iloc[0]) if "evaluator" in df.columns else None,
+        ids=get_instruction_ids(df).tolist(),
+        categories=df["category"].astype(str).tolist() if "category" in df.columns else None,
+        scores=pd.to_numeric(df[SCORE_COLUMN], errors="coerce").tolist(),
+    )
+
+
+def load_evaluation_summaries(
+    paths: Sequence[AnyPath],
+    cache_path: Optional[AnyPath] = None,
+    max_workers: Optional[int] = None,
+) -> list[dict[str, Any]]:
+    """Load the summaries of the evaluation files in parallel threads. If `cache_path` is given, the summaries are
+    materialized there keyed by the path, modification time and size of each file, so that only the new or modified
+    files are parsed again. Files that cannot be read are skipped (and not cached, so they are read again once fixed).
+    """
+    cache = {}
+    if cache_path is not None and Path(cache_path).exists():
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    stats = {str(p): os.stat(p) for p in paths}
+    keys = {p: [s.st_mtime_ns, s.st_size] for p, s in stats.items()}
+    to_load = [p for p in stats if p not in cache or cache[p]["key"] != keys[p]]
+    logging.info(f"Loading {len(to_load)} new or modified evaluation files, {len(stats) - len(to_load)} are cached.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = dict(zip(to_load, executor.map(_try_load_evaluation_summary, to_load)))
+
+    # removed and unreadable files are dropped from the cache
+    cache = {
+        p: cache[p] if p not in loaded else dict(key=keys[p], summary=loaded[p])
+        for p in stats
+        if p not in loaded or loaded[p] is not None
+    }
+    if cache_path is not None:
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+
+    return [dict(entry["summary"], path=p, mtime_ns=entry["key"][0]) for p, entry in cache.items()]
+
+
+def _try_load_evaluation_summary(path: AnyPath) -> Optional[dict[str, Any]]:
+    """Same as `load_evaluation_summary` but returns None (and logs a warning) if the file cannot be read."""
+    try:
+        return load_evaluation_summary(path)
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        logging.warning(f"Skipping the evaluation file {path} that cannot be read: {e!r}")
+        return None
+
+
+def _select_summaries(summaries: list[dict[str, Any]], evaluator: Optional[str] = None) -> list[dict[str, Any]]:
+    """Keep a single evaluator and a single file per model (raw evaluations over reports, then the latest file)."""
+    evaluators = pd.Series([s["evaluator"] for s in summaries], dtype=object)
+    if evaluator is None and evaluators.nunique() > 1:
+        evaluator = evaluators.mode().iloc[0]
+        logging.warning(
+            f"Found evaluations from {evaluators.nunique()} evaluators whose scores are not comparable, only keeping"
+            f" the most common one: {evaluator}."
+        )
+    if evaluator is not None:
+        summaries = [s for s in summaries if s["evaluator"] == evaluator]
+
+    selected = {}
+    for summary in sorted(summaries, key=lambda s: (s["kind"] == "raw", s["mtime_ns"])):
+        selected[summary["model"]] = summary
+    return list(selected.values())
+
+
+def make_leaderboard(
+    summaries: list[dict[str, Any]],
+    evaluator: Optional[str] = None,
+    n_bootstrap_resamples: int = N_BOOTSTRAP_RESAMPLES,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    seed: int = 123,
+) -> dict[str, Any]:
+    """Rank the models overall and per category with bootstrap confidence intervals, and compute the pairwise win rates
+    (on the shared instructions of models with raw evaluations) and the bootstrap p-values of the pairwise differences.
+
+    Returns:
+        dict: With keys "evaluator", "rankings" (DataFrame indexed by model, see `bootstrap.rank_stability`),
+        "rankings_per_category" (dict of such DataFrames), "win_rates" and "p_values" ((model, model) DataFrames).
+    """
+    summaries = _select_summaries(summaries, evaluator=evaluator)
+    raw = [s for s in summaries if s["kind"] == "raw"]
+    reports = [s for s in summaries if s["kind"] == "report"]
+    models = [s["model"] for s in raw + reports]
+
+    # (models, instructions) matrix of the raw scores, aligned on the instruction ids
+    df_raw = pd.DataFrame(
+        [(s["model"], id_, score) for s in raw for id_, score in zip(s["ids"], s["scores"])],
+        columns=["model", "id", "score"],
+    )
+    scores = df_raw.pivot_table(index="model", columns="id", values="score", aggfunc="mean", dropna=False)
+    scores = scores.reindex([s["model"] for s in raw])
+    id_to_category = {
+        id_: c for s in raw if s["categories"] is not None for id_, c in zip(s["ids"], s["categories"])
+    }
+    categories_raw = scores.columns.map(lambda id_: id_to_category.get(id_)).to_numpy(dtype=object)
+    # the same resampled instructions for all the models and categories, so the bootstrap is paired
+    counts = get_bootstrap_counts(scores.shape[1], n_resamples=n_bootstrap_resamples, seed=seed)
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((len(reports), n_bootstrap_resamples))
+
+    def _rank(columns: np.ndarray, report_means: Sequence[float], report_sems: Sequence[float]):
+        values = scores.to_numpy(dtype=np.float64)[:, columns]
+        with np.errstate(invalid="ignore"):
+            means = np.concatenate([np.nanmean(values, axis=1), report_means])
+        boot_means = np.concatenate(
+            [
+                bootstrap_means(values, counts=counts[:, columns]).reshape(len(raw), n_bootstrap_resamples),
+                np.asarray(report_means, dtype=float)[:, None] + np.asarray(report_sems, dtype=float)[:, None] * noise,
+            ]
+        )
+        return rank_stability_from_bootstrap(means, boot_means, index=models, confidence_level=confidence_level), boot_means
+
+    all_columns = np.ones(scores.shape[1], dtype=bool)
+    rankings, boot_means = _rank(all_columns, [s["mean"] for s in reports], [s["sem"] for s in reports])
+
+    rankings_per_category = {}
+    all_categories = set(categories_raw[pd.notnull(categories_raw)]) | {c for s in reports for c in s["mean_per_category"]}
+    for category in sorted(all_categories):
+        rankings_per_category[category], _ = _rank(
+            categories_raw == category,
+            [s["mean_per_category"].get(category, np.nan) for s in reports],
+            [s["sem_per_category"].get(category, np.nan) for s in reports],
+        )
+
+    return dict(
+        evaluator=next((s["evaluator"] for s in summaries), evaluator),
+        rankings=rankings,
+        rankings_per_category=rankings_per_category,
+        win_rates=_get_win_rates(scores).reindex(index=models, columns=models),
+        p_values=_get_p_values(boot_means, models),
+    )
+
+
+def _get_win_rates(scores: pd.DataFrame) -> pd.DataFrame:
+    """Fraction of the shared instructions on which the row model has a higher score than the column model (ties count
+    as half a win)."""
+    values = scores.to_numpy(dtype=np.float64)
+    row, col = values[:, None, :], values[None, :, :]
+    is_shared = ~np.isnan(row) & ~np.isnan(col)
+    wins = ((row > col) + 0.5 * (row == col)) * is_shared
+    with np.errstate(divide="ignore", invalid="ignore"):
+        win_rates = wins.sum(axis=2) / is_shared.sum(axis=2)
+    np.fill_diagonal(win_rates, np.nan)
+    return pd.DataFrame(win_rates, index=scores.index, columns=scores.index)
+
+
+def _get_p_values(boot_means: np.ndarray, models: Sequence[str]) -> pd.DataFrame:
+    """Two sided bootstrap p-values of the difference of the mean scores of each pair of models."""
+    row, col = boot_means[:, None, :], boot_means[None, :, :]
+    p_values = 2 * np.minimum((row <= col).mean(axis=2), (row >= col).mean(axis=2))
+    p_values = np.minimum(p_values, 1.0)
+    np.fill_diagonal(p_values, np.nan)
+    return pd.DataFrame(p_values, index=models, columns=models)
+
+
+def leaderboard_to_dict(leaderboard: dict[str, Any]) -> dict[str, Any]:
+    """JSON serializable version of the output of `make_leaderboard`."""
+    return dict(
+        evaluator=leaderboard["evaluator"],
+        rankings=leaderboard["rankings"].reset_index(names="model").to_dict(orient="records"),
+        rankings_per_category={
+            category: df.reset_index(names="model").to_dict(orient="records")
+            for category, df in leaderboard["rankings_per_category"].items()
+        },
+        win_rates=leaderboard["win_rates"].to_dict(),
+        p_values=leaderboard["p_values"].to_dict(),
+    )
+
+
+def format_leaderboard_md(leaderboard: dict[str, Any]) -> str:
+    """Format the rankings of `make_leaderboard` as markdown tables."""
+
+    def _format_table(df: pd.DataFrame) -> str:
+        lines = [
+            "| Rank | Model | Score | CI | Rank CI | P(rank) |",
+            "|---:|:---|---:|:---|:---|---:|",
+        ]
+        for model, r in df.iterrows():
+            lines.append(
+                f"| {int(r['rank'])} | {model} | {r['mean']:.2f} | [{r['ci_lower']:.2f}, {r['ci_upper']:.2f}]"
+                f" | [{int(r['rank_ci_lower'])}, {int(r['rank_ci_upper'])}] | {r['proba_rank']:.2f} |"
+            )
+        return "\n".join(lines)
+
+    sections = [f"# Leaderboard\n\nEvaluator: {leaderboard['evaluator']}", _format_table(leaderboard["rankings"])]
+    for category, df in leaderboard["rankings_per_category"].items():
+        df = df.dropna(subset=["mean"])
+        if len(df) > 0:
+            sections.append(f"## {category}\n\n{_format_table(df)}")
+    return "\n\n".join(sections) + "\n"
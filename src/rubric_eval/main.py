@@ -7,15 +7,19 @@ How to run:
 4. rubric_eval generate_rubrics --input_path=instructions.json
 5. rubric_eval generate_outputs --model_configs=gpt-4o-2024-05-13 --input_path=instructions_with_rubrics.json
 6. rubric_eval --model_configs=gpt-4o-2024-05-13 --input_path=outputs.json
+
+Add `--dry_run` to any command to print the projected number of tokens, cost and time without sending any request.
 """
 
 
+import inspect
 import json
 import logging
 import sys
 import re
+from functools import partial, wraps
 from pathlib import Path
-from typing import Any, Optional, Union
+from typing import Any, Optional, Sequence, Union
 
 import fire
 import numpy as np
@@ -29,13 +33,34 @@ from rubric_eval import (
     Rubricator,
     RubricBrainstormer,
     format_evaluation_report_md,
+    make_criteria_table,
     make_evaluation_report_dict,
+    save_criteria_table,
     summarize,
 )
 
-from .helpers import check_df_fields, get_output_path, process_input_df_
+from .checkpoints import run_with_checkpoints
+from .completion_cache import get_completion_cache
+from .estimate import estimate_stages, format_estimates
+from .helpers import CONFIGS_DIR, check_df_fields, get_output_path, process_input_df_
+from .leaderboard import (
+    EVALUATIONS_DIR,
+    LEADERBOARD_CACHE_NAME,
+    find_evaluation_files,
+    format_leaderboard_md,
+    leaderboard_to_dict,
+    load_evaluation_summaries,
+    make_leaderboard,
+)
+from .pipeline import AsyncArtifactWriter, JSONRecordsWriter, run_streaming_stages
+from .sweep import Task, run_dag
 
 CUR_DIR = Path(__file__).parent
+EVALUATION_HASH_COLUMN = "evaluation_hash"
+# values of `--dry_run <bool>` and `--dry_run=<bool>`
+_BOOL_STRINGS = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+# JSON caches of the annotations written by alpaca_eval next to the configs of the annotators
+ANNOTATIONS_CACHE_PATTERN = re.compile(r"^annotations_seed(?P<seed>\d+)_(?P<configs>.+)\.json$")
 
 __all__ = [
     "brainstorm_rubrics",
@@ -46,6 +71,10 @@ __all__ = [
     "brainstorm_and_generate_rubrics",
     "evaluate_and_generate_report",
     "generate_outputs_and_evaluation_report",
+    "run_streaming_pipeline",
+    "sweep",
+    "leaderboard",
+    "migrate_caches",
 ]
 
 logger = logging.getLogger(__name__)
@@ -56,6 +85,8 @@ def brainstorm_rubrics(  # from path
     output_path: Optional[AnyPath] = None,
     brainstormer_configs: AnyPath = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
+    is_resume: bool = False,
+    max_instances: Optional[int] = None,
     **brainstormer_kwargs,
 ) -> Path:
     """Generate brainstormed rubrics for given instructions.
@@ -75,14 +106,23 @@ def brainstorm_rubrics(  # from path
             `rubric_eval/configs/rubric_brainstormer_configs`.
         is_rm_prev_columns (bool, optional): Whether to remove unecessary columns from previous steps (e.g., learning
             objectives and useful_info_to_eval_instruction).
+        is_resume (bool, optional): Whether to resume from the rows saved in the `.partial.jsonl` write-ahead file
+            of a previous run that crashed or was interrupted. Finished rows are always appended to that file.
+        max_instances (Optional[int], optional): Maximum number of instructions to process, sampled at random.
         **brainstormer_kwargs: Additional keyword arguments to pass to the rubric brainstormer.
     """
-    df = ae_utils.load_or_convert_to_dataframe(input_path)
-    df_with_brainstorm = brainstorm_rubrics_from_df(
-        df, brainstormer_configs, is_rm_prev_columns=is_rm_prev_columns, **brainstormer_kwargs
-    )
+    df = _sample_max_instances(ae_utils.load_or_convert_to_dataframe(input_path), max_instances)
+    rubric_brainstormer = RubricBrainstormer(annotators_config=brainstormer_configs, **brainstormer_kwargs)
     output_path = get_output_path(input_path, output_path, sffx="_with_brainstorm")
-    df_with_brainstorm.to_json(output_path, orient="records", indent=4)
+    run_with_checkpoints(
+        df,
+        partial(
+            brainstorm_rubrics_from_df, is_rm_prev_columns=is_rm_prev_columns, rubric_brainstormer=rubric_brainstormer
+        ),
+        output_path,
+        is_resume=is_resume,
+        fn_hash_rows=rubric_brainstormer.hash_rows,
+    )
     logger.info(f"Instructions with brainstormed rubrics are written to: {output_path}")
     return output_path
 
@@ -92,20 +132,20 @@ def brainstorm_rubrics_from_df(
     brainstormer_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
     max_instances: Optional[int] = None,
+    rubric_brainstormer: Optional[RubricBrainstormer] = None,
     **brainstormer_kwargs,
 ) -> pd.DataFrame:
-    """Same as brainstorm_rubrics but takes a DataFrame as input and output."""
-    if max_instances:
-        n_inputs = len(df_input)
-        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
-        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    """Same as brainstorm_rubrics but takes a DataFrame as input and output. If `rubric_brainstormer` is given it is
+    used instead of initializing a new one from `brainstormer_configs`."""
+    df_input = _sample_max_instances(df_input, max_instances)
 
     process_input_df_(
         df_input,
         required_fields={"instruction"},
         optional_fields={"useful_info_to_eval_instruction": ""},
     )
-    rubric_brainstormer = RubricBrainstormer(annotators_config=brainstormer_configs, **brainstormer_kwargs)
+    if rubric_brainstormer is None:
+        rubric_brainstormer = RubricBrainstormer(annotators_config=brainstormer_configs, **brainstormer_kwargs)
     brainstormed_rubric = rubric_brainstormer(df_input)
     # converts rubric from string to list of dict, and renormalize weight as percentage
     df_brainstormed = rubric_brainstormer.make_df_rubrics(
@@ -122,6 +162,8 @@ def generate_rubrics(
     output_path: Optional[AnyPath] = None,
     rubricator_configs: AnyPath = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
+    is_resume: bool = False,
+    max_instances: Optional[int] = None,
     **rubricator_kwargs,
 ) -> Path:
     """Generate detailed rubrics for given instructions.
@@ -139,14 +181,21 @@ def generate_rubrics(
             `rubric_eval/configs/rubricator_configs`.
         is_rm_prev_columns (bool, optional): Whether to remove unecessary columns from previous steps (e.g., brainstormed
             rubrics and learning_objectives).
+        is_resume (bool, optional): Whether to resume from the rows saved in the `.partial.jsonl` write-ahead file
+            of a previous run that crashed or was interrupted. Finished rows are always appended to that file.
+        max_instances (Optional[int], optional): Maximum number of instructions to process, sampled at random.
         **rubricator_kwargs: Additional keyword arguments to pass to the rubricator
     """
-    df = ae_utils.load_or_convert_to_dataframe(input_path)
-    df_with_rubrics = generate_rubrics_from_df(
-        df, rubricator_configs, is_rm_prev_columns=is_rm_prev_columns, **rubricator_kwargs
-    )
+    df = _sample_max_instances(ae_utils.load_or_convert_to_dataframe(input_path), max_instances)
+    rubricator = Rubricator(annotators_config=rubricator_configs, **rubricator_kwargs)
     output_path = get_output_path(input_path, output_path, sffx="_with_rubrics", to_rm=["_with_brainstorm"])
-    df_with_rubrics.to_json(output_path, orient="records", indent=4)
+    run_with_checkpoints(
+        df,
+        partial(generate_rubrics_from_df, is_rm_prev_columns=is_rm_prev_columns, rubricator=rubricator),
+        output_path,
+        is_resume=is_resume,
+        fn_hash_rows=rubricator.hash_rows,
+    )
     logger.info(f"Instructions with generated rubrics are written to: {output_path}")
     return output_path
 
@@ -156,20 +205,20 @@ def generate_rubrics_from_df(
     rubricator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
     max_instances: Optional[int] = None,
+    rubricator: Optional[Rubricator] = None,
     **rubricator_kwargs,
 ) -> pd.DataFrame:
-    """Same as generate_rubrics but takes a DataFrame as input and output."""
-    if max_instances:
-        n_inputs = len(df_input)
-        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
-        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    """Same as generate_rubrics but takes a DataFrame as input and output. If `rubricator` is given it is used instead
+    of initializing a new one from `rubricator_configs`."""
+    df_input = _sample_max_instances(df_input, max_instances)
 
     process_input_df_(
         df_input,
         required_fields={"instruction", "brainstormed_rubric"},
         optional_fields={"brainstormed_response": ""},
     )
-    rubricator = Rubricator(annotators_config=rubricator_configs, **rubricator_kwargs)
+    if rubricator is None:
+        rubricator = Rubricator(annotators_config=rubricator_configs, **rubricator_kwargs)
     list_rubrics = rubricator(df_input)
 
     df_rubrics = rubricator.make_df_rubrics(list_rubrics, is_extract_criteria_col=True, is_renormalize_weight=True)
@@ -214,6 +263,8 @@ def generate_outputs(
     output_path: Optional[AnyPath] = None,
     is_rm_prev_columns: bool = True,
     dataset_name: Optional[str] = None,
+    is_resume: bool = False,
+    max_instances: Optional[int] = None,
     **outputer_kwargs,
 ) -> Path:
     """Generate model outputs for given instructions.
@@ -235,22 +286,73 @@ def generate_outputs(
             rubrics and learning_objectives).
         dataset_name: Optional[str]: Name of the benchmark. If provided, it will be added as a column to the output.
             If not provided, the benchmark name will be the input path.
+        is_resume (bool, optional): Whether to resume from the rows saved in the `.partial.jsonl` write-ahead file
+            of a previous run that crashed or was interrupted. Finished rows are always appended to that file.
+        max_instances (Optional[int], optional): Maximum number of instructions to process, sampled at random.
         **outputer_kwargs: Additional keyword arguments to pass to the outputer.
     """
     df = ae_utils.load_or_convert_to_dataframe(input_path)
+    _, output_path = _generate_outputs(
+        df,
+        model_configs,
+        input_path,
+        output_path,
+        is_rm_prev_columns=is_rm_prev_columns,
+        dataset_name=dataset_name,
+        is_resume=is_resume,
+        max_instances=max_instances,
+        **outputer_kwargs,
+    )
+    return output_path
+
+
+def _generate_outputs(
+    df: pd.DataFrame,
+    model_configs: Optional[AnyPath],
+    input_path: AnyPath,
+    output_path: Optional[AnyPath] = None,
+    is_rm_prev_columns: bool = True,
+    dataset_name: Optional[str] = None,
+    is_resume: bool = False,
+    max_instances: Optional[int] = None,
+    writer: Optional[AsyncArtifactWriter] = None,
+    **outputer_kwargs,
+) -> tuple[pd.DataFrame, Path]:
+    """Same as generate_outputs but takes the loaded input and also returns the outputs. If `writer` is given the
+    outputs are saved in the background."""
     dataset_name = _get_dataset_name(input_path, dataset_name)
     if model_configs is None:
         if "output" not in df.columns:
             raise ValueError("`model_configs=None` but the input input DataFrame doesn't contain an 'output' column.")
-        return input_path
+        return df, input_path
 
-    df_outputs = generate_outputs_from_df(
-        df, model_configs, is_rm_prev_columns=is_rm_prev_columns, dataset_name=dataset_name, **outputer_kwargs
-    )
+    df = _sample_max_instances(df, max_instances)
+    outputer = Outputer(annotators_config=model_configs, **outputer_kwargs)
     output_path = get_output_path(input_path, output_path, prfx="outputs_", to_rm=["instructions_", "instructions"])
-    df_outputs.to_json(output_path, orient="records", indent=4)
+    df_outputs = run_with_checkpoints(
+        df,
+        partial(
+            generate_outputs_from_df,
+            is_rm_prev_columns=is_rm_prev_columns,
+            dataset_name=dataset_name,
+            outputer=outputer,
+        ),
+        output_path,
+        is_resume=is_resume,
+        writer=writer,
+        fn_hash_rows=outputer.hash_rows,
+    )
     logger.info(f"Instructions with generated rubrics are written to: {output_path}")
-    return output_path
+    return df_outputs, output_path
+
+
+def _sample_max_instances(df_input: pd.DataFrame, max_instances: Optional[int]) -> pd.DataFrame:
+    """Sample at most `max_instances` rows of the input (always the same ones for a given input)."""
+    if max_instances:
+        n_inputs = len(df_input)
+        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
+        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    return df_input
 
 
 def _get_dataset_name(input_path: AnyPath, dataset_name: Optional[str]) -> Optional[str]:
@@ -273,16 +375,16 @@ def generate_outputs_from_df(
     is_rm_prev_columns: bool = True,
     dataset_name: Optional[Union[AnyPath, str]] = None,  # name or path
     max_instances: Optional[int] = None,
+    outputer: Optional[Outputer] = None,
     **outputer_kwargs,
 ) -> pd.DataFrame:
-    """Same as generate_rubrics but takes a DataFrame as input and output."""
-    if max_instances:
-        n_inputs = len(df_input)
-        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
-        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    """Same as generate_outputs but takes a DataFrame as input and output. If `outputer` is given it is used instead
+    of initializing a new one from `model_configs`."""
+    df_input = _sample_max_instances(df_input, max_instances)
 
     process_input_df_(df_input, required_fields={"instruction"})
-    outputer = Outputer(annotators_config=model_configs, **outputer_kwargs)
+    if outputer is None:
+        outputer = Outputer(annotators_config=model_configs, **outputer_kwargs)
     outputs = outputer(df_input)
     df_outputs = ae_utils.convert_to_dataframe(outputs)
     if is_rm_prev_columns:
@@ -311,6 +413,10 @@ def evaluate(
     output_path: Optional[AnyPath] = None,
     evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
+    is_resume: bool = False,
+    is_incremental: bool = False,
+    max_instances: Optional[int] = None,
+    criteria_table_path: Optional[AnyPath] = "auto",
     **evaluator_kwargs,
 ) -> Path:
     """Evaluate model outputs using generated rubrics.
@@ -326,19 +432,126 @@ def evaluate(
         evaluator_configs (str, optional): Configuration for the evaluator. Defaults to "gpt-4o-2024-08-06_CoT_v0".
         is_rm_prev_columns (bool, optional): Whether to remove unecessary columns from previous steps (e.g., brainstormed
             rubrics and learning_objectives).
+        is_resume (bool, optional): Whether to resume from the rows saved in the `.partial.jsonl` write-ahead file
+            of a previous run that crashed or was interrupted. Finished rows are always appended to that file.
+        is_incremental (bool, optional): Whether to only evaluate the rows that are new or changed compared to the
+            evaluations already in `output_path`. Rows are compared using the hash of the evaluator's primary keys
+            (instruction, rubric, output, ...) and of the evaluator configs, stored in the "evaluation_hash" column.
+            The evaluations of the rows that are not in the input anymore are dropped. The "evaluation_hash" column is
+            only added to the evaluations in incremental mode.
+        max_instances (Optional[int], optional): Maximum number of instructions to process, sampled at random.
+        criteria_table_path (Optional[AnyPath], optional): Directory of the Parquet dataset with one row per graded
+            criterion (instruction_id, model, evaluator, criterion, weight, performance, score, feedback), partitioned
+            by model. Evaluations of different models can be saved to the same directory. If "auto", uses
+            `{output_path stem}_criteria` next to the output. If None, the table is not saved.
         **evaluator_kwargs: Additional keyword arguments to pass to the evaluator.
     """
     df = ae_utils.load_or_convert_to_dataframe(input_path)
-    df_evaluations = evaluate_from_df(
+    _, output_path = _evaluate(
         df,
+        input_path,
+        output_path,
         evaluator_configs,
         is_rm_prev_columns=is_rm_prev_columns,
+        is_resume=is_resume,
+        is_incremental=is_incremental,
+        max_instances=max_instances,
+        criteria_table_path=criteria_table_path,
         **evaluator_kwargs,
     )
+    return output_path
+
+
+def _evaluate(
+    df: pd.DataFrame,
+    input_path: AnyPath,
+    output_path: Optional[AnyPath] = None,
+    evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
+    is_rm_prev_columns: bool = True,
+    is_resume: bool = False,
+    is_incremental: bool = False,
+    max_instances: Optional[int] = None,
+    criteria_table_path: Optional[AnyPath] = "auto",
+    writer: Optional[AsyncArtifactWriter] = None,
+    **evaluator_kwargs,
+) -> tuple[pd.DataFrame, Path]:
+    """Same as evaluate but takes the loaded input and also returns the evaluations. If `writer` is given the
+    evaluations are saved in the background."""
+    df = _sample_max_instances(df, max_instances)
+    evaluator = Evaluator(annotators_config=evaluator_configs, **evaluator_kwargs)
     output_path = get_output_path(input_path, output_path, sffx="_with_evaluations", to_rm=["_with_rubrics"])
-    df_evaluations.to_json(output_path, orient="records", indent=4)
+
+    fn_postprocess = None
+    if is_incremental:
+        # on a copy, to not add the column to the caller's DataFrame
+        df = df.assign(**{EVALUATION_HASH_COLUMN: evaluator.hash_rows(df)})
+
+    if is_incremental and Path(output_path).exists():
+        df_previous = ae_utils.load_or_convert_to_dataframe(output_path)
+        if EVALUATION_HASH_COLUMN not in df_previous.columns:
+            logger.warning(f"{output_path} doesn't have `{EVALUATION_HASH_COLUMN}`, so we evaluate all the rows.")
+        else:
+            df_previous = df_previous[df_previous[EVALUATION_HASH_COLUMN].isin(df[EVALUATION_HASH_COLUMN])]
+            df_input = df
+            df = df[~df[EVALUATION_HASH_COLUMN].isin(df_previous[EVALUATION_HASH_COLUMN])]
+            logger.info(f"Incremental evaluation: {len(df_input) - len(df)} rows are unchanged, evaluating {len(df)}.")
+            fn_postprocess = partial(_merge_incremental_evaluations, df_input=df_input, df_previous=df_previous)
+
+    df_evaluations = run_with_checkpoints(
+        df,
+        partial(evaluate_from_df, is_rm_prev_columns=is_rm_prev_columns, evaluator=evaluator),
+        output_path,
+        is_resume=is_resume,
+        fn_postprocess=fn_postprocess,
+        writer=writer,
+        fn_hash_rows=evaluator.hash_rows,
+    )
     logger.info(f"Evaluation results are written to: {output_path}")
-    return output_path
+
+    if criteria_table_path is not None and not df_evaluations.empty:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.warning("Skipping the criteria table, which requires `pyarrow` (`pip install pyarrow`).")
+            criteria_table_path = None
+
+    if criteria_table_path is not None and not df_evaluations.empty:
+        if criteria_table_path == "auto":
+            criteria_table_path = Path(output_path).with_name(f"{Path(output_path).stem}_criteria")
+        df_criteria = make_criteria_table(df_evaluations)
+        if writer is None:
+            save_criteria_table(df_criteria, criteria_table_path)
+        else:
+            writer.submit(save_criteria_table, df_criteria, criteria_table_path)
+        logger.info(f"Criteria table is written to: {criteria_table_path}")
+    return df_evaluations, output_path
+
+
+def _merge_incremental_evaluations(
+    df_new: pd.DataFrame, df_input: pd.DataFrame, df_previous: pd.DataFrame
+) -> pd.DataFrame:
+    """Merge the new evaluations with the previous ones that are still valid, in the order of the input. Repeated
+    input rows get the same evaluation.
+
+    Example:
+        >>> df_input = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a", "b", "a", "c"]})
+        >>> df_previous = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a", "a"], "score": [1, 1]})
+        >>> df_new = pd.DataFrame({EVALUATION_HASH_COLUMN: ["b"], "score": [2]})
+        >>> _merge_incremental_evaluations(df_new, df_input=df_input, df_previous=df_previous)["score"].tolist()
+        [1, 2, 1]
+    """
+    df_all = pd.concat([df_previous, df_new], ignore_index=True)
+    df_all = df_all.drop_duplicates(subset=[EVALUATION_HASH_COLUMN], keep="last")
+    # inner merge keeps the order of the input and drops the rows whose evaluation failed
+    df_merged = df_input[[EVALUATION_HASH_COLUMN]].merge(
+        df_all, on=EVALUATION_HASH_COLUMN, how="inner", validate="many_to_one"
+    )
+    if len(df_merged) != len(df_input):
+        logger.warning(
+            f"{len(df_input) - len(df_merged)} of the {len(df_input)} rows don't have an evaluation, probably because"
+            " it failed. They are not in the output and will be evaluated by the next incremental evaluation."
+        )
+    return df_merged
 
 
 def evaluate_from_df(
@@ -346,13 +559,12 @@ def evaluate_from_df(
     evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     is_rm_prev_columns: bool = True,
     max_instances: Optional[int] = None,
+    evaluator: Optional[Evaluator] = None,
     **evaluator_kwargs,
 ) -> pd.DataFrame:
-    """Same as evaluate but takes a DataFrame as input and output."""
-    if max_instances:
-        n_inputs = len(df_input)
-        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
-        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    """Same as evaluate but takes a DataFrame as input and output. If `evaluator` is given it is used instead of
+    initializing a new one from `evaluator_configs`."""
+    df_input = _sample_max_instances(df_input, max_instances)
 
     process_input_df_(
         df_input,
@@ -360,7 +572,8 @@ def evaluate_from_df(
         optional_fields={"excellent_response": ""},
     )
 
-    evaluator = Evaluator(annotators_config=evaluator_configs, **evaluator_kwargs)
+    if evaluator is None:
+        evaluator = Evaluator(annotators_config=evaluator_configs, **evaluator_kwargs)
     evaluations = evaluator(df_input)
     df_eval = evaluator.make_df_rubric_grading(evaluations)
     if is_rm_prev_columns:
@@ -399,20 +612,47 @@ def generate_report(
         **report_kwargs: Additional keyword arguments to pass to the report generator.
     """
     df = ae_utils.load_or_convert_to_dataframe(input_path)
+    return _generate_report(df, input_path, output_path, summarizer_configs, **summarizer_kwargs)
+
+
+def _generate_report(
+    df: pd.DataFrame,
+    input_path: AnyPath,
+    output_path: Optional[AnyPath] = None,
+    summarizer_configs: Optional[str] = "unstructured_gpt-4o-2024-08-06",
+    writer: Optional[AsyncArtifactWriter] = None,
+    **summarizer_kwargs,
+) -> Path:
+    """Same as generate_report but takes the loaded evaluations. If `writer` is given the reports are saved in the
+    background."""
     report_dict, report_str = generate_report_from_df(
         df,
         summarizer_configs,
         **summarizer_kwargs,
     )
-    report_json_path = _save_reports(report_str, report_dict, input_path, output_path)
+    report_json_path = _save_reports(report_str, report_dict, input_path, output_path, writer=writer)
     return report_json_path
 
 
-def _save_reports(report_str: str, report_json: dict, input_path: AnyPath, output_path: AnyPath) -> Path:
+def _save_reports(
+    report_str: str,
+    report_json: dict,
+    input_path: AnyPath,
+    output_path: AnyPath,
+    writer: Optional[AsyncArtifactWriter] = None,
+) -> Path:
     path_kwargs = dict(prfx="report_evaluations_", to_rm=["_with_evaluations"])
     report_md_path = get_output_path(input_path, output_path, extension=".md", **path_kwargs)
     report_json_path = get_output_path(input_path, output_path, extension=".json", **path_kwargs)
 
+    if writer is None:
+        _write_reports(report_str, report_json, report_md_path, report_json_path)
+    else:
+        writer.submit(_write_reports, report_str, report_json, report_md_path, report_json_path)
+    return report_json_path
+
+
+def _write_reports(report_str: str, report_json: dict, report_md_path: Path, report_json_path: Path):
     with open(report_md_path, "w") as f:
         f.write(report_str)
 
@@ -420,7 +660,6 @@ def _save_reports(report_str: str, report_json: dict, input_path: AnyPath, outpu
         json.dump(report_json, f, indent=4)
 
     logger.info(f"Evaluation report is written to: {report_md_path} (formatted) and {report_json_path} (raw).")
-    return report_json_path
 
 
 def generate_report_from_df(
@@ -430,10 +669,7 @@ def generate_report_from_df(
     **summarizer_kwargs,
 ) -> dict[str, Any]:
     """Same as generate_report but takes a DataFrame as input and output."""
-    if max_instances:
-        n_inputs = len(df_input)
-        df_input = df_input.sample(min(max_instances, len(df_input)), random_state=123)
-        logging.info(f"We sampled {len(df_input)} from the {n_inputs} due to max_instances.")
+    df_input = _sample_max_instances(df_input, max_instances)
 
     optional_fields = {
         "criteria": "",
@@ -464,37 +700,384 @@ def evaluate_and_generate_report(
     output_path: Optional[AnyPath] = None,
     evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     summarizer_configs: Optional[str] = "unstructured_gpt-4o-2024-08-06",
+    is_resume: bool = False,
+    is_incremental: bool = False,
     **evaluator_and_summarizer_kwargs,
 ) -> Path:
-    """Evaluate model outputs using rubrics, generate a report, and save it."""
-    eval_path = evaluate(input_path, output_path, evaluator_configs, **evaluator_and_summarizer_kwargs)
-    report_path = generate_report(eval_path, output_path, summarizer_configs, **evaluator_and_summarizer_kwargs)
+    """Evaluate model outputs using rubrics, generate a report, and save it. If `is_incremental`, only the new or
+    changed rows are evaluated (see `evaluate`) but the report is regenerated from all the evaluations. The evaluations
+    are passed to the report in memory and saved in the background."""
+    df = ae_utils.load_or_convert_to_dataframe(input_path)
+    with AsyncArtifactWriter() as writer:
+        report_path = _evaluate_and_generate_report(
+            df,
+            input_path,
+            output_path,
+            evaluator_configs,
+            summarizer_configs,
+            is_resume=is_resume,
+            is_incremental=is_incremental,
+            writer=writer,
+            **evaluator_and_summarizer_kwargs,
+        )
     return report_path
 
 
+def _evaluate_and_generate_report(
+    df: pd.DataFrame,
+    input_path: AnyPath,
+    output_path: Optional[AnyPath],
+    evaluator_configs: str,
+    summarizer_configs: Optional[str],
+    is_resume: bool = False,
+    is_incremental: bool = False,
+    writer: Optional[AsyncArtifactWriter] = None,
+    **evaluator_and_summarizer_kwargs,
+) -> Path:
+    df_evaluations, eval_path = _evaluate(
+        df,
+        input_path,
+        output_path,
+        evaluator_configs,
+        is_resume=is_resume,
+        is_incremental=is_incremental,
+        writer=writer,
+        **evaluator_and_summarizer_kwargs,
+    )
+    return _generate_report(
+        df_evaluations, eval_path, output_path, summarizer_configs, writer=writer, **evaluator_and_summarizer_kwargs
+    )
+
+
 def generate_outputs_and_evaluation_report(
     input_path: AnyPath,
     output_path: Optional[AnyPath] = None,
     model_configs: Optional[str] = None,
     evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
     summarizer_configs: Optional[str] = "unstructured_gpt-4o-2024-08-06",
+    is_resume: bool = False,
     **completor_evaluator_summarizer_kwargs,
 ):
     """Generate model outputs, evaluate them using rubrics, and generate the evaluation report. If `model_configs` is
     `None`, then the function will not generate outputs, so the input DataFrame should contain an "output" column.
+    The DataFrames are passed between the stages in memory and the intermediate results are saved in the background.
+    """
+    df = ae_utils.load_or_convert_to_dataframe(input_path)
+    with AsyncArtifactWriter() as writer:
+        df_outputs, completion_path = _generate_outputs(
+            df,
+            model_configs,
+            input_path,
+            output_path,
+            is_resume=is_resume,
+            writer=writer,
+            **completor_evaluator_summarizer_kwargs,
+        )
+        report_path = _evaluate_and_generate_report(
+            df_outputs,
+            completion_path,
+            output_path,
+            evaluator_configs,
+            summarizer_configs,
+            is_resume=is_resume,
+            writer=writer,
+            **completor_evaluator_summarizer_kwargs,
+        )
+    return report_path
+
+
+def run_streaming_pipeline(
+    input_path: AnyPath,
+    output_path: Optional[AnyPath] = None,
+    brainstormer_configs: Optional[AnyPath] = "gpt-4o-2024-08-06_CoT_v0",
+    rubricator_configs: Optional[AnyPath] = "gpt-4o-2024-08-06_CoT_v0",
+    model_configs: Optional[AnyPath] = None,
+    evaluator_configs: Optional[AnyPath] = "gpt-4o-2024-08-06_CoT_v0",
+    dataset_name: Optional[str] = None,
+    chunksize: int = 8,
+    max_in_flight: int = 2,
+    **annotators_kwargs,
+) -> Path:
+    """Brainstorm rubrics, generate rubrics, generate outputs and evaluate them, streaming chunks of instructions
+    through the stages. Contrary to running each step separately, a chunk moves to the next stage as soon as it is
+    done, so the first evaluations are written after a single chunk went through the pipeline.
+
+    Args:
+        input_path (AnyPath): Path to the file containing instructions. Should contain the columns needed by the
+            first stage that is run, e.g., "instruction" if `brainstormer_configs` is not None.
+        output_path (Optional[AnyPath], optional): Path to save the output JSON file containing evaluation results.
+            Rows are appended to the file as soon as they are evaluated. If None, the output will be saved in the same
+            directory as the input file with "_with_evaluations.json" appended to the filename.
+        brainstormer_configs (Optional[AnyPath], optional): Configuration for the rubric brainstormer. If None, the
+            brainstorming is skipped and the input should contain "brainstormed_rubric" (or "rubric" if
+            `rubricator_configs` is also None).
+        rubricator_configs (Optional[AnyPath], optional): Configuration for the rubricator. If None, the rubric
+            generation is skipped and the input should contain "rubric" and "criteria".
+        model_configs (Optional[AnyPath], optional): Configuration for the model to evaluate. If None, the output
+            generation is skipped and the input should contain "output".
+        evaluator_configs (Optional[AnyPath], optional): Configuration for the evaluator. If None, the evaluation is
+            skipped.
+        dataset_name (Optional[str], optional): Name of the benchmark. If not provided, the benchmark name will be
+            derived from the input path.
+        chunksize (int, optional): Number of instructions that move together through the stages.
+        max_in_flight (int, optional): Maximum number of chunks that wait in the queue before each stage.
+        **annotators_kwargs: Additional keyword arguments to pass to all the annotators.
     """
-    completion_path = generate_outputs(
-        input_path=input_path,
-        output_path=output_path,
-        model_configs=model_configs,
-        **completor_evaluator_summarizer_kwargs,
+    df = ae_utils.load_or_convert_to_dataframe(input_path)
+    stages = []
+    if brainstormer_configs is not None:
+        rubric_brainstormer = RubricBrainstormer(annotators_config=brainstormer_configs, **annotators_kwargs)
+        stages.append(
+            ("brainstorm_rubrics", partial(brainstorm_rubrics_from_df, rubric_brainstormer=rubric_brainstormer))
+        )
+    if rubricator_configs is not None:
+        rubricator = Rubricator(annotators_config=rubricator_configs, **annotators_kwargs)
+        stages.append(("generate_rubrics", partial(generate_rubrics_from_df, rubricator=rubricator)))
+    if model_configs is not None:
+        outputer = Outputer(annotators_config=model_configs, **annotators_kwargs)
+        dataset_name = _get_dataset_name(input_path, dataset_name)
+        stages.append(
+            ("generate_outputs", partial(generate_outputs_from_df, outputer=outputer, dataset_name=dataset_name))
+        )
+    if evaluator_configs is not None:
+        evaluator = Evaluator(annotators_config=evaluator_configs, **annotators_kwargs)
+        stages.append(("evaluate", partial(evaluate_from_df, evaluator=evaluator)))
+
+    if len(stages) == 0:
+        raise ValueError("All the configs are None so there is nothing to run.")
+
+    output_path = get_output_path(
+        input_path, output_path, sffx="_with_evaluations", to_rm=["_with_rubrics", "_with_brainstorm"]
     )
-    report_path = evaluate_and_generate_report(
-        completion_path,
-        output_path,
-        evaluator_configs,
-        **completor_evaluator_summarizer_kwargs,
+    chunks = ae_utils.dataframe_chunk_generator(df, chunksize)
+    with JSONRecordsWriter(output_path) as writer:
+        for df_chunk in run_streaming_stages(chunks, stages, max_in_flight=max_in_flight):
+            writer.write(df_chunk)
+            logger.info(f"{writer.n_records}/{len(df)} instructions went through the pipeline.")
+
+    logger.info(f"Results of the streaming pipeline are written to: {output_path}")
+    return output_path
+
+
+def sweep(
+    input_paths: Union[AnyPath, Sequence[AnyPath]],
+    output_dir: AnyPath = "results",
+    models_configs: Union[str, Sequence[str]] = "all",
+    evaluator_configs: str = "gpt-4o-2024-08-06_CoT_v0",
+    summarizer_configs: Optional[str] = "unstructured_gpt-4o-2024-08-06",
+    max_workers: int = 8,
+    is_skip_existing: bool = True,
+    is_resume: bool = True,
+    **completor_evaluator_summarizer_kwargs,
+) -> dict[str, str]:
+    """Generate outputs, evaluations and reports for every (model, dataset) pair. The tasks are scheduled from a
+    single work queue so that each task starts as soon as its dependencies are done, e.g., the evaluation of a fast
+    model doesn't wait for the outputs of slow models.
+
+    The results are written to:
+        - `{output_dir}/{dataset}/annotated_completions/{model}/completions.json`
+        - `{output_dir}/{dataset}/{evaluator}_as_evaluator/{model}/evaluations.json`
+        - `{output_dir}/{dataset}/{evaluator}_as_evaluator/{model}/report_evaluations_evaluations.json`
+        - `{output_dir}/{dataset}/{evaluator}_as_evaluator/criteria/model={model}/` (criteria table of all models)
+    where `dataset` is `{parent directory}/{stem}` of the input path.
+
+    Args:
+        input_paths (Union[AnyPath, Sequence[AnyPath]]): Path(s) to the files containing instructions with rubrics, one
+            per dataset.
+        output_dir (AnyPath, optional): Directory where to save all the results.
+        models_configs (Union[str, Sequence[str]], optional): Configurations of the models to evaluate. If "all", uses
+            all the models in `rubric_eval/configs/models_configs`.
+        evaluator_configs (str, optional): Configuration for the evaluator.
+        summarizer_configs (Optional[str], optional): Configuration for the summarizer, same default as
+            `generate_report`. If `None` the reports don't have any qualitative analysis.
+        max_workers (int, optional): Maximum number of tasks running at the same time.
+        is_skip_existing (bool, optional): Whether to skip the tasks whose results already exist.
+        is_resume (bool, optional): Whether the tasks interrupted in a previous sweep resume from their checkpoints.
+        **completor_evaluator_summarizer_kwargs: Additional keyword arguments to pass to all the steps.
+
+    Returns:
+        dict[str, str]: Status of each task, e.g. {"evaluate:wildbench_hard/rubrics:gpt-4o-2024-05-13": "success"}.
+    """
+    input_paths, models_configs = _get_sweep_inputs(input_paths, models_configs)
+
+    kwargs = completor_evaluator_summarizer_kwargs
+    tasks = []
+    for input_path in input_paths:
+        dataset = f"{Path(input_path).parent.name}/{Path(input_path).stem}"
+        dataset_name = _get_dataset_name(input_path, None)
+        for model_configs in models_configs:
+            model = Path(model_configs).name
+            completions_path, evaluations_path, report_path = _get_sweep_paths(
+                output_dir, input_path, model_configs, evaluator_configs
+            )
+            outputs_task = f"generate_outputs:{dataset}:{model}"
+            evaluate_task = f"evaluate:{dataset}:{model}"
+            tasks += [
+                Task(
+                    outputs_task,
+                    partial(
+                        generate_outputs,
+                        model_configs=model_configs,
+                        input_path=input_path,
+                        output_path=completions_path,
+                        dataset_name=dataset_name,
+                        is_resume=is_resume,
+                        **kwargs,
+                    ),
+                    artifact_path=completions_path,
+                ),
+                Task(
+                    evaluate_task,
+                    partial(
+                        evaluate,
+                        input_path=completions_path,
+                        output_path=evaluations_path,
+                        evaluator_configs=evaluator_configs,
+                        is_resume=is_resume,
+                        # all the models of a dataset share the same criteria table
+                        criteria_table_path=evaluations_path.parents[1] / "criteria",
+                        **kwargs,
+                    ),
+                    dependencies=[outputs_task],
+                    artifact_path=evaluations_path,
+                ),
+                Task(
+                    f"generate_report:{dataset}:{model}",
+                    partial(
+                        generate_report, input_path=evaluations_path, summarizer_configs=summarizer_configs, **kwargs
+                    ),
+                    dependencies=[evaluate_task],
+                    artifact_path=report_path,
+                ),
+            ]
+
+    statuses = run_dag(tasks, max_workers=max_workers, is_skip_existing=is_skip_existing)
+    failed = [name for name, status in statuses.items() if status == "failed"]
+    if len(failed) > 0:
+        logger.warning(f"{len(failed)} tasks of the sweep failed: {failed}")
+    return statuses
+
+
+def leaderboard(
+    evaluations_dir: AnyPath = EVALUATIONS_DIR,
+    output_dir: Optional[AnyPath] = None,
+    evaluator: Optional[str] = None,
+    n_bootstrap_resamples: int = 10_000,
+    max_workers: Optional[int] = None,
+    is_use_cache: bool = True,
+) -> Path:
+    """Rank all the models evaluated under `evaluations_dir` and save `leaderboard.json` and `leaderboard.md`.
+
+    Args:
+        evaluations_dir (AnyPath): Directory that is searched recursively for raw evaluations (`*evaluations*.json`,
+            e.g. the output of a sweep) and evaluation reports (`report_*.json`). Models are aligned on the instruction
+            ids; when a model has both, its raw evaluations are used.
+        output_dir (Optional[AnyPath]): Where to save the leaderboard. Defaults to `evaluations_dir`.
+        evaluator (Optional[str]): Only rank the evaluations of this evaluator. Defaults to the most common one.
+        n_bootstrap_resamples (int): Number of bootstrap resamples for the confidence intervals and p-values.
+        max_workers (Optional[int]): Number of threads used to load the evaluation files.
+        is_use_cache (bool): Whether to keep what is needed from each evaluation file in `{output_dir}/
+            leaderboard_cache.json`, so that adding a model only loads its own file.
+    """
+    output_dir = Path(output_dir or evaluations_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache_path = output_dir / LEADERBOARD_CACHE_NAME if is_use_cache else None
+    summaries = load_evaluation_summaries(
+        find_evaluation_files(evaluations_dir), cache_path=cache_path, max_workers=max_workers
+    )
+    if len(summaries) == 0:
+        raise ValueError(f"No evaluations or reports found in {evaluations_dir}.")
+
+    results = make_leaderboard(summaries, evaluator=evaluator, n_bootstrap_resamples=n_bootstrap_resamples)
+    leaderboard_path = output_dir / "leaderboard.json"
+    with open(leaderboard_path, "w") as f:
+        json.dump(leaderboard_to_dict(results), f, indent=4)
+    with open(output_dir / "leaderboard.md", "w") as f:
+        f.write(format_leaderboard_md(results))
+    logger.info(f"Leaderboard of {len(results['rankings'])} models is written to: {leaderboard_path}.")
+    return leaderboard_path
+
+
+def migrate_caches(
+    paths: Union[AnyPath, Sequence[AnyPath]] = CONFIGS_DIR,
+    cache_path: AnyPath = "auto",
+) -> int:
+    """Import the previous JSON caches into the SQLite completion cache shared by the annotators and the summarizers
+    (see `CompletionCache`).
+
+    Args:
+        paths (Union[AnyPath, Sequence[AnyPath]]): JSON caches or directories searched recursively for them: the
+            caches of the summarizers (`cache.json`) and of the annotators (`annotations_seed{seed}_{configs}.json`,
+            next to the configs that made them). Defaults to the configs of the package, where they were written.
+        cache_path (AnyPath): Path to the database. If "auto", uses `RUBRIC_EVAL_CACHE_DIR/completions.sqlite`.
+
+    Returns:
+        int: The number of imported completions.
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    json_paths = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            json_paths += sorted(
+                p for p in path.rglob("*.json") if p.name == "cache.json" or ANNOTATIONS_CACHE_PATTERN.match(p.name)
+            )
+        else:
+            json_paths.append(path)
+
+    cache = get_completion_cache(cache_path)
+    annotator_classes = {cls.annotator_column: cls for cls in (Outputer, RubricBrainstormer, Rubricator, Evaluator)}
+    n_imported = 0
+    for json_path in json_paths:
+        match = ANNOTATIONS_CACHE_PATTERN.match(json_path.name)
+        if match is None:
+            n_imported += cache.import_json(json_path)
+            continue
+
+        with open(json_path) as f:
+            records = json.load(f)
+        columns = records[0].keys() if len(records) > 0 else []
+        annotator_class = next((cls for column, cls in annotator_classes.items() if column in columns), None)
+        configs_path = json_path.parent / f"{match.group('configs')}.yaml"
+        if annotator_class is None or not configs_path.exists():
+            logger.warning(f"Skipping {json_path}: cannot find the annotator and configs that made it.")
+            continue
+        annotator = annotator_class(
+            annotators_config=configs_path,
+            seed=int(match.group("seed")),
+            artifacts_dir=None,
+            completion_cache=cache,
+        )
+        n_imported += annotator.import_json_cache(json_path)
+
+    logger.info(f"Imported {n_imported} completions from {len(json_paths)} JSON caches to {cache}.")
+    return n_imported
+
+
+def _get_sweep_inputs(
+    input_paths: Union[AnyPath, Sequence[AnyPath]], models_configs: Union[str, Sequence[str]]
+) -> tuple[list[AnyPath], list[str]]:
+    if isinstance(input_paths, (str, Path)):
+        input_paths = [input_paths]
+    if models_configs == "all":
+        models_configs = sorted(p.name for p in (CONFIGS_DIR / "models_configs").iterdir() if p.is_dir())
+    elif isinstance(models_configs, str):
+        models_configs = [models_configs]
+    return list(input_paths), list(models_configs)
+
+
+def _get_sweep_paths(
+    output_dir: AnyPath, input_path: AnyPath, model_configs: str, evaluator_configs: str
+) -> tuple[Path, Path, Path]:
+    """Return the paths of the completions, evaluations and report of a (dataset, model) pair of the sweep."""
+    dataset = f"{Path(input_path).parent.name}/{Path(input_path).stem}"
+    model = Path(model_configs).name
+    completions_path = Path(output_dir) / dataset / "annotated_completions" / model / "completions.json"
+    evaluations_path = (
+        Path(output_dir) / dataset / f"{Path(evaluator_configs).name}_as_evaluator" / model / "evaluations.json"
     )
+    report_path = evaluations_path.with_name("report_evaluations_evaluations.json")
+    return completions_path, evaluations_path, report_path
 
 
 #
@@ -602,22 +1185,150 @@ ALL_FUNCTIONS = {
     "brainstorm_and_generate_rubrics": brainstorm_and_generate_rubrics,
     "evaluate_and_generate_report": evaluate_and_generate_report,
     "generate_outputs_and_evaluation_report": generate_outputs_and_evaluation_report,
+    "run_streaming_pipeline": run_streaming_pipeline,
+    "sweep": sweep,
+    "leaderboard": leaderboard,
+    "migrate_caches": migrate_caches,
 }
 
 
+# stages run by each function and the argument that contains the configs of each stage
+DRY_RUN_STAGES = {
+    "brainstorm_rubrics": [("brainstorm_rubrics", "brainstormer_configs")],
+    "generate_rubrics": [("generate_rubrics", "rubricator_configs")],
+    "generate_outputs": [("generate_outputs", "model_configs")],
+    "evaluate": [("evaluate", "evaluator_configs")],
+    "generate_report": [("generate_report", "summarizer_configs")],
+    "brainstorm_and_generate_rubrics": [
+        ("brainstorm_rubrics", "brainstormer_configs"),
+        ("generate_rubrics", "rubricator_configs"),
+    ],
+    "evaluate_and_generate_report": [("evaluate", "evaluator_configs"), ("generate_report", "summarizer_configs")],
+    "generate_outputs_and_evaluation_report": [
+        ("generate_outputs", "model_configs"),
+        ("evaluate", "evaluator_configs"),
+        ("generate_report", "summarizer_configs"),
+    ],
+    "run_streaming_pipeline": [
+        ("brainstorm_rubrics", "brainstormer_configs"),
+        ("generate_rubrics", "rubricator_configs"),
+        ("generate_outputs", "model_configs"),
+        ("evaluate", "evaluator_configs"),
+    ],
+    "sweep": [
+        ("generate_outputs", "models_configs"),
+        ("evaluate", "evaluator_configs"),
+        ("generate_report", "summarizer_configs"),
+    ],
+}
+
+
+def dry_run(fn_name: str, *args, **kwargs) -> pd.DataFrame:
+    """Estimate the number of requests, tokens, price and time of calling `ALL_FUNCTIONS[fn_name](*args, **kwargs)`
+    without sending any request. See `estimate.estimate_stage` for how the estimates are computed.
+
+    Returns:
+        pd.DataFrame: One row per stage (and per model and dataset for `sweep`).
+    """
+    signature = inspect.signature(ALL_FUNCTIONS[fn_name])
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+    for name, parameter in signature.parameters.items():
+        if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+            arguments.update(arguments.pop(name, {}))
+    stages = DRY_RUN_STAGES.get(fn_name, [])
+    if len(stages) == 0:
+        # the function does not send any request
+        return pd.DataFrame()
+
+    if fn_name != "sweep":
+        df = ae_utils.load_or_convert_to_dataframe(arguments["input_path"])
+        df = _sample_max_instances(df, arguments.get("max_instances", None))
+        return estimate_stages(df, [(stage, arguments[configs_arg]) for stage, configs_arg in stages])
+
+    input_paths, models_configs = _get_sweep_inputs(arguments["input_paths"], arguments["models_configs"])
+    all_estimates = []
+    for input_path in input_paths:
+        df = ae_utils.load_or_convert_to_dataframe(input_path)
+        df = _sample_max_instances(df, arguments.get("max_instances", None))
+        for model_configs in models_configs:
+            stages_configs = dict(
+                generate_outputs=model_configs,
+                evaluate=arguments["evaluator_configs"],
+                generate_report=arguments["summarizer_configs"],
+            )
+            paths = _get_sweep_paths(arguments["output_dir"], input_path, model_configs, arguments["evaluator_configs"])
+            if arguments["is_skip_existing"]:
+                # same as the sweep: tasks whose artifact exists are skipped
+                stages_configs = {
+                    stage: configs if not path.exists() else None
+                    for (stage, configs), path in zip(stages_configs.items(), paths)
+                }
+            df_estimates = estimate_stages(df, list(stages_configs.items()))
+            df_estimates.insert(0, "dataset", _get_dataset_name(input_path, None))
+            all_estimates.append(df_estimates)
+    return pd.concat(all_estimates, ignore_index=True) if len(all_estimates) > 0 else pd.DataFrame()
+
+
+def _make_dry_run_fn(fn_name: str):
+    """Return a function with the same signature as `ALL_FUNCTIONS[fn_name]` that prints the estimates of the call."""
+
+    @wraps(ALL_FUNCTIONS[fn_name])
+    def fn(*args, **kwargs):
+        print(format_estimates(dry_run(fn_name, *args, **kwargs)))
+
+    return fn
+
+
+def _pop_dry_run_flag(argv: list[str]) -> bool:
+    """Remove the `--dry_run` flag from the command line arguments (in place) and return its value. Accepts
+    `--dry_run`, `--dry_run=<bool>` and `--dry_run <bool>`, so it is never forwarded to the functions.
+
+    Example:
+        >>> argv = ["evaluate", "--dry_run", "False", "--input_path=outputs.json"]
+        >>> _pop_dry_run_flag(argv), argv
+        (False, ['evaluate', '--input_path=outputs.json'])
+        >>> argv = ["evaluate", "--dry_run=true"]
+        >>> _pop_dry_run_flag(argv), argv
+        (True, ['evaluate'])
+    """
+    is_dry_run = False
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--dry_run":
+            del argv[i]
+            is_dry_run = True
+            if i < len(argv) and argv[i].lower() in _BOOL_STRINGS:
+                is_dry_run = _BOOL_STRINGS[argv.pop(i).lower()]
+        elif arg.startswith("--dry_run="):
+            value = arg.split("=", 1)[1]
+            if value.lower() not in _BOOL_STRINGS:
+                raise ValueError(f"Invalid value for --dry_run: {value!r}, expected a boolean.")
+            del argv[i]
+            is_dry_run = _BOOL_STRINGS[value.lower()]
+        else:
+            i += 1
+    return is_dry_run
+
+
 def main():
+    # estimate the tokens, cost and time of the command instead of running it
+    is_dry_run = _pop_dry_run_flag(sys.argv)
     is_fn_name = len(sys.argv) > 1 and "--" not in sys.argv[1]
     is_help = any(a == "--help" for a in sys.argv)
 
+    functions = ALL_FUNCTIONS
+    if is_dry_run:
+        functions = {fn_name: _make_dry_run_fn(fn_name) for fn_name in ALL_FUNCTIONS}
+
     if is_fn_name or is_help:
-        fire.Fire(ALL_FUNCTIONS)
+        fire.Fire(functions)
     else:
         # default behavior if no function is specified
-        fire.Fire(generate_outputs_and_evaluation_report)
+        fire.Fire(functions["generate_outputs_and_evaluation_report"])
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "run_doctests":
-        run_doctests()
-    else:
-        fire.Fire(ALL_FUNCTIONS)
+    main()
@@ -0,0 +1,107 @@
+"""Statistics of the outputs of the models (length, lists and markdown structure) shown in the reports."""
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from alpaca_eval.types import AnyPath
+
+from .artifacts import get_cache_dir
+from .completion_cache import get_completion_cache
+from .helpers import hash_content
+from .rate_limits import CHARS_PER_TOKEN
+
+__all__ = ["OUTPUT_STATISTICS", "compute_output_statistics", "get_outputs_statistics"]
+
+OUTPUT_STATISTICS = ["n_chars", "n_tokens", "n_list_items", "has_list", "n_headers", "n_code_blocks", "n_table_rows"]
+
+# bump when the statistics change, to invalidate the cached ones
+OUTPUT_STATISTICS_VERSION = 2
+DEFAULT_OUTPUT_STATISTICS_CACHE_NAME = "output_statistics.sqlite"
+
+# single scan of the line starts. The lookaheads are the patterns of `alpaca_eval.utils.contains_list` (bullets,
+# numbers and letters): a match of one can span several lines and overlap with the matches of the others, so they
+# are captured without consuming the text and each is only counted if it starts after the end of its previous match
+_LIST_ITEM_GROUPS = ["bullet", "number", "letter"]
+_STRUCTURE_PATTERN = re.compile(
+    r"^(?=(?P<bullet>\s*[\*\•\-]\s*[^\w]*\w+))?"
+    r"(?=(?P<number>\s*\d+[\.\)]\s*[^\w]*\w+))?"
+    r"(?=(?P<letter>\s*[a-zA-Z][\.\)]\s+[^\w]*\w+))?"
+    r"(?:[ \t]*(?:(?P<header>#{1,6}[ \t])|(?P<fence>```)|(?P<table>\|)))?",
+    re.MULTILINE,
+)
+
+
+@lru_cache(maxsize=2**16)
+def compute_output_statistics(output: str) -> tuple[int, ...]:
+    """Statistics `OUTPUT_STATISTICS` of an output: number of characters, approximate number of tokens (as the rate
+    limiter), number of list items (as `alpaca_eval.utils.contains_list`) and whether there is one, number of markdown
+    headers, code blocks and table rows (in a single scan). Results are memoized per output, so outputs shared by
+    several reports are only scanned once.
+
+    Example:
+        >>> dict(zip(OUTPUT_STATISTICS, compute_output_statistics("# Plan\\n1. Shop\\n2. Cook\\n```py\\nx\\n```")))
+        {'n_chars': 34, 'n_tokens': 9, 'n_list_items': 2, 'has_list': 1, 'n_headers': 1, 'n_code_blocks': 1, 'n_table_rows': 0}
+        >>> compute_output_statistics("- \\n1. item")[2]
+        2
+    """
+    n_list_items = 0
+    list_item_ends = dict.fromkeys(_LIST_ITEM_GROUPS, 0)
+    counts = dict(header=0, fence=0, table=0)
+    for match in _STRUCTURE_PATTERN.finditer(output):
+        for group in _LIST_ITEM_GROUPS:
+            if match.start(group) >= list_item_ends[group]:
+                n_list_items += 1
+                list_item_ends[group] = match.end(group)
+        for group in counts:
+            if match.start(group) >= 0:
+                counts[group] += 1
+    return (
+        len(output),
+        math.ceil(len(output) / CHARS_PER_TOKEN),
+        n_list_items,
+        int(n_list_items > 0),
+        counts["header"],
+        counts["fence"] // 2,
+        counts["table"],
+    )
+
+
+def get_outputs_statistics(outputs: Sequence[Any], cache: Union[AnyPath, Any, None] = "auto") -> pd.DataFrame:
+    """Statistics of each output (NaN for missing outputs), with the columns `OUTPUT_STATISTICS`.
+
+    Args:
+        outputs: Outputs of the models.
+        cache: Where the statistics of each output are stored under the hash of the output, so that the reports of
+            the same outputs by other evaluators or reruns reuse them. A path to a SQLite database (see
+            `get_completion_cache`), "auto" for `get_cache_dir() / "output_statistics.sqlite"`, any object with
+            `get_many` and `put_many` methods (e.g. an `ArtifactStore`), or None to not store them.
+
+    Example:
+        >>> import tempfile
+        >>> cache = Path(tempfile.mkdtemp()) / "output_statistics.sqlite"
+        >>> get_outputs_statistics(["- a\\n- b", None], cache=cache)["n_list_items"].tolist()
+        [2.0, nan]
+        >>> len(get_completion_cache(cache))
+        1
+    """
+    if isinstance(cache, str) and cache == "auto":
+        cache = get_cache_dir() / DEFAULT_OUTPUT_STATISTICS_CACHE_NAME
+    cache = get_completion_cache(cache)
+
+    keys = [hash_content(OUTPUT_STATISTICS_VERSION, o) if isinstance(o, str) else None for o in outputs]
+    key_to_output = {k: o for k, o in zip(keys, outputs) if k is not None}
+    key_to_statistics = {}
+    if cache is not None:
+        key_to_statistics = {k: tuple(r["statistics"]) for k, r in cache.get_many(list(key_to_output)).items()}
+    new_statistics = {k: compute_output_statistics(o) for k, o in key_to_output.items() if k not in key_to_statistics}
+    if cache is not None:
+        cache.put_many({k: dict(statistics=list(stats)) for k, stats in new_statistics.items()})
+    key_to_statistics.update(new_statistics)
+
+    nan_statistics = (np.nan,) * len(OUTPUT_STATISTICS)
+    statistics = [key_to_statistics[k] if k is not None else nan_statistics for k in keys]
+    return pd.DataFrame(statistics, columns=OUTPUT_STATISTICS, dtype=float)
@@ -3,12 +3,13 @@ from typing import Sequence
 from alpaca_eval import constants as ae_constants
 from alpaca_eval.annotators import base
 
+from .annotators import BaseAnnotatorJSON
 from .helpers import CONFIGS_DIR
 
 __all__ = ["Outputer"]
 
 
-class Outputer(base.BaseAnnotatorJSON):
+class Outputer(BaseAnnotatorJSON):
     __doc__ = base.BaseAnnotatorJSON.__doc__.replace(
         "Base class for a pool of annotators.",
         "Model to evaluate.",
@@ -0,0 +1,126 @@
+"""Batch decoding of the JSON annotations (rubrics, gradings and summaries) with tolerant fallbacks.
+
+Every string is first decoded with a fast JSON decoder (`orjson` if it is installed, otherwise the C accelerated
+`json`). Only the strings that fail go through the slower fallbacks: the content of a "```json ... ```" block, then
+`ast.literal_eval` for python literals (e.g. single quotes, True/None). The reason of the failure of each string is
+returned instead of raised, so that a single bad completion does not fail a batch.
+"""
+import ast
+import json
+import logging
+import re
+from collections import Counter
+from typing import Any, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["decode_json", "decode_json_batch", "log_decoding_failures", "json_parser"]
+
+JSON_BLOCK_PATTERN = re.compile(r"```(?:json)?(.*?)```", re.DOTALL)
+
+
+def _fast_loads(string: str) -> Any:
+    return orjson.loads(string) if orjson is not None else json.loads(string)
+
+
+def decode_json(value: Any, is_allow_literal: bool = True) -> tuple[Any, Optional[str]]:
+    """Decode a single value, see `decode_json_batch`.
+
+    Example:
+        >>> decode_json('{"a": 1}')
+        ({'a': 1}, None)
+        >>> decode_json("blah ```json\\n[1, 2]```")
+        ([1, 2], None)
+        >>> decode_json("{'a': True}")
+        ({'a': True}, None)
+        >>> decode_json("not json")[1]
+        'not valid JSON nor a python literal: Expecting value: line 1 column 1 (char 0)'
+    """
+    if not isinstance(value, str):
+        return value, None
+    if value.strip() == "":
+        return None, "empty string"
+
+    try:
+        return _fast_loads(value), None
+    except ValueError:  # also the base class of orjson.JSONDecodeError
+        pass
+
+    candidates = [m.strip() for m in JSON_BLOCK_PATTERN.findall(value)] + [value.strip()]
+    error = None
+    for candidate in candidates:
+        try:
+            return json.loads(candidate), None
+        except ValueError as e:
+            error = error or e
+        if is_allow_literal:
+            try:
+                return ast.literal_eval(candidate), None
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                pass
+
+    kind = "not valid JSON nor a python literal" if is_allow_literal else "not valid JSON"
+    return None, f"{kind}: {error}"
+
+
+def decode_json_batch(
+    values: Sequence[Any], is_allow_literal: bool = True
+) -> tuple[list[Any], list[Optional[str]]]:
+    """Decode a batch of JSON strings. Values that are not strings (e.g. already decoded) are returned as is.
+
+    Returns:
+        tuple: The decoded values (None where the decoding failed) and the reason of the failure of each value (None
+        where it succeeded).
+
+    Example:
+        >>> decoded, reasons = decode_json_batch(['[1]', "{'a': None}", '{"a": ', 3])
+        >>> decoded
+        [[1], {'a': None}, None, 3]
+        >>> [reason is None for reason in reasons]
+        [True, True, False, True]
+    """
+    decoded, reasons = [], []
+    for value in values:
+        if isinstance(value, str):
+            # inlined fast path, the fallbacks are only used for the values that fail
+            try:
+                decoded.append(_fast_loads(value))
+                reasons.append(None)
+                continue
+            except ValueError:
+                pass
+        value, reason = decode_json(value, is_allow_literal=is_allow_literal)
+        decoded.append(value)
+        reasons.append(reason)
+    return decoded, reasons
+
+
+def log_decoding_failures(reasons: Sequence[Optional[str]], name: str, max_reasons: int = 3) -> int:
+    """Log the number of values of `name` that could not be decoded and their most common failure reasons."""
+    failures = Counter(r for r in reasons if r is not None)
+    n_failures = sum(failures.values())
+    if n_failures > 0:
+        most_common = "; ".join(f"{n}x {reason}" for reason, n in failures.most_common(max_reasons))
+        logging.warning(f"{n_failures} examples of {name} could not be decoded. Most common reasons: {most_common}")
+    return n_failures
+
+
+def json_parser(completion: str, annotation_key: Optional[str]) -> list[Any]:
+    """Same as `alpaca_eval.completion_parsers.json_parser` (read the completion as JSON and select `annotation_key`)
+    but with the fast decoder and the fallbacks of `decode_json`. Raises a `ValueError` with the failure reason.
+
+    Example:
+        >>> json_parser('[{"is_good": true}, {"is_good": false}]', "is_good")
+        [True, False]
+        >>> json_parser("Here it is: ```json\\n{'score': 3}```", "score")
+        [3]
+    """
+    decoded, reason = decode_json(completion)
+    if reason is not None:
+        raise ValueError(f"Could not parse the completion: {reason}")
+    if isinstance(decoded, dict):
+        return [decoded[annotation_key] if annotation_key is not None else decoded]
+    return [d[annotation_key] if annotation_key is not None else d for d in decoded]
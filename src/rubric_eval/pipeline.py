@@ -0,0 +1,220 @@
+"""Code for streaming chunks of instructions through the RubricEval stages."""
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+import pandas as pd
+from alpaca_eval.types import AnyPath
+
+__all__ = ["run_streaming_stages", "JSONRecordsWriter", "AsyncArtifactWriter"]
+
+_END = object()  # sentinel that marks the end of the stream
+
+
+class _StageFailure:
+    """Sentinel propagated downstream when a stage raised an exception."""
+
+    def __init__(self, stage_name: str, exception: BaseException):
+        self.stage_name = stage_name
+        self.exception = exception
+
+
+def run_streaming_stages(
+    chunks: Iterable[pd.DataFrame],
+    stages: Sequence[tuple[str, Callable[[pd.DataFrame], pd.DataFrame]]],
+    max_in_flight: int = 2,
+) -> Iterator[pd.DataFrame]:
+    """Run every chunk through all the stages, without waiting for the other chunks to finish the previous stage.
+
+    Each stage runs in its own thread and stages are connected by bounded queues, so at most `max_in_flight` chunks
+    wait between two stages. This means that the first results are available after a single chunk went through all
+    the stages and that memory doesn't grow with the number of instructions.
+
+    Args:
+        chunks: Iterable of DataFrames to process. Can be a generator, it will be consumed lazily.
+        stages: Sequence of (name, fn) where fn maps a DataFrame to the processed DataFrame. Chunks that become empty
+            (e.g. all annotations are missing) are not passed to the next stages.
+        max_in_flight: Maximum number of chunks waiting in the queue before each stage.
+
+    Yields:
+        pd.DataFrame: The processed chunks, in the same order as the input chunks.
+
+    Example:
+        >>> chunks = (pd.DataFrame({"a": [i]}) for i in range(3))
+        >>> stages = [("add", lambda df: df.assign(b=df["a"] + 1)), ("mult", lambda df: df.assign(c=df["b"] * 2))]
+        >>> pd.concat(run_streaming_stages(chunks, stages), ignore_index=True)["c"].tolist()
+        [2, 4, 6]
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=max_in_flight) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_feed_chunks, args=(chunks, queues[0], stop), daemon=True)]
+    for i, (name, fn) in enumerate(stages):
+        threads.append(
+            threading.Thread(
+                target=_run_stage,
+                args=(name, fn, queues[i], queues[i + 1], stop),
+                name=f"rubric_eval_stage_{name}",
+                daemon=True,
+            )
+        )
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _END:
+                break
+            if isinstance(item, _StageFailure):
+                raise RuntimeError(f"Stage `{item.stage_name}` failed.") from item.exception
+            yield item
+    finally:
+        # unblocks the workers if the consumer stopped early or a stage failed
+        stop.set()
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item in a bounded queue unless the pipeline was stopped. Returns whether the item was added."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _feed_chunks(chunks: Iterable[pd.DataFrame], out_queue: queue.Queue, stop: threading.Event):
+    try:
+        for chunk in chunks:
+            if not _put(out_queue, chunk, stop):
+                return
+    except Exception as e:
+        logging.exception("Error while reading the chunks to process:")
+        _put(out_queue, _StageFailure("input", e), stop)
+        return
+    _put(out_queue, _END, stop)
+
+
+def _run_stage(
+    name: str,
+    fn: Callable[[pd.DataFrame], pd.DataFrame],
+    in_queue: queue.Queue,
+    out_queue: queue.Queue,
+    stop: threading.Event,
+):
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+        if item is _END or isinstance(item, _StageFailure):
+            _put(out_queue, item, stop)
+            return
+
+        try:
+            out = fn(item)
+        except Exception as e:
+            logging.exception(f"Error in stage `{name}`:")
+            _put(out_queue, _StageFailure(name, e), stop)
+            return
+
+        if out is None or len(out) == 0:
+            logging.warning(f"Stage `{name}` returned no rows for a chunk of {len(item)} rows.")
+            continue
+
+        if not _put(out_queue, out, stop):
+            return
+
+
+class JSONRecordsWriter:
+    """Incrementally writes DataFrames to a JSON file of records.
+
+    The resulting file is the same as `df.to_json(path, orient="records", indent=4)` on the concatenated DataFrames,
+    but rows are flushed to disk as soon as they are written instead of being held in memory.
+
+    Example:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     path = Path(tmpdir) / "out.json"
+        ...     with JSONRecordsWriter(path) as writer:
+        ...         writer.write(pd.DataFrame({"a": [1, 2]}))
+        ...         writer.write(pd.DataFrame({"a": [3]}))
+        ...     pd.read_json(path)["a"].tolist()
+        [1, 2, 3]
+    """
+
+    def __init__(self, path: AnyPath):
+        self.path = Path(path)
+        self.n_records = 0
+        self._file = None
+
+    def __enter__(self) -> "JSONRecordsWriter":
+        self._file = open(self.path, "w")
+        self._file.write("[")
+        return self
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        records = df.to_json(orient="records", indent=4).strip()
+        # remove the enclosing brackets to be able to append to the list that is being written
+        records = records[1:-1].rstrip()
+        self._file.write(("," if self.n_records > 0 else "") + records)
+        self._file.flush()
+        self.n_records += len(df)
+
+    def __exit__(self, *args):
+        self._file.write("\n]")
+        self._file.close()
+
+
+class AsyncArtifactWriter:
+    """Persists artifacts in a background thread, so that the next stage can start on the in-memory DataFrame while
+    the previous one is being serialized. Writes are run one at a time in the order they were submitted. Exiting the
+    context waits for all the writes and raises the first error.
+
+    Example:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmpdir:
+        ...     path = Path(tmpdir) / "out.json"
+        ...     with AsyncArtifactWriter() as writer:
+        ...         _ = writer.to_json(pd.DataFrame({"a": [1, 2]}), path)
+        ...     pd.read_json(path)["a"].tolist()
+        [1, 2]
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rubric_eval_writer")
+        self._futures: list[Future] = []
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run `fn(*args, **kwargs)` in the background."""
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def to_json(self, df: pd.DataFrame, path: AnyPath, **kwargs) -> Future:
+        """Write a copy of `df` as a JSON list of records, so that `df` can be modified while it is being written."""
+        kwargs = dict(orient="records", indent=4) | kwargs
+        return self.submit(df.copy().to_json, path, **kwargs)
+
+    def wait(self):
+        """Wait for all the writes submitted so far."""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self) -> "AsyncArtifactWriter":
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
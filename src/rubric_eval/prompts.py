@@ -0,0 +1,113 @@
+"""Rendering of prompts with multiple examples (e.g. the summarizer prompts) from column arrays.
+
+Each column is formatted in a single pass over its values, each example is joined once from its parts and the prompt is
+joined once from its examples, so there are no copies of the data nor quadratic string concatenations. Values that are
+not strings are dumped as JSON with `indent=2`, with `orjson` if it is installed and gives the same string.
+"""
+import json
+import math
+import re
+from typing import Any, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ["format_value", "format_column", "format_examples", "fill_template"]
+
+
+# `json` escapes the characters after "~", and `orjson` formats NaN and the floats that `repr` formats with an
+# exponent differently (e.g. "1e16" and "0.00001" instead of "1e+16" and "1e-05")
+_NON_ASCII_PATTERN = re.compile(r"[^\x00-\x7e]")
+_EXPONENT_PATTERN = re.compile(r"[0-9]e|0\.0000")
+
+
+def _escape_non_ascii(match: re.Match) -> str:
+    code = ord(match.group(0))
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    return f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
+
+
+def _is_orjson_compatible(value: Any) -> bool:
+    """Whether `orjson` formats the numbers of the value as `json`, i.e., there are no floats that `json` formats
+    with an exponent (`repr`) or as NaN/Infinity."""
+    if isinstance(value, float):
+        return math.isfinite(value) and (value == 0 or 1e-4 <= abs(value) < 1e16)
+    if isinstance(value, dict):
+        return all(_is_orjson_compatible(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_is_orjson_compatible(v) for v in value)
+    return True
+
+
+def format_value(value: Any) -> str:
+    """Format a value of an example: strings are kept as is and anything else is dumped as JSON with `indent=2`.
+
+    Example:
+        >>> print(format_value([{"criterion": "clarity", "weight": 60.0}]))
+        [
+          {
+            "criterion": "clarity",
+            "weight": 60.0
+          }
+        ]
+    """
+    if isinstance(value, str):
+        return value
+    if orjson is None:
+        return json.dumps(value, indent=2)
+
+    try:
+        dumped = orjson.dumps(value, option=orjson.OPT_INDENT_2).decode("utf-8")
+    except TypeError:  # also the base class of orjson.JSONEncodeError, e.g. non-string keys or large integers
+        return json.dumps(value, indent=2)
+    # the numbers are only checked if they may differ, which is rare
+    if ("null" in dumped or _EXPONENT_PATTERN.search(dumped) is not None) and not _is_orjson_compatible(value):
+        return json.dumps(value, indent=2)
+    if not dumped.isascii() or "\x7f" in dumped:
+        dumped = _NON_ASCII_PATTERN.sub(_escape_non_ascii, dumped)
+    return dumped
+
+
+def format_column(values: Sequence[Any]) -> list[str]:
+    """Format all the values of a column, see `format_value`."""
+    return [value if isinstance(value, str) else format_value(value) for value in values]
+
+
+def format_examples(
+    columns: Sequence[tuple[str, Sequence[Any]]], delimiter: str = "", n_examples: Optional[int] = None
+) -> list[str]:
+    """Format each example as a markdown section per column ("## {title} {i}") followed by the delimiter.
+
+    Args:
+        columns: The title and the values of each column to format, in order.
+        delimiter: String appended to each example.
+        n_examples: Number of examples, only needed if there are no columns.
+
+    Example:
+        >>> format_examples([("Instruction", ["Say hi", "Count"]), ("Score", [1, [2, 3]])], delimiter="---\\n")[1]
+        '## Instruction 1 \\nCount\\n\\n## Score 1 \\n[\\n  2,\\n  3\\n]\\n\\n---\\n'
+    """
+    titles = [title for title, _ in columns]
+    formatted_columns = [format_column(values) for _, values in columns]
+    if n_examples is None:
+        n_examples = len(formatted_columns[0]) if len(formatted_columns) > 0 else 0
+    if len(formatted_columns) == 0:
+        return [delimiter] * n_examples
+
+    examples = []
+    for i, values in enumerate(zip(*formatted_columns)):
+        parts = []
+        for title, value in zip(titles, values):
+            parts += ["## ", title, " ", str(i), " \n", value, "\n\n"]
+        parts.append(delimiter)
+        examples.append("".join(parts))
+    return examples
+
+
+def fill_template(template: str, examples: Sequence[str], prefix: str = "", key: str = "to_format") -> str:
+    """Fill the `{key}` of the template with the prefix and the concatenated examples."""
+    return template.format(**{key: prefix + "".join(examples)})
@@ -0,0 +1,239 @@
+"""Compact columnar representation of columns of lists of records, such as the rubrics and the gradings."""
+from typing import Any, Hashable, Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["RaggedRecords"]
+
+
+class RaggedRecords:
+    """Columnar container for a sequence of lists of dicts (e.g. the "rubric" or "evaluation" column of a DataFrame).
+
+    Instead of one Python dict per record with repeated string keys, the records of all the lists are stored flat:
+    `offsets` delimits the records of each list, each key is a typed column over all the records (int, float or bool
+    arrays, strings are interned as a categorical, anything else such as nested dicts is an object array) and
+    `pattern_codes` gives the keys (in order) of each record as an index into `patterns`. This makes the conversion
+    to and from the JSON format lossless, including missing keys, the order of the keys, non-list rows (e.g. NaN) and
+    non-dict elements.
+
+    Example:
+        >>> rubrics = [[{"criterion": "a", "weight": 60}, {"criterion": "b", "weight": 40}], [{"criterion": "a"}], None]
+        >>> ragged = RaggedRecords.from_lists(rubrics)
+        >>> len(ragged), ragged.n_records, ragged.rows.tolist()
+        (3, 3, [0, 0, 1])
+        >>> ragged.get("weight").tolist()
+        [60.0, 40.0, nan]
+        >>> ragged.to_lists() == rubrics
+        True
+    """
+
+    __slots__ = ("offsets", "columns", "patterns", "pattern_codes", "others", "null_rows")
+
+    def __init__(
+        self,
+        offsets: np.ndarray,
+        columns: dict[str, Any],
+        patterns: list[tuple[str, ...]],
+        pattern_codes: np.ndarray,
+        others: Optional[dict[int, Any]] = None,
+        null_rows: Optional[dict[int, Any]] = None,
+    ):
+        self.offsets = offsets
+        self.columns = columns
+        self.patterns = patterns
+        self.pattern_codes = pattern_codes
+        # non-dict elements (code -1) and non-list rows, kept as is for the lossless conversion
+        self.others = others or {}
+        self.null_rows = null_rows or {}
+
+    @classmethod
+    def from_lists(cls, lists: Iterable[Any]) -> "RaggedRecords":
+        """Build the container from lists of dicts. Elements that are not lists are kept as empty rows."""
+        lists = list(lists)
+        null_rows = {i: x for i, x in enumerate(lists) if not isinstance(x, list)}
+        lengths = [len(x) if isinstance(x, list) else 0 for x in lists]
+        records = [d for x in lists if isinstance(x, list) for d in x]
+
+        pattern_to_code, patterns = {}, []
+        pattern_codes = np.empty(len(records), dtype=np.int32)
+        others = {}
+        for i, d in enumerate(records):
+            if isinstance(d, dict):
+                pattern_codes[i] = pattern_to_code.setdefault(tuple(d), len(pattern_to_code))
+            else:
+                pattern_codes[i] = -1
+                others[i] = d
+        patterns = list(pattern_to_code)
+
+        # gather the values of each key, pattern by pattern so that every lookup succeeds
+        values = {}
+        order = np.argsort(pattern_codes, kind="stable")
+        ends = np.cumsum(np.bincount(pattern_codes[pattern_codes >= 0], minlength=len(patterns))) + len(others)
+        for pattern, start, end in zip(patterns, np.concatenate([[len(others)], ends[:-1]]), ends):
+            idcs = order[start:end].tolist()
+            group = [records[i] for i in idcs]
+            for key in pattern:
+                key_idcs, key_vals = values.setdefault(key, ([], []))
+                key_idcs.extend(idcs)
+                key_vals.extend([d[key] for d in group])
+
+        columns = {key: _encode_column(idcs, vals, len(records)) for key, (idcs, vals) in values.items()}
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(offsets, columns, patterns, pattern_codes, others=others, null_rows=null_rows)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def n_records(self) -> int:
+        return len(self.pattern_codes)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Number of records of each list."""
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Index of the list of each record."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @property
+    def keys(self) -> list[str]:
+        return list(self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays (the objects referenced by object columns are not counted)."""
+        arrays = [self.offsets, self.pattern_codes] + [
+            a for c in self.columns.values() for a in ([c.codes, c.categories] if _is_categorical(c) else [c])
+        ]
+        return sum(a.nbytes for a in arrays)
+
+    def has(self, key: str) -> np.ndarray:
+        """Boolean array of the records that have `key`."""
+        is_in_pattern = np.array([key in p for p in self.patterns] + [False], dtype=bool)
+        # code -1 (non-dict elements) indexes the trailing False
+        return is_in_pattern[self.pattern_codes]
+
+    def get(self, key: str, default: Any = np.nan) -> np.ndarray:
+        """Values of `key` for all the records, `default` where the key is missing. Numeric columns stay numeric if
+        `default` is NaN, otherwise the array has object dtype."""
+        has_key = self.has(key)
+        is_nan_default = isinstance(default, float) and np.isnan(default)
+        if key not in self.columns:
+            return np.full(self.n_records, default, dtype=float if is_nan_default else object)
+
+        column = self.columns[key]
+        if _is_categorical(column):
+            values = np.asarray(column.categories, dtype=object)[column.codes]
+        elif column.dtype.kind != "O" and is_nan_default:
+            return column if has_key.all() else np.where(has_key, column, np.nan)
+        else:
+            values = column.astype(object)
+        values[~has_key] = default
+        return values
+
+    def to_frame(self, keys: Sequence[str]) -> pd.DataFrame:
+        """One row per record with the index "row" of its list and the values of `keys` (NaN if missing)."""
+        df = pd.DataFrame({key: self.get(key) for key in keys})
+        df.insert(0, "row", self.rows)
+        return df
+
+    def split(self, values: Sequence[Any]) -> list[list[Any]]:
+        """Split values aligned with the records into one list per row."""
+        values = list(values)
+        offsets = self.offsets.tolist()
+        return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def take_records(self, mask: np.ndarray) -> "RaggedRecords":
+        """Keep the records where the boolean `mask` is True."""
+        mask = np.asarray(mask, dtype=bool)
+        idcs = np.flatnonzero(mask)
+        new_idcs = np.cumsum(mask) - 1
+        offsets = np.zeros_like(self.offsets)
+        np.cumsum(np.bincount(self.rows[mask], minlength=len(self)), out=offsets[1:])
+        columns = {key: column[idcs] for key, column in self.columns.items()}
+        others = {int(new_idcs[i]): v for i, v in self.others.items() if mask[i]}
+        return RaggedRecords(
+            offsets, columns, self.patterns, self.pattern_codes[idcs], others=others, null_rows=self.null_rows
+        )
+
+    def set(self, key: str, values: Sequence[Any], mask: Optional[np.ndarray] = None) -> "RaggedRecords":
+        """Set `key` to `values` (aligned with the records) in the dict records where `mask` is True (default all).
+        The key is appended to the records that did not have it, the other records are unchanged."""
+        is_dict = self.pattern_codes >= 0
+        mask = is_dict if mask is None else np.asarray(mask, dtype=bool) & is_dict
+        values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+        if key in self.columns and not mask.all():
+            # keep the previous values of the records that are not updated
+            has_key = self.has(key)
+            previous = self.get(key, default=None)
+            for i in np.flatnonzero(~mask & has_key).tolist():
+                values[i] = previous[i]
+            mask = mask | has_key
+
+        patterns = list(self.patterns)
+        with_key = np.arange(len(patterns) + 1, dtype=np.int32)
+        for code, pattern in enumerate(self.patterns):
+            if key not in pattern:
+                with_key[code] = len(patterns)
+                patterns.append(pattern + (key,))
+        pattern_codes = np.where(mask, with_key[self.pattern_codes], self.pattern_codes).astype(np.int32)
+
+        idcs = np.flatnonzero(mask)
+        columns = {**self.columns, key: _encode_column(idcs, [values[i] for i in idcs.tolist()], self.n_records)}
+        return RaggedRecords(
+            self.offsets, columns, patterns, pattern_codes, others=self.others, null_rows=self.null_rows
+        )
+
+    def to_lists(self) -> list[Any]:
+        """Convert back to lists of dicts."""
+        records = np.empty(self.n_records, dtype=object)
+        decoded = {key: self.get(key, default=None) for key in self.columns}
+        # group the records by pattern to build the dicts of each pattern with a single zip
+        order = np.argsort(self.pattern_codes, kind="stable")
+        ends = np.cumsum(np.bincount(self.pattern_codes[self.pattern_codes >= 0], minlength=len(self.patterns)))
+        ends += len(self.others)
+        for pattern, start, end in zip(self.patterns, np.concatenate([[len(self.others)], ends[:-1]]), ends):
+            idcs = order[start:end]
+            if len(pattern) == 0:
+                records[idcs] = [{} for _ in range(len(idcs))]
+            else:
+                columns = [decoded[key][idcs].tolist() for key in pattern]
+                records[idcs] = [dict(zip(pattern, vals)) for vals in zip(*columns)]
+        records = records.tolist()
+        for i, value in self.others.items():
+            records[i] = value
+
+        lists = self.split(records)
+        for row, value in self.null_rows.items():
+            lists[row] = value
+        return lists
+
+
+def _is_categorical(column: Any) -> bool:
+    return isinstance(column, pd.Categorical)
+
+
+def _encode_column(idcs: Sequence[int], values: list[Hashable], n_records: int) -> Any:
+    """Typed column of length `n_records` with `values` at `idcs`: a categorical for strings, a numpy array for ints,
+    floats and bools, or an object array if the types are mixed (to keep the conversion lossless)."""
+    types = set(map(type, values))
+    if types == {str}:
+        codes = np.full(n_records, -1, dtype=np.int32)
+        value_codes, categories = pd.factorize(pd.Series(values, dtype=object), sort=False)
+        codes[idcs] = value_codes
+        return pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+    dtype = {frozenset({int}): np.int64, frozenset({float}): np.float64, frozenset({bool}): np.bool_}.get(
+        frozenset(types), object
+    )
+    column = np.zeros(n_records, dtype=dtype) if dtype is not object else np.full(n_records, None, dtype=object)
+    try:
+        column[idcs] = values
+    except OverflowError:
+        column = np.full(n_records, None, dtype=object)
+        column[idcs] = values
+    return column
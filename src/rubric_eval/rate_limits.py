@@ -0,0 +1,160 @@
+"""Token-bucket rate limiting of the requests sent to the providers, shared across annotators, threads and processes."""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+from alpaca_eval.types import AnyPath
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+__all__ = ["RateLimiter", "get_rate_limiter", "estimate_n_tokens_of_request"]
+
+DEFAULT_LOCK_DIR = os.environ.get("RUBRIC_EVAL_RATE_LIMIT_DIR", None)
+CHARS_PER_TOKEN = 4  # rough approximation for english text
+
+_RATE_LIMITERS: dict[tuple[str, str], "RateLimiter"] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    """Blocks until a request fits in the requests per minute (RPM) and tokens per minute (TPM) budgets.
+
+    Each budget is a token bucket that refills continuously at `budget / 60` per second and holds at most one minute
+    of budget. Requests are therefore sent as soon as the quota allows it, rather than in bursts followed by 429s.
+
+    Args:
+        requests_per_minute: Maximum number of requests per minute. None means no limit.
+        tokens_per_minute: Maximum number of tokens per minute. None means no limit.
+        lock_path: If given, the state of the buckets is stored in that file and updated under a file lock, so that
+            the budgets are shared by all the processes using the same path.
+
+    Example:
+        >>> limiter = RateLimiter(requests_per_minute=600)
+        >>> limiter.acquire()  # the bucket starts full so this doesn't wait
+        0.0
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        lock_path: Optional[AnyPath] = None,
+    ):
+        self.capacities = dict(requests=requests_per_minute, tokens=tokens_per_minute)
+        self.capacities = {k: float(v) for k, v in self.capacities.items() if v is not None}
+        self.lock_path = Path(lock_path) if lock_path is not None else None
+        if self.lock_path is not None and fcntl is None:
+            logging.warning("File locks are not supported on this platform, the rate limit is only per process.")
+            self.lock_path = None
+        if self.lock_path is not None:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._state = dict(levels=dict(self.capacities), last=time.time())
+
+    def acquire(self, n_tokens: float = 0) -> float:
+        """Wait until a request with `n_tokens` tokens can be sent and consume the budget. Returns the waited time."""
+        to_consume = dict(requests=1.0, tokens=float(n_tokens))
+        to_consume = {k: min(to_consume[k], capacity) for k, capacity in self.capacities.items()}
+        waited = 0.0
+        while True:
+            sleep_time = self._try_consume(to_consume)
+            if sleep_time <= 0:
+                return waited
+            time.sleep(sleep_time)
+            waited += sleep_time
+
+    def _try_consume(self, to_consume: dict[str, float]) -> float:
+        """Consume the budget if possible and return 0, otherwise return the time to wait before retrying."""
+        with self._lock:
+            if self.lock_path is None:
+                return self._update_state_(self._state, to_consume)
+
+            with open(self.lock_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = json.loads(content) if content else dict(levels=dict(self.capacities), last=time.time())
+                    sleep_time = self._update_state_(state, to_consume)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return sleep_time
+
+    def _update_state_(self, state: dict[str, Any], to_consume: dict[str, float]) -> float:
+        now = time.time()
+        elapsed = max(0.0, now - state["last"])
+        state["last"] = now
+        levels = state["levels"]
+        for k, capacity in self.capacities.items():
+            levels[k] = min(capacity, levels.get(k, capacity) + elapsed * capacity / 60)
+
+        missing = {k: to_consume[k] - levels[k] for k in self.capacities if to_consume[k] > levels[k]}
+        if len(missing) > 0:
+            return max(m * 60 / self.capacities[k] for k, m in missing.items())
+
+        for k in self.capacities:
+            levels[k] -= to_consume[k]
+        return 0.0
+
+
+def get_rate_limiter(
+    provider: str,
+    model_name: str,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    lock_dir: Optional[AnyPath] = DEFAULT_LOCK_DIR,
+) -> Optional[RateLimiter]:
+    """Return the process-wide rate limiter for a (provider, model_name), creating it if needed. The limits are set
+    by the first caller. Returns None if no limits are given.
+
+    Args:
+        provider: Key of the provider, e.g. the base_url. See `decoders.get_provider_key`.
+        model_name: Name of the model, the budgets are per model.
+        requests_per_minute: Maximum number of requests per minute.
+        tokens_per_minute: Maximum number of tokens per minute.
+        lock_dir: Directory where to store the shared state of the buckets to share the budgets across processes.
+            Defaults to the environment variable `RUBRIC_EVAL_RATE_LIMIT_DIR`. If None, the budgets are per process.
+    """
+    if requests_per_minute is None and tokens_per_minute is None:
+        return None
+
+    key = (provider, model_name)
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            lock_path = None
+            if lock_dir is not None:
+                lock_path = Path(lock_dir) / (re.sub(r"[^\w.-]+", "_", f"{provider}__{model_name}") + ".json")
+            logging.info(
+                f"Rate limiting {model_name} on {provider} to {requests_per_minute} RPM and {tokens_per_minute} TPM."
+            )
+            _RATE_LIMITERS[key] = RateLimiter(
+                requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute, lock_path=lock_path
+            )
+        return _RATE_LIMITERS[key]
+
+
+def estimate_n_tokens_of_request(prompt: str, completions_kwargs: dict[str, Any]) -> int:
+    """Estimate the number of tokens counted against the TPM budget for a request. Like the providers, we count the
+    tokens of the prompt and the maximum number of tokens to generate.
+
+    Example:
+        >>> estimate_n_tokens_of_request("a" * 400, dict(max_tokens=50))
+        150
+    """
+    max_tokens = completions_kwargs.get("max_tokens", completions_kwargs.get("max_completion_tokens", 0)) or 0
+    if isinstance(max_tokens, Sequence):
+        max_tokens = max(max_tokens, default=0)
+    return len(prompt) // CHARS_PER_TOKEN + int(max_tokens)
@@ -1,16 +1,19 @@
 import logging
-from typing import Optional, Sequence
+from typing import Any, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 from alpaca_eval import utils as ae_utils
 from alpaca_eval.annotators import base
 
-from .helpers import CONFIGS_DIR, expand_json_column, percentage_scale_df_
+from .annotators import BaseAnnotatorJSON
+from .helpers import CONFIGS_DIR, apply_in_parallel, expand_json_column
+from .ragged import RaggedRecords
 
-__all__ = ["RubricBrainstormer", "Rubricator"]
+__all__ = ["RubricBrainstormer", "Rubricator", "normalize_rubrics"]
 
 
-class BaseRubricator(base.BaseAnnotatorJSON):
+class BaseRubricator(BaseAnnotatorJSON):
     DEFAULT_ANNOTATION_TYPE = object
     TMP_MISSING_ANNOTATION = "TMP_MISSING_ANNOTATION"
 
@@ -41,8 +44,10 @@ class BaseRubricator(base.BaseAnnotatorJSON):
         is_renormalize_weight: bool = True,
         is_extract_criteria_col: bool = True,
         is_expand_json_column: bool = False,
+        n_postprocessing_workers: Optional[int] = None,
     ) -> pd.DataFrame:
-        """Processes the annotated examples into a DataFrame containing a rubric of (dict of dict) column."""
+        """Processes the annotated examples into a DataFrame containing a rubric of (dict of dict) column. The rows are
+        processed in `n_postprocessing_workers` processes (defaults to the value given at initialization)."""
         df_rubrics = ae_utils.convert_to_dataframe(annotated)
         n_examples = len(df_rubrics)
         # filter out examples where annotation is missing (pd.isnull(value) or value is None)
@@ -61,33 +66,81 @@ class BaseRubricator(base.BaseAnnotatorJSON):
         if rubric_columns is None:
             rubric_columns = [self.annotation_key]
 
-        # TODO: remove hard coding
-        if self.annotation_key == "brainstormed_rubric":
-            df_rubrics["learning_objectives"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["learning_objectives"])
-            df_rubrics["brainstormed_response"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["brainstormed_response"])
-            df_rubrics["brainstormed_rubric"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["brainstormed_rubric"])
-        elif self.annotation_key == "rubric":
-            df_rubrics["excellent_response"] = df_rubrics["rubric"].apply(lambda x: x["excellent_response"])
-            df_rubrics["rubric"] = df_rubrics["rubric"].apply(lambda x: x["rubric"])
-
-        for col in rubric_columns:
-            # remove potential duplicate criteria in the rubric (happens with bad models)
-            df_rubrics[col] = df_rubrics[col].apply(
-                lambda x: pd.DataFrame(x).drop_duplicates(subset=["criterion"], keep="first").to_dict(orient="records")
-            )
-
-            if is_renormalize_weight:
-                # each element is a list of dicts, dicts have a key "weight" that we want to normalize over the list
-                # we do so by converting list of dict to df, then normalize "weight" then convert back to list of dict
-                df_rubrics[col] = df_rubrics[col].apply(
-                    lambda x: percentage_scale_df_(pd.DataFrame(x), columns=["weight"]).to_dict(orient="records")
-                )
-
-            if is_extract_criteria_col:
-                # for each rubric (which is a list of dict) make a list of the key "criterion"
-                df_rubrics["criteria"] = df_rubrics[col].apply(lambda x: [c["criterion"] for c in x])
-
-        return df_rubrics
+        return apply_in_parallel(
+            df_rubrics,
+            _postprocess_rubrics,
+            n_workers=n_postprocessing_workers or self.n_postprocessing_workers,
+            annotation_key=self.annotation_key,
+            rubric_columns=rubric_columns,
+            is_renormalize_weight=is_renormalize_weight,
+            is_extract_criteria_col=is_extract_criteria_col,
+        )
+
+
+def _postprocess_rubrics(
+    df_rubrics: pd.DataFrame,
+    annotation_key: str,
+    rubric_columns: Sequence[str],
+    is_renormalize_weight: bool = True,
+    is_extract_criteria_col: bool = True,
+) -> pd.DataFrame:
+    """Processing of the rubrics, defined at the module level to be able to run in a process pool."""
+    df_rubrics = df_rubrics.copy()
+
+    # TODO: remove hard coding
+    if annotation_key == "brainstormed_rubric":
+        df_rubrics["learning_objectives"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["learning_objectives"])
+        df_rubrics["brainstormed_response"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["brainstormed_response"])
+        df_rubrics["brainstormed_rubric"] = df_rubrics["brainstormed_rubric"].apply(lambda x: x["brainstormed_rubric"])
+    elif annotation_key == "rubric":
+        df_rubrics["excellent_response"] = df_rubrics["rubric"].apply(lambda x: x["excellent_response"])
+        df_rubrics["rubric"] = df_rubrics["rubric"].apply(lambda x: x["rubric"])
+
+    for col in rubric_columns:
+        # remove potential duplicate criteria in the rubric (happens with bad models) and renormalize the weights
+        rubrics, criteria = normalize_rubrics(df_rubrics[col], is_renormalize_weight=is_renormalize_weight)
+        df_rubrics[col] = pd.Series(rubrics, index=df_rubrics.index, dtype=object)
+
+        if is_extract_criteria_col:
+            df_rubrics["criteria"] = pd.Series(criteria, index=df_rubrics.index, dtype=object)
+
+    return df_rubrics
+
+
+def normalize_rubrics(
+    rubrics: Sequence[list[dict[str, Any]]], is_renormalize_weight: bool = True
+) -> tuple[list[list[dict[str, Any]]], list[list[str]]]:
+    """Normalize a batch of rubrics (lists of dicts with keys "criterion" and "weight") in one pass over their columnar
+    representation (`RaggedRecords`): duplicate criteria are removed (keeping the first), the weights are rescaled to
+    sum to 100 in each rubric, and the criteria are extracted. The cost is linear in the total number of criteria.
+
+    Returns:
+        tuple: The normalized rubrics and the list of criteria of each rubric.
+
+    Example:
+        >>> rubrics, criteria = normalize_rubrics([[{"criterion": "a", "weight": 3}, {"criterion": "b", "weight": 1},
+        ...                                         {"criterion": "a", "weight": 2}]])
+        >>> rubrics
+        [[{'criterion': 'a', 'weight': 75.0}, {'criterion': 'b', 'weight': 25.0}]]
+        >>> criteria
+        [['a', 'b']]
+    """
+    ragged = RaggedRecords.from_lists(rubrics)
+    criteria = ragged.get("criterion", default=None)
+    is_kept = ~pd.DataFrame({"rubric": ragged.rows, "criterion": criteria}).duplicated().to_numpy()
+    ragged = ragged.take_records(is_kept)
+    criteria = criteria[is_kept]
+
+    if is_renormalize_weight:
+        weights = pd.to_numeric(pd.Series(ragged.get("weight"), dtype=object), errors="coerce").to_numpy(dtype=float)
+        rows = ragged.rows
+        # same as pandas' sum: missing weights are skipped
+        sums = np.bincount(rows, weights=np.nan_to_num(weights), minlength=len(ragged))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = weights / sums[rows] * 100
+        ragged = ragged.set("weight", weights)
+
+    return ragged.to_lists(), ragged.split(criteria.tolist())
 
 
 class RubricBrainstormer(BaseRubricator):
@@ -1,13 +1,13 @@
 """Code for summarizing the rubric evaluation results."""
 import abc
-import copy
-import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
 from pathlib import Path
 from typing import Any, Callable, Optional, Sequence, Union
 
+import numpy as np
 import pandas as pd
 import yaml
 from alpaca_eval import completion_parsers as ae_completion_parsers
@@ -15,7 +15,21 @@ from alpaca_eval import types as ae_types
 from alpaca_eval import utils as ae_utils
 from alpaca_eval.decoders import get_fn_completions
 
-__all__ = ["summarize"]
+from . import clustering, parsing, prompts
+from .artifacts import ArtifactStore
+from .completion_cache import CompletionCache, get_completion_cache
+from .decoders import (
+    DEFAULT_MAX_CONCURRENCY,
+    cache_completions,
+    get_provider_key,
+    get_provider_semaphore,
+    rate_limited_completions,
+)
+from .helpers import hash_content
+from .ragged import RaggedRecords
+from .rate_limits import CHARS_PER_TOKEN, DEFAULT_LOCK_DIR, get_rate_limiter
+
+__all__ = ["summarize", "pack_examples"]
 
 
 def summarize(
@@ -59,19 +73,95 @@ def summarize(
     return summarizer(df)
 
 
+def pack_examples(
+    lengths: Sequence[int],
+    max_length: int,
+    min_examples: int = 2,
+    is_boundary: Optional[Sequence[bool]] = None,
+) -> list[tuple[int, int]]:
+    """Greedy next-fit packing of consecutive examples into chunks whose total length is at most `max_length`. Each
+    chunk has at least `min_examples` examples (if there are enough left) even if it is longer, so that every level of
+    the hierarchical summarization reduces the number of summaries.
+
+    Args:
+        lengths: Length of each example.
+        max_length: Maximum total length of the examples of a chunk.
+        min_examples: Minimum number of examples of a chunk.
+        is_boundary: Whether a chunk should also end after each example, e.g. the content-defined boundaries of
+            `is_content_boundary`. Such boundaries only depend on the examples themselves, so inserting or removing an
+            example only changes the chunk that contains it.
+
+    Returns:
+        list: The (start, end) indices of the examples of each chunk.
+
+    Example:
+        >>> pack_examples([3, 3, 3, 8, 1, 1], max_length=7)
+        [(0, 2), (2, 4), (4, 6)]
+        >>> pack_examples([1, 1, 1, 1, 1], max_length=7, is_boundary=[False, True, False, False, False])
+        [(0, 2), (2, 5)]
+    """
+    chunks = []
+    start, length = 0, 0
+    for i, example_length in enumerate(lengths):
+        is_full = length + example_length > max_length or (is_boundary is not None and i > 0 and is_boundary[i - 1])
+        if i - start >= min_examples and is_full:
+            chunks.append((start, i))
+            start, length = i, 0
+        length += example_length
+    if len(lengths) > start:
+        chunks.append((start, len(lengths)))
+    return chunks
+
+
+def is_content_boundary(key: str, length: int, target_length: int) -> bool:
+    """Whether a chunk of the summary tree ends after the example with the hexadecimal hash `key`. The probability is
+    `length / target_length`, so the chunks have on average `target_length` characters, but the decision only depends
+    on the example itself.
+
+    Example:
+        >>> is_content_boundary("0123456789abcdef", length=100, target_length=1000)
+        True
+        >>> is_content_boundary("fedcba9876543210", length=100, target_length=1000)
+        False
+    """
+    return int(key[:12], 16) / 16**12 < length / target_length
+
+
 class BaseSummarizer(abc.ABC):
     """Base class for summarizing the rubric grading.
 
     Args:
         configs_dir: Path to the directory containing the summarizer configs.
         summarize_by_cols: Columns to summarize by.
-        approx_max_characters_to_summarize: Approximate maximum number of characters to summarize. The actual prompt
-            size will be stochastic but shouldn't be more than 1.5 times this value (most likely less than 1.1 times).
-        cache_path: Path to the cache file.
+        approx_max_characters_to_summarize: Approximate maximum number of characters of each summarization prompt.
+            Only used if `max_prompt_tokens` is None.
+        max_prompt_tokens: Token budget of each summarization prompt, estimated with `CHARS_PER_TOKEN` characters per
+            token as the rate limiter. The examples are greedily packed into prompts up to this budget. If None, uses
+            `approx_max_characters_to_summarize / CHARS_PER_TOKEN`.
+        cache_path: Completion cache shared with the annotators, see `get_completion_cache`. If "auto", uses the SQLite
+            database `RUBRIC_EVAL_CACHE_DIR/completions.sqlite`. If None, completions are not cached.
         fn_completion_parser: Function to use for parsing completions.
         completion_parser_kwargs: Keyword arguments for the completion parser.
         fn_completions (str): Function in `decoders.py` to use for decoding the output.
         completions_kwargs (dict, optional): kwargs for fn_completions. E.g. model_name, max_tokens, temperature, top_p, top_k, stop_seq.
+        requests_per_minute: Requests per minute budget for the (provider, model_name), shared with the annotators.
+        tokens_per_minute: Tokens per minute budget for the (provider, model_name), shared with the annotators.
+        rate_limit_lock_dir: Directory used to share the rate limits across processes.
+        max_concurrency: Maximum number of concurrent summarization requests, shared with the annotators using the
+            same provider. If None or 1, the chunks are summarized sequentially. Defaults to
+            `RUBRIC_EVAL_MAX_CONCURRENCY` if set, otherwise None.
+        artifacts_dir: Directory of the content-addressed store of the summaries of the summary tree (see
+            `ArtifactStore`). Each summary is stored under the hash of the configs of the summarizer and of the
+            examples or summaries it summarizes, so regenerating a report after a small change only summarizes the
+            chunks that changed and their ancestors. If "auto", uses `RUBRIC_EVAL_CACHE_DIR/artifacts`. If None, no
+            store is used.
+        content_boundary_fraction: If given (and there is an artifact store), the chunks of the summary tree also end
+            at content-defined boundaries (see `is_content_boundary`) that target this fraction of the prompt budget,
+            e.g. 0.5, and the rows are sorted by their hash. Inserting or removing rows then only changes the chunks
+            that contain them, so more summaries are reused when a report is regenerated, at the cost of about
+            `1 / content_boundary_fraction` times more first-level summaries (and more levels) when nothing is cached.
+            If None, the rows are kept in the order of the input and the chunks are only packed up to the prompt
+            budget, which minimizes the number of requests.
     """
 
     def __init__(
@@ -79,13 +169,20 @@ class BaseSummarizer(abc.ABC):
         configs_dir: ae_types.AnyPath,
         summarize_by_cols: Sequence[str] = ("category",),
         approx_max_characters_to_summarize: Optional[int] = 70000,
-        cache_path: Optional[str] = "auto",
+        max_prompt_tokens: Optional[int] = None,
+        cache_path: Optional[Union[ae_types.AnyPath, CompletionCache]] = "auto",
         base_dir: ae_types.AnyPath = Path(__file__).parent / "configs" / "summarizers_configs",
         # completion arguments
         fn_completion_parser: Optional[Union[Callable, str]] = None,
         completion_parser_kwargs: Optional[dict[str, Any]] = None,
         fn_completions: Union[Callable, str] = "openai_completions",
         completions_kwargs: Optional[dict[str, Any]] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        rate_limit_lock_dir: Optional[ae_types.AnyPath] = DEFAULT_LOCK_DIR,
+        max_concurrency: Optional[int] = DEFAULT_MAX_CONCURRENCY,
+        artifacts_dir: Optional[ae_types.AnyPath] = "auto",
+        content_boundary_fraction: Optional[float] = None,
         # prompting arguments
         add_columns_to_format: tuple[str] = ("instruction", "category"),
         completion_key: str = "summary",
@@ -93,6 +190,7 @@ class BaseSummarizer(abc.ABC):
         self.configs_dir = Path(configs_dir)
         self.summarize_by_cols = summarize_by_cols
         self.approx_max_characters_to_summarize = approx_max_characters_to_summarize
+        self.max_prompt_tokens = max_prompt_tokens or approx_max_characters_to_summarize // CHARS_PER_TOKEN
         self.summaries = {}
         self.cache_path = cache_path
         self.base_dir = base_dir
@@ -100,25 +198,52 @@ class BaseSummarizer(abc.ABC):
 
         self.add_columns_to_format = add_columns_to_format
         self.completion_key = completion_key
+        self.artifact_store = ArtifactStore(artifacts_dir) if artifacts_dir is not None else None
+        self.content_boundary_fraction = content_boundary_fraction
+        self._hashed_configs = dict(
+            summarizer=self.__class__.__name__,
+            fn_completions=fn_completions if isinstance(fn_completions, str) else repr(fn_completions),
+            completions_kwargs=self.completions_kwargs,
+            fn_completion_parser=fn_completion_parser if isinstance(fn_completion_parser, str) else None,
+            completion_parser_kwargs=completion_parser_kwargs,
+            add_columns_to_format=list(add_columns_to_format),
+            completion_key=completion_key,
+            version=ae_utils.get_multi_package_version(["rubric_eval", "alpaca_eval"]),
+        )
 
         # init completion function
-        if self.cache_path == "auto":
-            self.cache_path = self.configs_dir / "cache.json"
-        if cache_path:
-            cache_completions = get_fn_completions("cache_completions")
+        self.max_concurrency = max_concurrency
+        self._provider = get_provider_key(fn_completions, self.completions_kwargs)
+        rate_limiter = get_rate_limiter(
+            self._provider,
+            model_name=self.completions_kwargs.get("model_name", ""),
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            lock_dir=rate_limit_lock_dir,
+        )
+        self.completion_cache = get_completion_cache(cache_path)
+        if self.completion_cache is not None:
             self._fn_completions = partial(
                 cache_completions,
                 fn_completions=fn_completions,
-                cache_path=self.cache_path,
+                cache=self.completion_cache,
+                rate_limiter=rate_limiter,
                 **self.completions_kwargs,
             )
         else:
             fn_completions = get_fn_completions(fn_completions)
-            self._fn_completions = partial(fn_completions, **self.completions_kwargs)
+            self._fn_completions = partial(
+                rate_limited_completions,
+                fn_completions=fn_completions,
+                rate_limiter=rate_limiter,
+                **self.completions_kwargs,
+            )
 
         # init completion parser
         if fn_completion_parser is None:
             fn_completion_parser = lambda x: [x]
+        elif isinstance(fn_completion_parser, str) and fn_completion_parser in parsing.__all__:
+            fn_completion_parser = getattr(parsing, fn_completion_parser)
         elif isinstance(fn_completion_parser, str):
             fn_completion_parser = ae_utils.get_module_attribute(ae_completion_parsers, fn_completion_parser)
         completion_parser_kwargs = completion_parser_kwargs or {}
@@ -134,6 +259,52 @@ class BaseSummarizer(abc.ABC):
         """Summarize the rubric evaluation results."""
         ...
 
+    @property
+    def config_hash(self) -> str:
+        """Hash of the configs and prompt templates of the summarizer, i.e., changes whenever the summary of the same
+        examples could change."""
+        return hash_content(self._hashed_configs)
+
+    def _generate_and_parse_memoized(
+        self, keys: Sequence[Optional[str]], fn_make_prompt: Callable[[int], str]
+    ) -> list[dict[str, Any]]:
+        """Same as `_generate_and_parse_many` but the summaries are reused from the artifact store if their key is
+        there, and only the prompts `fn_make_prompt(i)` of the missing summaries are built and summarized."""
+        summaries = [None] * len(keys)
+        if self.artifact_store is not None:
+            stored = self.artifact_store.get_many([k for k in keys if k is not None])
+            summaries = [stored.get(k) if k is not None else None for k in keys]
+
+        idcs_missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if self.artifact_store is not None:
+            logging.info(
+                f"Reusing {len(keys) - len(idcs_missing)} summaries from {self.artifact_store}, summarizing "
+                f"{len(idcs_missing)}."
+            )
+        new_summaries = self._generate_and_parse_many([fn_make_prompt(i) for i in idcs_missing])
+        for i, summary in zip(idcs_missing, new_summaries):
+            summaries[i] = summary
+        if self.artifact_store is not None:
+            self.artifact_store.put_many(
+                {keys[i]: summary for i, summary in zip(idcs_missing, new_summaries) if keys[i] is not None}
+            )
+        return summaries
+
+    def _generate_and_parse_many(self, prompts: Sequence[str]) -> list[dict[str, Any]]:
+        """Same as `_generate_and_parse` for multiple prompts, with up to `max_concurrency` requests in flight. The
+        outputs are in the same order as `prompts`."""
+        n_workers = min(self.max_concurrency or 1, len(prompts))
+        if n_workers <= 1:
+            return [self._generate_and_parse(prompt) for prompt in prompts]
+
+        logging.info(f"Summarizing {len(prompts)} chunks with up to {n_workers} concurrent requests.")
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="rubric_eval_summarizer") as executor:
+            return list(executor.map(self._generate_and_parse_with_semaphore, prompts))
+
+    def _generate_and_parse_with_semaphore(self, prompt: str) -> dict[str, Any]:
+        with get_provider_semaphore(self._provider, self.max_concurrency):
+            return self._generate_and_parse(prompt)
+
     def _generate_and_parse(self, prompt) -> dict[str, Any]:
         """Helper function to generate prompts, get completions and parse them."""
         completions = self._fn_completions(prompts=[prompt])
@@ -168,66 +339,160 @@ class UnstructuredSummarizer(BaseSummarizer):
         subsequent_prompt_template = subsequent_prompt_template or prompt_template
         self.subsequent_prompt_template = ae_utils.read_or_return(subsequent_prompt_template, relative_to=self.base_dir)
         self.example_delimiter = example_delimiter
+        self._hashed_configs.update(
+            cols_to_split_by=list(cols_to_split_by),
+            is_add_rubric_description=is_add_rubric_description,
+            initial_prompt_template=self.initial_prompt_template,
+            subsequent_prompt_template=self.subsequent_prompt_template,
+            example_delimiter=example_delimiter,
+        )
 
     def summarize(self, df: pd.DataFrame, *args, **kwargs) -> dict[str, str]:
-        """Summarize the rubric evaluation results in an unstructured format."""
+        """Summarize the rubric evaluation results in an unstructured format. The chunks of all the splits are
+        summarized concurrently, and so are the summaries of each level of the hierarchy.
+
+        If there is an artifact store, the summaries form a content-addressed tree: each leaf summary is keyed by the
+        hashes of its rows and each internal summary by the keys of its children. Only the summaries whose key is not
+        in the store are generated. If `content_boundary_fraction` is given, the rows are sorted by their hash and
+        split at content-defined boundaries, otherwise they are summarized in the order of the input.
+        """
         splits = self._split_dfs_by_cols(df)
         if len(splits) == 1:
             # Summarize df using potential hierarchy if doesn't fit in approx_max_characters_to_summarize
             summary_completions = self._get_summary(df)
         else:
             # 1. Summarize each split (e.g. category) separately using potential hierarchy
-            all_summaries = dict()
-            for val_splitted_by, split_df in splits:
-                all_summaries[val_splitted_by] = self._get_summary(split_df)
+            split_summaries, split_keys = self._get_summaries([split_df for _, split_df in splits])
+            all_summaries = {val_splitted_by: summary for (val_splitted_by, _), summary in zip(splits, split_summaries)}
 
             # 2. Summarize the splitted summaries
-            summary_completions = self._get_subsequent_summary(list(all_summaries.values()), n_examples=len(df))
+            (summary_completions,), _ = self._get_subsequent_summaries(
+                [list(all_summaries.values())], all_n_examples=[len(df)], all_keys=[split_keys]
+            )
             summary_completions["summaries_splitted"] = all_summaries
 
         return summary_completions
 
     def _get_summary(self, df: pd.DataFrame) -> dict[str, str]:
         """Get the summary of the DataFrame."""
+        summaries, _ = self._get_summaries([df])
+        return summaries[0]
+
+    def _get_summaries(self, dfs: Sequence[pd.DataFrame]) -> tuple[list[dict[str, str]], list[Optional[str]]]:
+        """Get the summary of each DataFrame and its key in the summary tree. The initial summaries of the chunks of
+        all the DataFrames are generated concurrently."""
+        chunks, all_chunk_keys, all_n_chunks = [], [], []
+        for df in dfs:
+            rubric_based_evaluations = self._get_rubric_based_evaluations(df)
+            row_keys = None
+            if self.artifact_store is not None:
+                row_keys = self._hash_rows(df, rubric_based_evaluations)
+            if row_keys is not None and self.content_boundary_fraction is not None:
+                # content-defined boundaries only localize a change if the rows are in an order that doesn't depend
+                # on the input, otherwise the examples are kept in the order of the input
+                order = np.argsort(row_keys, kind="stable")
+                df = df.iloc[order]
+                rubric_based_evaluations = [rubric_based_evaluations[i] for i in order]
+                row_keys = [row_keys[i] for i in order]
+
+            examples = self._format_initial_examples(df, rubric_based_evaluations)
+            df_chunks = self._get_chunks(
+                [len(example) for example in examples], self.initial_prompt_template, example_keys=row_keys
+            )
+            for start, end in df_chunks:
+                chunks.append((df.iloc[start:end], rubric_based_evaluations[start:end]))
+                all_chunk_keys.append(
+                    self._hash_node("initial", row_keys[start:end]) if row_keys is not None else None
+                )
+            all_n_chunks.append(len(df_chunks))
 
-        # initialize summary
-        summaries = []
-        formatted_cols = list(self.add_columns_to_format) + ["evaluation"]
-        for split_df in self._split_dfs_by_lengths(
-            df, formatted_cols=formatted_cols, prompt_template=self.initial_prompt_template
-        ):
-            prompt = self._make_initial_prompt(split_df)
-            summaries.append(self._generate_and_parse(prompt))
-
-        return self._get_subsequent_summary(summaries, n_examples=len(df))
+        summaries = iter(
+            self._generate_and_parse_memoized(
+                all_chunk_keys,
+                lambda i: self._fill_prompt(self.initial_prompt_template, self._format_initial_examples(*chunks[i])),
+            )
+        )
+        chunk_keys = iter(all_chunk_keys)
+        all_summaries = [[next(summaries) for _ in range(n_chunks)] for n_chunks in all_n_chunks]
+        all_keys = [[next(chunk_keys) for _ in range(n_chunks)] for n_chunks in all_n_chunks]
+        return self._get_subsequent_summaries(
+            all_summaries, all_n_examples=[len(df) for df in dfs], all_keys=all_keys
+        )
 
     def _get_subsequent_summary(self, summaries: list[dict[str, Any]], n_examples: int) -> dict[str, str]:
         """Summarize a dataframe of summaries, where the summary is potentially hierarchical in case the
         prompt is longer than `approx_max_characters_to_summarize`.
         """
-        total_time = 0
-        total_price = 0
+        outs, _ = self._get_subsequent_summaries([summaries], all_n_examples=[n_examples])
+        return outs[0]
 
-        if len(summaries) < 1:
+    def _get_subsequent_summaries(
+        self,
+        all_summaries: list[list[dict[str, Any]]],
+        all_n_examples: Sequence[int],
+        all_keys: Optional[list[list[Optional[str]]]] = None,
+    ) -> tuple[list[dict[str, str]], list[Optional[str]]]:
+        """Same as `_get_subsequent_summary` for multiple lists of summaries, which are reduced level by level. The
+        summaries of a level are generated concurrently across all the lists, so the tree of summaries is the same as
+        when reducing each list separately. Also returns the key of each final summary in the summary tree, given the
+        keys `all_keys` of the summaries (None if they are not in the tree)."""
+        if any(len(summaries) < 1 for summaries in all_summaries):
             raise ValueError("Can't summarize fewer than one summaries.")
 
-        while len(summaries) > 1:
-            df_summaries = pd.DataFrame.from_records(summaries)
-            total_price += df_summaries["summarizer_price_per_example"].sum()
-            total_time += df_summaries["summarizer_time_per_example"].sum()
-            summaries = []
-            for split_df in self._split_dfs_by_lengths(
-                df_summaries, formatted_cols=[self.completion_key], prompt_template=self.subsequent_prompt_template
-            ):
-                prompt = self._make_prompt(
-                    split_df, self.subsequent_prompt_template, add_columns_to_format=[self.completion_key]
-                )
-                summaries.append(self._generate_and_parse(prompt))
+        all_summaries = [list(summaries) for summaries in all_summaries]
+        if all_keys is None:
+            all_keys = [[None] * len(summaries) for summaries in all_summaries]
+        all_keys = [list(keys) for keys in all_keys]
+        total_times = [0] * len(all_summaries)
+        total_prices = [0] * len(all_summaries)
+        while any(len(summaries) > 1 for summaries in all_summaries):
+            chunks, chunk_keys, idcs_to_reduce = [], [], []
+            for i, (summaries, keys) in enumerate(zip(all_summaries, all_keys)):
+                if len(summaries) <= 1:
+                    continue
+                df_summaries = pd.DataFrame.from_records(summaries)
+                total_prices[i] += df_summaries["summarizer_price_per_example"].sum()
+                total_times[i] += df_summaries["summarizer_time_per_example"].sum()
+                examples = self._format_examples(df_summaries, add_columns_to_format=[self.completion_key])
+                is_in_tree = all(key is not None for key in keys)
+                for start, end in self._get_chunks(
+                    [len(example) for example in examples],
+                    self.subsequent_prompt_template,
+                    example_keys=keys if is_in_tree else None,
+                ):
+                    chunks.append(df_summaries.iloc[start:end])
+                    chunk_keys.append(self._hash_node("subsequent", keys[start:end]) if is_in_tree else None)
+                    idcs_to_reduce.append(i)
+                all_summaries[i], all_keys[i] = [], []
+
+            summaries = self._generate_and_parse_memoized(
+                chunk_keys,
+                lambda j: self._make_prompt(
+                    chunks[j], self.subsequent_prompt_template, add_columns_to_format=[self.completion_key]
+                ),
+            )
+            for i, summary, key in zip(idcs_to_reduce, summaries, chunk_keys):
+                all_summaries[i].append(summary)
+                all_keys[i].append(key)
+
+        outs = []
+        for summaries, total_price, total_time, n_examples in zip(
+            all_summaries, total_prices, total_times, all_n_examples
+        ):
+            out = summaries[0]
+            out["summarizer_price_per_example"] = (out["summarizer_price_per_example"] + total_price) / n_examples
+            out["summarizer_time_per_example"] = (total_time + out["summarizer_time_per_example"]) / n_examples
+            outs.append(out)
+        return outs, [keys[0] for keys in all_keys]
 
-        out = summaries[0]
-        out["summarizer_price_per_example"] = (out["summarizer_price_per_example"] + total_price) / n_examples
-        out["summarizer_time_per_example"] = (total_time + out["summarizer_time_per_example"]) / n_examples
-        return out
+    def _hash_rows(self, df: pd.DataFrame, rubric_based_evaluations: list[list[dict[str, Any]]]) -> list[str]:
+        """Hash of the content of each row that is formatted in the initial prompt."""
+        columns = [df[col].tolist() for col in self.add_columns_to_format]
+        return [hash_content(*values) for values in zip(*columns, rubric_based_evaluations)]
+
+    def _hash_node(self, level: str, child_keys: Sequence[str]) -> str:
+        """Key of a summary of the summary tree, given the keys of the rows or summaries that it summarizes."""
+        return hash_content(self.config_hash, level, list(child_keys), length=32)
 
     def _split_dfs_by_cols(self, df: pd.DataFrame) -> list[tuple[str, pd.DataFrame]]:
         """Split the DataFrame based on the columns to split by, if it's in the dataframe.
@@ -256,106 +521,151 @@ class UnstructuredSummarizer(BaseSummarizer):
                 )
         return splitted_dfs
 
-    def _split_dfs_by_lengths(
-        self, df: pd.DataFrame, formatted_cols: Sequence[str], prompt_template: str
-    ) -> list[pd.DataFrame]:
-        """
-        Split the dataframe in such a ways that the columns to format have approx less than
-        `self.approx_max_characters_to_summarize` characters.
-        """
-        splitted_dfs = []
-
-        # Calculate the string length of the formatted columns
-        formatted_str = df[formatted_cols].to_string(index=False)
-
-        max_char = int((self.approx_max_characters_to_summarize - len(prompt_template)) * 0.9)
+    def _get_chunks(
+        self, example_lengths: Sequence[int], prompt_template: str, example_keys: Optional[Sequence[str]] = None
+    ) -> list[tuple[int, int]]:
+        """Split the examples into consecutive chunks whose prompts fit in `self.max_prompt_tokens`, by greedily
+        packing them given the number of characters of each formatted example (see `pack_examples`). If the hashes
+        `example_keys` of the examples are given and `content_boundary_fraction` is set, the chunks also end at
+        content-defined boundaries, which shortens them on average.
 
-        # If the formatted string length is within the limit, append the whole group
-        if len(formatted_str) <= max_char:
-            splitted_dfs.append(df)
-        else:
-            # Calculate the number of splits and rows per split
-            n_splits = len(formatted_str) // max_char + 1
-            n_rows_per_split = len(df) // n_splits + 1
-            if n_rows_per_split == 1:
-                logging.warning(
-                    "The number of evaluations to summarize is 1. Summarization of a single row is not useful, so we use 2 intead."
-                    "Please consider increasing the `approx_max_characters_to_summarize` or the number of rows per split."
-                )
-                n_rows_per_split = 2
-
-            # Split the group DataFrame by rows
-            splitted_dfs.extend(df.iloc[i : i + n_rows_per_split] for i in range(0, len(df), n_rows_per_split))
+        Returns:
+            list: The (start, end) indices of the examples of each chunk.
+        """
+        n_template_chars = len(prompt_template.format(to_format=self.example_delimiter))
+        max_chars = self.max_prompt_tokens * CHARS_PER_TOKEN - n_template_chars
+        is_boundary = None
+        if example_keys is not None and self.content_boundary_fraction is not None:
+            target_length = max(1, int(max_chars * self.content_boundary_fraction))
+            is_boundary = [
+                is_content_boundary(key, length, target_length=target_length)
+                for key, length in zip(example_keys, example_lengths)
+            ]
+        chunks = pack_examples(example_lengths, max_length=max_chars, is_boundary=is_boundary)
 
+        n_chars_per_chunk = [sum(example_lengths[start:end]) for start, end in chunks]
+        if max(n_chars_per_chunk, default=0) > max_chars:
+            logging.warning(
+                f"{sum(n > max_chars for n in n_chars_per_chunk)} prompts are longer than `max_prompt_tokens="
+                f"{self.max_prompt_tokens}` because summarizing a single example is not useful. Please consider "
+                "increasing `max_prompt_tokens`."
+            )
+        if len(chunks) > 1:
             logging.info(
-                f"Splitting the DataFrame into {len(splitted_dfs)} parts of approx {n_rows_per_split} rows for hierarchical summarization."
+                f"Splitting the DataFrame into {len(chunks)} parts of {min(e - s for s, e in chunks)} to "
+                f"{max(e - s for s, e in chunks)} rows for hierarchical summarization."
             )
+        return chunks
 
-        return splitted_dfs
-
-    def _make_prompt(
+    def _format_examples(
         self,
         df: pd.DataFrame,
-        prompt_template: str,
         add_columns_to_format: Sequence[str] = tuple(),
-        fn_additional_to_format: Optional[Callable] = None,
-    ) -> str:
-        df = copy.deepcopy(df.reset_index())
-        prompt_template = copy.deepcopy(prompt_template)
-
-        to_format = copy.deepcopy(self.example_delimiter)
-        for i, row in df.iterrows():
-            for col in add_columns_to_format:
-                value = row[col]
-                if not isinstance(value, str):
-                    value = json.dumps(value, indent=2)
-                to_format += f"## {col.capitalize()} {i} \n{value}\n\n"
+        additional_columns: Sequence[tuple[str, Sequence[Any]]] = tuple(),
+    ) -> list[str]:
+        """Format each row of the DataFrame as an example of the prompt, followed by the example delimiter. The
+        (title, values) of `additional_columns` are formatted after the columns of the DataFrame."""
+        columns = [(col.capitalize(), df[col].tolist()) for col in add_columns_to_format] + list(additional_columns)
+        return prompts.format_examples(columns, delimiter=self.example_delimiter, n_examples=len(df))
 
-            if fn_additional_to_format:
-                to_format += fn_additional_to_format(i, row)
+    def _make_prompt(
+        self, df: pd.DataFrame, prompt_template: str, add_columns_to_format: Sequence[str] = tuple()
+    ) -> str:
+        return self._fill_prompt(prompt_template, self._format_examples(df, add_columns_to_format))
 
-            to_format += self.example_delimiter
+    def _fill_prompt(self, prompt_template: str, examples: Sequence[str]) -> str:
+        prompt = prompts.fill_template(prompt_template, examples, prefix=self.example_delimiter)
 
-        prompt = prompt_template.format(to_format=to_format)
-
-        if len(prompt) > 1.5 * self.approx_max_characters_to_summarize:
-            logging.warning(
-                f"The prompt is much longer than `approx_max_characters_to_summarize={self.approx_max_characters_to_summarize}`..."
-            )
+        if len(prompt) > 1.5 * self.max_prompt_tokens * CHARS_PER_TOKEN:
+            logging.warning(f"The prompt is much longer than `max_prompt_tokens={self.max_prompt_tokens}`...")
 
         return prompt
 
-    def _make_initial_prompt(self, df: pd.DataFrame) -> str:
-        def fn_additional_to_format(i, row):
-            """Additional formatting for rubric."""
-            evaluation_dict = {e["criterion"]: e for e in row["evaluation"]}
-            for rubric_per_crit in row["rubric"]:  # list of dict
-                curr_eval = evaluation_dict[rubric_per_crit["criterion"]]
-                curr_eval["criteria_weight"] = rubric_per_crit["weight"]
-                if self.is_add_rubric_description:
-                    desc = rubric_per_crit["performance_to_description"][curr_eval["performance"]]
-                    curr_eval["rubric_description"] = desc
-
-            value = json.dumps(list(evaluation_dict.values()), indent=2)
-            return f"## Rubric-based evaluation {i} \n{value}\n\n"
-
-        return self._make_prompt(
+    def _format_initial_examples(
+        self, df: pd.DataFrame, rubric_based_evaluations: Optional[list[list[dict[str, Any]]]] = None
+    ) -> list[str]:
+        """Examples of the initial prompt: the columns to format and the rubric-based evaluation of each row."""
+        if rubric_based_evaluations is None:
+            rubric_based_evaluations = self._get_rubric_based_evaluations(df)
+        return self._format_examples(
             df,
-            self.initial_prompt_template,
             add_columns_to_format=self.add_columns_to_format,
-            fn_additional_to_format=fn_additional_to_format,
+            additional_columns=[("Rubric-based evaluation", rubric_based_evaluations)],
         )
 
+    def _get_rubric_based_evaluations(self, df: pd.DataFrame) -> list[list[dict[str, Any]]]:
+        """Add the weight ("criteria_weight") and the description of the performance ("rubric_description") of each
+        criterion of the rubric to its evaluation, in one pass over the columnar evaluations and rubrics. The
+        evaluations of the input DataFrame are not modified."""
+        evaluations = RaggedRecords.from_lists(df["evaluation"])
+        # keep a single evaluation per criterion
+        df_evaluation = evaluations.to_frame(["criterion", "performance"])
+        is_first = ~df_evaluation[["row", "criterion"]].duplicated().to_numpy()
+        evaluations = evaluations.take_records(is_first)
+        df_evaluation = df_evaluation[is_first].assign(idx=np.arange(evaluations.n_records))
+
+        rubrics = RaggedRecords.from_lists(df["rubric"])
+        df_rubric = pd.DataFrame(
+            dict(
+                row=rubrics.rows,
+                criterion=rubrics.get("criterion"),
+                weight=rubrics.get("weight", default=None),
+                performance_to_description=rubrics.get("performance_to_description", default=None),
+            )
+        ).drop_duplicates(subset=["row", "criterion"], keep="last")
+        df_merged = df_evaluation.merge(df_rubric, on=["row", "criterion"], how="inner")
+        idcs = df_merged["idx"].to_numpy()
+        is_in_rubric = np.zeros(evaluations.n_records, dtype=bool)
+        is_in_rubric[idcs] = True
+
+        weights = np.full(evaluations.n_records, None, dtype=object)
+        weights[idcs] = df_merged["weight"].to_numpy(dtype=object)
+        evaluations = evaluations.set("criteria_weight", weights, mask=is_in_rubric)
+        if self.is_add_rubric_description:
+            descriptions = np.full(evaluations.n_records, None, dtype=object)
+            descriptions[idcs] = [
+                performance_to_description[performance]
+                for performance_to_description, performance in zip(
+                    df_merged["performance_to_description"], df_merged["performance"]
+                )
+            ]
+            evaluations = evaluations.set("rubric_description", descriptions, mask=is_in_rubric)
+        return evaluations.to_lists()
+
+
+class StructuredSummarizer(UnstructuredSummarizer):
+    """Summarizer that clusters the per-criterion feedback locally before any LLM call, and only summarizes the
+    representative feedback of each cluster with its count. The feedback of the evaluations of the same performance
+    level (and category) are clustered by near-duplicate detection (see `clustering.cluster_near_duplicates`), so the
+    prompts are much shorter than the full rubric-based evaluations of `UnstructuredSummarizer` while keeping the same
+    output schema. The clusters are then summarized hierarchically as in `UnstructuredSummarizer`.
+
+    Args:
+        add_columns_to_format: Columns of the clusters to format in the prompt.
+        similarity_threshold: Minimum estimated Jaccard similarity of the words of two feedback to be clustered.
+        n_permutations: Number of permutations of the MinHash signatures.
+        n_bands: Number of bands of the locality sensitive hashing, the more bands the more candidate pairs.
+        seed: Seed of the MinHash permutations.
+    """
 
-class StructuredSummarizer(BaseSummarizer):
     def __init__(
         self,
         *args,
-        apply_structured_summary_at_each_level: bool = True,
+        add_columns_to_format: tuple[str] = ("category", "criterion", "performance", "count", "feedback"),
+        similarity_threshold: float = clustering.SIMILARITY_THRESHOLD,
+        n_permutations: int = clustering.N_PERMUTATIONS,
+        n_bands: int = clustering.N_BANDS,
+        seed: int = 123,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        self.apply_structured_summay_at_each_level = apply_structured_summary_at_each_level
+        super().__init__(*args, add_columns_to_format=add_columns_to_format, **kwargs)
+        self.similarity_threshold = similarity_threshold
+        self.n_permutations = n_permutations
+        self.n_bands = n_bands
+        self.seed = seed
+        self._hashed_configs.update(
+            similarity_threshold=similarity_threshold, n_permutations=n_permutations, n_bands=n_bands, seed=seed
+        )
 
     def summarize(self, df: pd.DataFrame, *args, **kwargs) -> dict[str, str]:
         """
@@ -367,4 +677,101 @@ class StructuredSummarizer(BaseSummarizer):
         Returns:
             str: A structured summary of the rubric evaluation results.
         """
-        ...
+        df_clusters = self.cluster_feedback(df)
+        splits = self._split_dfs_by_cols(df)
+        if df_clusters.empty:
+            logging.warning("None of the evaluations has feedback to summarize, so the summary is empty.")
+            summary_completions = self._get_empty_summary()
+            if len(splits) > 1:
+                summary_completions["summaries_splitted"] = {val: self._get_empty_summary() for val, _ in splits}
+            return summary_completions
+
+        summary_completions = super().summarize(df_clusters)
+
+        # the price and time are per evaluated example, not per cluster
+        summary_completions["summarizer_price_per_example"] *= len(df_clusters) / len(df)
+        summary_completions["summarizer_time_per_example"] *= len(df_clusters) / len(df)
+        if "summaries_splitted" in summary_completions:
+            n_examples = {val_splitted_by: len(split_df) for val_splitted_by, split_df in splits}
+            for val_splitted_by, split_df in self._split_dfs_by_cols(df_clusters):
+                summary = summary_completions["summaries_splitted"][val_splitted_by]
+                summary["summarizer_price_per_example"] *= len(split_df) / n_examples[val_splitted_by]
+                summary["summarizer_time_per_example"] *= len(split_df) / n_examples[val_splitted_by]
+        elif len(splits) > 1:
+            # a single split has feedback, so its summary is the summary of all the feedback
+            cols_to_split_by = [col for col in self.cols_to_split_by if col in df.columns]
+            val_splitted_by = ", ".join(str(df_clusters[col].iloc[0]) for col in cols_to_split_by)
+            summary = dict(summary_completions)
+            n_examples = {val: len(split_df) for val, split_df in splits}[val_splitted_by]
+            summary["summarizer_price_per_example"] *= len(df) / n_examples
+            summary["summarizer_time_per_example"] *= len(df) / n_examples
+            summary_completions["summaries_splitted"] = {val_splitted_by: summary}
+
+        if len(splits) > 1:
+            # the splits without any feedback have no cluster
+            summary_completions["summaries_splitted"] = {
+                val: summary_completions["summaries_splitted"].get(val, self._get_empty_summary()) for val, _ in splits
+            }
+        return summary_completions
+
+    def _get_empty_summary(self) -> dict[str, Any]:
+        """Summary of evaluations without any feedback, with the same keys as the generated summaries."""
+        return {
+            "summarizer_price_per_example": 0.0,
+            "summarizer_time_per_example": 0.0,
+            "summarizer_date": datetime.now().isoformat(),
+            "summarizer_version": ae_utils.get_multi_package_version(["rubric_eval", "alpaca_eval"]),
+            self.completion_key: dict(strengths=[], weaknesses=[], suggestions=[], overall_assessment=""),
+        }
+
+    def cluster_feedback(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Cluster the feedback of all the criteria of all the evaluations by performance level and by the columns to
+        split by (e.g. category).
+
+        Returns:
+            pd.DataFrame: One row per cluster, sorted by decreasing size within each split, with the columns to split
+            by, the criterion and the feedback of the representative of the cluster, the performance level and the
+            number of feedback in the cluster ("count"). Missing or blank feedback are ignored, so it's empty if no
+            evaluation has feedback.
+        """
+        cols_to_split_by = [col for col in self.cols_to_split_by if col in df.columns]
+        evaluations = RaggedRecords.from_lists(df["evaluation"])
+        df_feedback = evaluations.to_frame(["criterion", "performance", "feedback"])
+        # evaluations without feedback would only make clusters of empty feedback
+        is_feedback = df_feedback["feedback"].notna() & (df_feedback["feedback"].astype(str).str.strip() != "")
+        df_feedback = df_feedback[is_feedback].reset_index(drop=True)
+        for col in cols_to_split_by:
+            df_feedback[col] = df[col].to_numpy()[df_feedback["row"].to_numpy()]
+        df_feedback["performance"] = df_feedback["performance"].astype(str).str.strip().str.lower()
+
+        # clustering the criterion with its feedback, because the criteria are specific to each instruction
+        texts = (df_feedback["criterion"].astype(str) + ": " + df_feedback["feedback"].astype(str)).tolist()
+        groups = list(zip(*[df_feedback[col].astype(str) for col in cols_to_split_by + ["performance"]]))
+        clusters = clustering.cluster_near_duplicates(
+            texts,
+            groups=[hash_content(*group) for group in groups],
+            similarity_threshold=self.similarity_threshold,
+            n_permutations=self.n_permutations,
+            n_bands=self.n_bands,
+            seed=self.seed,
+        )
+        representatives = np.unique(clusters, return_index=True)[1]
+
+        df_clusters = df_feedback.iloc[representatives][cols_to_split_by + ["criterion", "performance", "feedback"]]
+        df_clusters.insert(len(df_clusters.columns) - 1, "count", np.bincount(clusters))
+        df_clusters = df_clusters.sort_values(
+            cols_to_split_by + ["count"], ascending=[True] * len(cols_to_split_by) + [False], kind="stable"
+        )
+        logging.info(
+            f"Clustered {len(df_feedback)} feedback of {len(df)} evaluations into {len(df_clusters)} clusters."
+        )
+        return df_clusters.reset_index(drop=True)
+
+    def _get_rubric_based_evaluations(self, df: pd.DataFrame) -> list[None]:
+        # the clusters only contain the columns to format
+        return [None] * len(df)
+
+    def _format_initial_examples(
+        self, df: pd.DataFrame, rubric_based_evaluations: Optional[list[None]] = None
+    ) -> list[str]:
+        return self._format_examples(df, add_columns_to_format=self.add_columns_to_format)
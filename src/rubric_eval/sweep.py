@@ -0,0 +1,129 @@
+"""Scheduling of a DAG of tasks, e.g., a sweep over models x datasets x stages."""
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+from alpaca_eval.types import AnyPath
+
+__all__ = ["Task", "run_dag"]
+
+
+class Task:
+    """A node of the DAG.
+
+    Args:
+        name: Unique name of the task.
+        fn: Function to call without arguments to run the task.
+        dependencies: Names of the tasks that need to finish successfully before running this task.
+        artifact_path: Path of the file written by the task. If it exists, the task is considered done.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], Any],
+        dependencies: Sequence[str] = (),
+        artifact_path: Optional[AnyPath] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.dependencies = list(dependencies)
+        self.artifact_path = Path(artifact_path) if artifact_path is not None else None
+
+    def __repr__(self) -> str:
+        return f"Task(name={self.name!r}, dependencies={self.dependencies})"
+
+    @property
+    def is_done(self) -> bool:
+        return self.artifact_path is not None and self.artifact_path.exists()
+
+
+def run_dag(tasks: Sequence[Task], max_workers: int = 8, is_skip_existing: bool = True) -> dict[str, str]:
+    """Run the tasks from a single work queue, each task starts as soon as all its dependencies are done.
+
+    Args:
+        tasks: Tasks to run.
+        max_workers: Maximum number of tasks running at the same time.
+        is_skip_existing: Whether to skip the tasks whose artifact already exists.
+
+    Returns:
+        dict[str, str]: Status of each task: "success", "skipped" (artifact existed), "failed", or "upstream_failed".
+
+    Example:
+        >>> order = []
+        >>> tasks = [Task("b", lambda: order.append("b"), dependencies=["a"]), Task("a", lambda: order.append("a"))]
+        >>> run_dag(tasks, max_workers=2)
+        {'b': 'success', 'a': 'success'}
+        >>> order
+        ['a', 'b']
+    """
+    name_to_task = {t.name: t for t in tasks}
+    if len(name_to_task) != len(tasks):
+        raise ValueError("Task names should be unique.")
+
+    children = {name: [] for name in name_to_task}
+    n_missing_deps = {}
+    for task in tasks:
+        missing = [d for d in task.dependencies if d not in name_to_task]
+        if len(missing) > 0:
+            raise ValueError(f"Task {task.name} depends on unknown tasks: {missing}.")
+        for dependency in task.dependencies:
+            children[dependency].append(task.name)
+        n_missing_deps[task.name] = len(task.dependencies)
+
+    statuses = {}
+    ready = [name for name, n in n_missing_deps.items() if n == 0]
+    running: dict[Future, str] = {}
+
+    def _finish(name: str, status: str):
+        statuses[name] = status
+        if status in ("success", "skipped"):
+            for child in children[name]:
+                n_missing_deps[child] -= 1
+                if n_missing_deps[child] == 0:
+                    ready.append(child)
+        else:
+            to_cancel = list(children[name])
+            while to_cancel:
+                child = to_cancel.pop()
+                if child not in statuses:
+                    statuses[child] = "upstream_failed"
+                    to_cancel.extend(children[child])
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rubric_eval_sweep") as executor:
+        while ready or running:
+            while ready:
+                name = ready.pop(0)
+                if name in statuses:  # already cancelled
+                    continue
+                task = name_to_task[name]
+                if is_skip_existing and task.is_done:
+                    logging.info(f"Skipping {name} because {task.artifact_path} exists.")
+                    _finish(name, "skipped")
+                    continue
+                logging.info(f"Starting {name}.")
+                running[executor.submit(task.fn)] = name
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    logging.exception(f"Error in {name}:")
+                    _finish(name, "failed")
+                else:
+                    logging.info(f"Finished {name}.")
+                    _finish(name, "success")
+
+    never_ran = [name for name in name_to_task if name not in statuses]
+    if len(never_ran) > 0:
+        raise ValueError(f"The following tasks have cyclic dependencies: {never_ran}.")
+
+    n_per_status = {s: list(statuses.values()).count(s) for s in sorted(set(statuses.values()))}
+    logging.info(f"Finished running {len(tasks)} tasks: {n_per_status}.")
+    return {name: statuses[name] for name in name_to_task}
@@ -0,0 +1,119 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from rubric_eval.checkpoints import get_checkpoint_path, load_checkpoint, run_with_checkpoints
+
+
+class Shouter:
+    """Stage that upper cases the instructions, records the rows it processed and can crash on some of them."""
+
+    def __init__(self, crash_on=()):
+        self.crash_on = set(crash_on)
+        self.seen = []
+
+    def __call__(self, df):
+        if df["instruction"].isin(self.crash_on).any():
+            raise RuntimeError("crash")
+        self.seen.extend(df["instruction"])
+        return df.assign(output=df["instruction"].str.upper())
+
+
+class TestRunWithCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output_path = Path(self.tmpdir.name) / "outputs.json"
+        self.checkpoint_path = get_checkpoint_path(self.output_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _crash_after_first_chunk(self, df_input, **kwargs):
+        """Run the stage on chunks of 2 rows and crash on the third row."""
+        if isinstance(df_input, list):
+            df_input = pd.DataFrame(dict(instruction=df_input))
+        stage = Shouter(crash_on=[df_input["instruction"].iloc[2]])
+        with self.assertRaises(RuntimeError):
+            run_with_checkpoints(df_input, stage, self.output_path, chunksize=2, **kwargs)
+        return stage
+
+    def test_resume_only_runs_remaining_rows(self):
+        stage = self._crash_after_first_chunk(["q1", "q2", "q3", "q4"])
+        self.assertEqual(stage.seen, ["q1", "q2"])
+        self.assertEqual([r["instruction"] for r in load_checkpoint(self.checkpoint_path)], ["q1", "q2"])
+
+        stage = Shouter()
+        df_output = run_with_checkpoints(
+            pd.DataFrame(dict(instruction=["q1", "q2", "q3", "q4"])), stage, self.output_path, is_resume=True
+        )
+        self.assertEqual(stage.seen, ["q3", "q4"])
+        self.assertEqual(df_output["output"].tolist(), ["Q1", "Q2", "Q3", "Q4"])
+        self.assertNotIn("_checkpoint_key", df_output.columns)
+
+        # the final output is written and the write-ahead file removed
+        with open(self.output_path) as f:
+            self.assertEqual([r["output"] for r in json.load(f)], ["Q1", "Q2", "Q3", "Q4"])
+        self.assertFalse(self.checkpoint_path.exists())
+
+    def test_resume_follows_the_order_of_the_new_input(self):
+        self._crash_after_first_chunk(["q1", "q2", "q3", "q4"])
+
+        # rows were inserted, reordered and removed since the crash
+        stage = Shouter()
+        df_input = pd.DataFrame(dict(instruction=["q0", "q4", "q2", "q3"]))
+        df_output = run_with_checkpoints(df_input, stage, self.output_path, is_resume=True)
+        self.assertEqual(sorted(stage.seen), ["q0", "q3", "q4"])
+        self.assertEqual(df_output["instruction"].tolist(), ["q0", "q4", "q2", "q3"])
+        self.assertEqual(df_output["output"].tolist(), ["Q0", "Q4", "Q2", "Q3"])
+
+    def test_resume_with_repeated_rows(self):
+        self._crash_after_first_chunk(["q1", "q1", "q2", "q1"])
+
+        stage = Shouter()
+        df_input = pd.DataFrame(dict(instruction=["q1", "q1", "q2", "q1"]))
+        df_output = run_with_checkpoints(df_input, stage, self.output_path, is_resume=True)
+        # the first two occurrences of q1 are done, only the third one is run again
+        self.assertEqual(stage.seen, ["q2", "q1"])
+        self.assertEqual(df_output["instruction"].tolist(), ["q1", "q1", "q2", "q1"])
+
+    def test_without_resume_discards_checkpoint(self):
+        self._crash_after_first_chunk(["q1", "q2", "q3"])
+
+        stage = Shouter()
+        df_output = run_with_checkpoints(pd.DataFrame(dict(instruction=["q1", "q2", "q3"])), stage, self.output_path)
+        self.assertEqual(stage.seen, ["q1", "q2", "q3"])
+        self.assertEqual(df_output["output"].tolist(), ["Q1", "Q2", "Q3"])
+
+    def test_resume_ignores_partially_written_last_line(self):
+        self._crash_after_first_chunk(["q1", "q2", "q3"])
+        with open(self.checkpoint_path, "a") as f:
+            f.write('{"instruction": "q3", "out')
+
+        stage = Shouter()
+        df_output = run_with_checkpoints(
+            pd.DataFrame(dict(instruction=["q1", "q2", "q3"])), stage, self.output_path, is_resume=True
+        )
+        self.assertEqual(stage.seen, ["q3"])
+        self.assertEqual(df_output["output"].tolist(), ["Q1", "Q2", "Q3"])
+
+    def test_fn_hash_rows_keys_the_rows(self):
+        def fn_hash_rows(df):
+            return df["instruction"]
+
+        df_input = pd.DataFrame(dict(instruction=["q1", "q2", "q3"], note=["a", "b", "c"]))
+        self._crash_after_first_chunk(df_input, fn_hash_rows=fn_hash_rows)
+
+        # a column that isn't hashed changed, which doesn't invalidate the finished rows
+        stage = Shouter()
+        df_output = run_with_checkpoints(
+            df_input.assign(note=["d", "e", "f"]), stage, self.output_path, is_resume=True, fn_hash_rows=fn_hash_rows
+        )
+        self.assertEqual(stage.seen, ["q3"])
+        self.assertEqual(df_output["output"].tolist(), ["Q1", "Q2", "Q3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
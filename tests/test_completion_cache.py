@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pandas as pd
+from alpaca_eval.decoders.cache import cache_completions as json_cache_completions
+
+from rubric_eval.completion_cache import CompletionCache, get_completion_cache, get_completion_key
+from rubric_eval.decoders import cache_completions
+from rubric_eval.main import migrate_caches
+from rubric_eval.outputs import Outputer
+
+MODEL_CONFIGS = """
+test_model:
+  prompt_template: "test_model/prompt.txt"
+  fn_completions: "test_completions"
+  completions_kwargs:
+    model_name: "test"
+    value: "the output"
+  batch_size: 1
+  fn_completion_parser: null
+"""
+
+
+def failing_test_completions():
+    """Replaces `test_completions` to check that the completions come from the cache."""
+    mock = Mock(side_effect=AssertionError("The completion should have been cached."))
+    mock.__name__ = "test_completions"
+    return patch("alpaca_eval.decoders.test.test_completions", mock)
+
+
+class TestCompletionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.cache = CompletionCache(self.dir / "completions.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_and_get(self):
+        self.assertEqual(len(self.cache), 0)
+        self.cache.put("k1", dict(completions=["a"]))
+        self.cache.put_many({"k1": dict(completions=["b"]), "k2": dict(completions=["c"])})
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get("k1"), dict(completions=["b"]))
+        self.assertIsNone(self.cache.get("k3"))
+        keys = [f"k{i}" for i in range(2000)]  # more keys than variables per query
+        self.assertEqual(set(self.cache.get_many(keys)), {"k1", "k2"})
+
+        # another connection to the same database sees the same completions
+        self.assertEqual(CompletionCache(self.cache.path).get("k2"), dict(completions=["c"]))
+
+    def test_get_completion_cache(self):
+        self.assertIsNone(get_completion_cache(None))
+        self.assertIs(get_completion_cache(self.cache), self.cache)
+        self.assertIs(get_completion_cache(self.dir / "a.sqlite"), get_completion_cache(str(self.dir / "a.sqlite")))
+        with patch.dict(os.environ, {"RUBRIC_EVAL_CACHE_DIR": str(self.dir / "auto")}):
+            self.assertEqual(get_completion_cache("auto").path, self.dir / "auto" / "completions.sqlite")
+
+    def test_import_json_cache_of_cache_completions(self):
+        # JSON cache written by the previous summarizers, i.e. `alpaca_eval.decoders.cache_completions`
+        json_path = self.dir / "cache.json"
+        prompts = ["Summarize A", "Summarize B"]
+        kwargs = dict(model_name="test", value="summary")
+        previous = json_cache_completions(prompts, "test_completions", json_path, **kwargs)
+
+        self.assertEqual(self.cache.import_json(json_path), 2)
+        self.assertEqual(len(self.cache), 2)
+        key = get_completion_key(prompts[0], "test_completions", kwargs)
+        self.assertEqual(self.cache.get(key), previous[0])
+
+        with failing_test_completions():
+            completions = cache_completions(prompts, "test_completions", cache=self.cache, **kwargs)
+        self.assertEqual(completions, previous)
+
+    def test_import_json_cache_rejects_other_files(self):
+        json_path = self.dir / "cache.json"
+        json_path.write_text(json.dumps([{"prompt": "a"}]))
+        with self.assertRaises(ValueError):
+            self.cache.import_json(json_path)
+
+
+class TestMigrateCaches(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.configs_dir = self.dir / "models_configs"
+        model_dir = self.configs_dir / "test_model"
+        model_dir.mkdir(parents=True)
+        (model_dir / "configs.yaml").write_text(MODEL_CONFIGS)
+        (model_dir / "prompt.txt").write_text("{instruction}")
+        self.env = patch.dict(os.environ, {"RUBRIC_EVAL_CACHE_DIR": str(self.dir / "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_migrate_caches_of_annotators_and_summarizers(self):
+        df = pd.DataFrame(dict(instruction=["q1", "q2", "q3"]))
+        # JSON cache of annotations written next to the configs, as before the completion cache
+        annotations_path = self.configs_dir / "test_model" / "annotations_seed0_configs.json"
+        outputer = Outputer(
+            annotators_config="test_model",
+            base_dir=self.configs_dir,
+            caching_path=annotations_path,
+            artifacts_dir=None,
+            completion_cache=None,
+        )
+        outputer(df)
+        self.assertTrue(annotations_path.exists())
+        summarizer_cache_path = self.configs_dir / "cache.json"
+        json_cache_completions(["Summarize"], "test_completions", summarizer_cache_path, model_name="test", value="s")
+
+        cache_path = self.dir / "completions.sqlite"
+        self.assertEqual(migrate_caches(self.configs_dir, cache_path=cache_path), 4)
+        self.assertEqual(len(get_completion_cache(cache_path)), 4)
+
+        with failing_test_completions():
+            outputer = Outputer(
+                annotators_config="test_model",
+                base_dir=self.configs_dir,
+                artifacts_dir=None,
+                completion_cache=cache_path,
+            )
+            annotations = outputer(df)
+        self.assertEqual([a["output"] for a in annotations], ["the output"] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
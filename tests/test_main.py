@@ -0,0 +1,161 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+
+from rubric_eval import main
+from rubric_eval.main import EVALUATION_HASH_COLUMN, _merge_incremental_evaluations, evaluate
+
+EVALUATOR_CONFIGS = """
+test_evaluator:
+  prompt_template: "test_evaluator/prompt.txt"
+  fn_completions: "test_completions"
+  completions_kwargs:
+    model_name: "test"
+    value: '{"rubric_grading": [{"criterion": "tone", "feedback": "ok", "explanation": "x", "performance": "good"}]}'
+  batch_size: 1
+  fn_completion_parser: "json_parser"
+  completion_parser_kwargs:
+    annotation_key: "rubric_grading"
+"""
+RUBRIC = [{"criterion": "tone", "weight": 100, "performance_to_description": {"good": "Good tone."}}]
+
+
+def make_outputs(instructions, outputs):
+    n = len(instructions)
+    return pd.DataFrame(
+        dict(
+            instruction=instructions,
+            output=outputs,
+            rubric=[RUBRIC] * n,
+            criteria=[["tone"]] * n,
+            excellent_response=["excellent"] * n,
+            category=["writing"] * n,
+        )
+    )
+
+
+class TestIncrementalEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        evaluator_dir = self.dir / "evaluators_configs" / "test_evaluator"
+        evaluator_dir.mkdir(parents=True)
+        (evaluator_dir / "configs.yaml").write_text(EVALUATOR_CONFIGS)
+        (evaluator_dir / "prompt.txt").write_text("{instruction}\n{rubric}\n{criteria}\n{excellent_response}\n{output}")
+        self.input_path = self.dir / "outputs.json"
+        self.output_path = self.dir / "evaluations.json"
+
+        self.env = patch.dict(os.environ, {"RUBRIC_EVAL_CACHE_DIR": str(self.dir / "cache")})
+        self.env.start()
+        # records the rows that are sent to the evaluator
+        self.evaluated = []
+        evaluate_from_df = main.evaluate_from_df
+
+        def recording_evaluate_from_df(df, **kwargs):
+            self.evaluated.extend(zip(df["instruction"], df["output"]))
+            return evaluate_from_df(df, **kwargs)
+
+        self.evaluate_patch = patch.object(main, "evaluate_from_df", recording_evaluate_from_df)
+        self.evaluate_patch.start()
+
+    def tearDown(self):
+        self.evaluate_patch.stop()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def _evaluate(self, df, is_incremental=True):
+        self.evaluated.clear()
+        df.to_json(self.input_path, orient="records")
+        evaluate(
+            self.input_path,
+            self.output_path,
+            evaluator_configs="test_evaluator",
+            is_incremental=is_incremental,
+            criteria_table_path=None,
+            base_dir=self.dir / "evaluators_configs",
+        )
+        with open(self.output_path) as f:
+            return pd.DataFrame(json.load(f))
+
+    def test_only_new_or_changed_rows_are_evaluated(self):
+        df_evaluations = self._evaluate(make_outputs(["q1", "q2", "q3"], ["a1", "a2", "a3"]))
+        self.assertEqual(len(self.evaluated), 3)
+        self.assertIn(EVALUATION_HASH_COLUMN, df_evaluations.columns)
+
+        # q2's output changed, q4 is new, q3 was removed and the rows were reordered
+        df_evaluations = self._evaluate(make_outputs(["q4", "q2", "q1"], ["a4", "a2 (v2)", "a1"]))
+        self.assertEqual(sorted(self.evaluated), [("q2", "a2 (v2)"), ("q4", "a4")])
+        self.assertEqual(df_evaluations["instruction"].tolist(), ["q4", "q2", "q1"])
+        self.assertEqual(df_evaluations["output"].tolist(), ["a4", "a2 (v2)", "a1"])
+        self.assertTrue(df_evaluations["weighted_score"].notna().all())
+
+        # nothing changed
+        df_evaluations = self._evaluate(make_outputs(["q4", "q2", "q1"], ["a4", "a2 (v2)", "a1"]))
+        self.assertEqual(self.evaluated, [])
+        self.assertEqual(df_evaluations["instruction"].tolist(), ["q4", "q2", "q1"])
+
+    def test_repeated_rows_are_not_multiplied(self):
+        self._evaluate(make_outputs(["q1", "q1", "q2"], ["a1", "a1", "a2"]))
+        df_evaluations = self._evaluate(make_outputs(["q1", "q2", "q1", "q3"], ["a1", "a2", "a1", "a3"]))
+        self.assertEqual(self.evaluated, [("q3", "a3")])
+        self.assertEqual(df_evaluations["instruction"].tolist(), ["q1", "q2", "q1", "q3"])
+
+    def test_hash_column_only_in_incremental_mode(self):
+        df = make_outputs(["q1", "q2"], ["a1", "a2"])
+        df_evaluations, _ = main._evaluate(
+            df,
+            self.input_path,
+            self.output_path,
+            "test_evaluator",
+            criteria_table_path=None,
+            base_dir=self.dir / "evaluators_configs",
+        )
+        self.assertNotIn(EVALUATION_HASH_COLUMN, df_evaluations.columns)
+        self.assertNotIn(EVALUATION_HASH_COLUMN, df.columns)
+
+        df_evaluations, _ = main._evaluate(
+            df,
+            self.input_path,
+            self.output_path,
+            "test_evaluator",
+            is_incremental=True,
+            criteria_table_path=None,
+            base_dir=self.dir / "evaluators_configs",
+        )
+        self.assertIn(EVALUATION_HASH_COLUMN, df_evaluations.columns)
+        self.assertNotIn(EVALUATION_HASH_COLUMN, df.columns)
+
+    def test_previous_evaluations_without_hash_are_all_reevaluated(self):
+        self._evaluate(make_outputs(["q1", "q2"], ["a1", "a2"]), is_incremental=False)
+        df_evaluations = self._evaluate(make_outputs(["q1", "q2"], ["a1", "a2"]))
+        self.assertEqual(len(self.evaluated), 2)
+        self.assertIn(EVALUATION_HASH_COLUMN, df_evaluations.columns)
+
+
+class TestMergeIncrementalEvaluations(unittest.TestCase):
+    def test_merge(self):
+        df_input = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a", "b", "a", "c"]})
+        df_previous = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a", "a", "c"], "score": [1, 1, 3]})
+        df_new = pd.DataFrame({EVALUATION_HASH_COLUMN: ["b", "c"], "score": [2, 4]})
+        df_merged = _merge_incremental_evaluations(df_new, df_input=df_input, df_previous=df_previous)
+        self.assertEqual(df_merged[EVALUATION_HASH_COLUMN].tolist(), ["a", "b", "a", "c"])
+        # the new evaluations replace the previous ones
+        self.assertEqual(df_merged["score"].tolist(), [1, 2, 1, 4])
+
+    def test_missing_evaluations_are_reported(self):
+        df_input = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a", "b", "c"]})
+        df_previous = pd.DataFrame({EVALUATION_HASH_COLUMN: ["a"], "score": [1]})
+        df_new = pd.DataFrame({EVALUATION_HASH_COLUMN: ["c"], "score": [3]})
+        with self.assertLogs(main.logger, level="WARNING") as logs:
+            df_merged = _merge_incremental_evaluations(df_new, df_input=df_input, df_previous=df_previous)
+        self.assertEqual(df_merged[EVALUATION_HASH_COLUMN].tolist(), ["a", "c"])
+        self.assertIn("1 of the 3 rows", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import random
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from rubric_eval.artifacts import ArtifactStore
+from rubric_eval.completion_cache import get_completion_cache
+from rubric_eval.output_statistics import OUTPUT_STATISTICS, compute_output_statistics, get_outputs_statistics
+
+# patterns of `alpaca_eval.utils.contains_list`
+CONTAINS_LIST_PATTERNS = [
+    re.compile(r"^\s*[\*\•\-]\s*[^\w]*\w+", re.MULTILINE),
+    re.compile(r"^\s*\d+[\.\)]\s*[^\w]*\w+", re.MULTILINE),
+    re.compile(r"^\s*[a-zA-Z][\.\)]\s+[^\w]*\w+", re.MULTILINE),
+]
+
+
+def count_list_items(output):
+    return sum(len(pattern.findall(output)) for pattern in CONTAINS_LIST_PATTERNS)
+
+
+class TestComputeOutputStatistics(unittest.TestCase):
+    def test_statistics(self):
+        output = "# Plan\n## Steps\n1. Shop\n2. Cook\n- eat\n```py\nx = 1\n```\n| a | b |\n|---|---|\n| 1 | 2 |"
+        statistics = dict(zip(OUTPUT_STATISTICS, compute_output_statistics(output)))
+        self.assertEqual(statistics["n_chars"], len(output))
+        self.assertEqual(statistics["n_list_items"], 3)
+        self.assertEqual(statistics["has_list"], 1)
+        self.assertEqual(statistics["n_headers"], 2)
+        self.assertEqual(statistics["n_code_blocks"], 1)
+        self.assertEqual(statistics["n_table_rows"], 3)
+
+    def test_list_items_match_contains_list(self):
+        # list items whose matches span several lines or overlap across the patterns
+        for output in ["- \n1. item", "- \n- x", "\n\n- a\n  b) c", "1.\n\n2) b\nc. d", "a) - 1. x", ""]:
+            self.assertEqual(compute_output_statistics(output)[2], count_list_items(output), repr(output))
+
+        rng = random.Random(0)
+        pieces = ["-", "*", "•", "1", "12", ".", ")", "a", "b", " ", "\t", "\n", "\n\n", "#", "|", "```", "x", "- "]
+        for _ in range(20000):
+            output = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+            self.assertEqual(compute_output_statistics(output)[2], count_list_items(output), repr(output))
+
+
+class TestGetOutputsStatistics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_statistics_are_stored_per_output(self):
+        cache_path = self.dir / "output_statistics.sqlite"
+        df_statistics = get_outputs_statistics(["- a\n- b", None, "text", "- a\n- b"], cache=cache_path)
+        self.assertEqual(df_statistics["n_list_items"].iloc[[0, 2, 3]].tolist(), [2, 0, 2])
+        # missing outputs have no statistics
+        self.assertTrue(df_statistics.iloc[1].isna().all())
+        self.assertEqual(len(get_completion_cache(cache_path)), 2)
+
+        # a rerun with one new output only stores the new one, and reuses the stored statistics
+        get_outputs_statistics(["- a\n- b", "text", "# new"], cache=cache_path)
+        self.assertEqual(len(get_completion_cache(cache_path)), 3)
+
+    def test_other_stores_and_no_store(self):
+        store = ArtifactStore(self.dir / "artifacts")
+        df_statistics = get_outputs_statistics(["# title"], cache=store)
+        self.assertEqual(df_statistics["n_headers"].tolist(), [1])
+        self.assertEqual(len(list(store.artifacts_dir.rglob("*.json"))), 1)
+        self.assertEqual(get_outputs_statistics(["# title"], cache=None)["n_headers"].tolist(), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
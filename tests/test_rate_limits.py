@@ -0,0 +1,84 @@
+import json
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from rubric_eval.rate_limits import RateLimiter, fcntl, get_rate_limiter
+
+TOKENS_PER_MINUTE = 1e6
+
+
+def _acquire_many(lock_path, n_requests, n_tokens):
+    limiter = RateLimiter(tokens_per_minute=TOKENS_PER_MINUTE, lock_path=lock_path)
+    return sum(limiter.acquire(n_tokens) for _ in range(n_requests))
+
+
+@unittest.skipIf(fcntl is None, "File locks are not supported on this platform.")
+class TestRateLimiterFileLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.lock_path = Path(self.tmpdir.name) / "provider__model.json"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_budget_is_shared_through_the_lock_file(self):
+        # two limiters with the same lock file behave like two processes
+        limiter = RateLimiter(requests_per_minute=2, lock_path=self.lock_path)
+        other_limiter = RateLimiter(requests_per_minute=2, lock_path=self.lock_path)
+        self.assertEqual(limiter._try_consume(dict(requests=1.0)), 0.0)
+        self.assertEqual(other_limiter._try_consume(dict(requests=1.0)), 0.0)
+
+        # the bucket is empty for both, and refills at 2 requests per minute
+        self.assertGreater(other_limiter._try_consume(dict(requests=1.0)), 25)
+        self.assertGreater(limiter._try_consume(dict(requests=1.0)), 25)
+
+        # another lock file has its own budget
+        unrelated_limiter = RateLimiter(requests_per_minute=2, lock_path=Path(self.tmpdir.name) / "other.json")
+        self.assertEqual(unrelated_limiter._try_consume(dict(requests=1.0)), 0.0)
+
+    def test_concurrent_processes_dont_lose_updates(self):
+        n_processes, n_requests, n_tokens = 4, 25, 1000
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            waited = list(
+                executor.map(
+                    _acquire_many, [self.lock_path] * n_processes, [n_requests] * n_processes, [n_tokens] * n_processes
+                )
+            )
+        duration = time.time() - start
+        self.assertEqual(waited, [0.0] * n_processes)
+
+        # every request was counted: the bucket only refilled during the run
+        with open(self.lock_path) as f:
+            levels = json.load(f)["levels"]
+        consumed = n_processes * n_requests * n_tokens
+        max_refill = duration * TOKENS_PER_MINUTE / 60
+        self.assertLessEqual(levels["tokens"], TOKENS_PER_MINUTE - consumed + max_refill)
+
+    def test_waits_when_budget_is_used_by_another_process(self):
+        # the budget of 60 RPM (one request per second) is used by another process
+        other_limiter = RateLimiter(requests_per_minute=60, lock_path=self.lock_path)
+        for _ in range(60):
+            other_limiter.acquire()
+
+        limiter = RateLimiter(requests_per_minute=60, lock_path=self.lock_path)
+        start = time.time()
+        waited = limiter.acquire()
+        self.assertGreater(waited, 0.0)
+        self.assertGreaterEqual(time.time() - start, waited * 0.9)
+
+    def test_get_rate_limiter_uses_lock_dir(self):
+        limiter = get_rate_limiter(
+            "https://api.example.com/v1", "test-model", requests_per_minute=10, lock_dir=self.tmpdir.name
+        )
+        self.assertIs(limiter, get_rate_limiter("https://api.example.com/v1", "test-model", requests_per_minute=10))
+        self.assertEqual(limiter.lock_path.parent, Path(self.tmpdir.name))
+        limiter.acquire()
+        self.assertTrue(limiter.lock_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from rubric_eval.sweep import Task, run_dag
+
+
+class Recorder:
+    """Records the tasks that ran and writes their artifact."""
+
+    def __init__(self):
+        self.ran = []
+        self._lock = threading.Lock()
+
+    def make_fn(self, name, artifact_path=None, is_fail=False):
+        def fn():
+            with self._lock:
+                self.ran.append(name)
+            if is_fail:
+                raise RuntimeError(f"{name} failed")
+            if artifact_path is not None:
+                Path(artifact_path).write_text(name)
+
+        return fn
+
+
+class TestRunDag(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.recorder = Recorder()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _make_pipeline(self, model, failing=()):
+        """outputs -> evaluate -> report, each writing an artifact."""
+        tasks = []
+        previous = []
+        for stage in ["outputs", "evaluate", "report"]:
+            name = f"{stage}:{model}"
+            path = self.dir / f"{stage}_{model}.json"
+            tasks.append(Task(name, self.recorder.make_fn(name, path, name in failing), previous, artifact_path=path))
+            previous = [name]
+        return tasks
+
+    def test_skips_tasks_with_existing_artifacts(self):
+        tasks = self._make_pipeline("m1")
+        (self.dir / "outputs_m1.json").write_text("done")
+
+        statuses = run_dag(tasks, max_workers=2)
+        self.assertEqual(statuses, {"outputs:m1": "skipped", "evaluate:m1": "success", "report:m1": "success"})
+        self.assertEqual(self.recorder.ran, ["evaluate:m1", "report:m1"])
+
+    def test_rerun_skips_everything_that_is_done(self):
+        run_dag(self._make_pipeline("m1"), max_workers=2)
+        self.recorder.ran.clear()
+
+        statuses = run_dag(self._make_pipeline("m1"), max_workers=2)
+        self.assertEqual(set(statuses.values()), {"skipped"})
+        self.assertEqual(self.recorder.ran, [])
+
+    def test_is_skip_existing_false_reruns(self):
+        for stage in ["outputs", "evaluate", "report"]:
+            (self.dir / f"{stage}_m1.json").write_text("done")
+
+        statuses = run_dag(self._make_pipeline("m1"), max_workers=2, is_skip_existing=False)
+        self.assertEqual(set(statuses.values()), {"success"})
+        self.assertEqual(self.recorder.ran, ["outputs:m1", "evaluate:m1", "report:m1"])
+
+    def test_failure_only_skips_downstream_tasks(self):
+        tasks = self._make_pipeline("m1", failing=["evaluate:m1"]) + self._make_pipeline("m2")
+        statuses = run_dag(tasks, max_workers=2)
+        self.assertEqual(
+            statuses,
+            {
+                "outputs:m1": "success",
+                "evaluate:m1": "failed",
+                "report:m1": "upstream_failed",
+                "outputs:m2": "success",
+                "evaluate:m2": "success",
+                "report:m2": "success",
+            },
+        )
+        self.assertNotIn("report:m1", self.recorder.ran)
+
+    def test_task_starts_when_its_dependencies_are_done(self):
+        # the evaluation of a fast model doesn't wait for the outputs of a slow model
+        slow_started, fast_evaluated = threading.Event(), threading.Event()
+
+        def slow_outputs():
+            slow_started.set()
+            self.assertTrue(fast_evaluated.wait(timeout=10))
+
+        tasks = [
+            Task("outputs:slow", slow_outputs),
+            Task("outputs:fast", lambda: slow_started.wait(timeout=10)),
+            Task("evaluate:fast", fast_evaluated.set, ["outputs:fast"]),
+            Task("evaluate:slow", lambda: None, ["outputs:slow"]),
+        ]
+        statuses = run_dag(tasks, max_workers=2)
+        self.assertEqual(set(statuses.values()), {"success"})
+        self.assertTrue(fast_evaluated.is_set())
+
+    def test_invalid_dags(self):
+        with self.assertRaises(ValueError):
+            run_dag([Task("a", lambda: None), Task("a", lambda: None)])
+        with self.assertRaises(ValueError):
+            run_dag([Task("a", lambda: None, ["unknown"])])
+        with self.assertRaises(ValueError):
+            run_dag([Task("a", lambda: None, ["b"]), Task("b", lambda: None, ["a"])])
+
+
+if __name__ == "__main__":
+    unittest.main()